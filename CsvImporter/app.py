@@ -1,11 +1,34 @@
 # -*- coding: utf-8 -*-
 import logging
 from flask import Flask
+from CsvImporter.models.database import Session, WriteSession, configure_session
+from CsvImporter.utility.expiry_sweeper import ExpirySweeperThread
+from CsvImporter.utility.import_jobs import ImportJobRunner
+from CsvImporter.views.response_cache import ResponseCache
 from CsvImporter.views.views import main_view
 
 
 def create_app(config=None):
+    """
+    :param config: dict of Flask config, EXPIRY_SWEEP_INTERVAL in seconds starts ExpirySweeperThread
+    """
     flask_app = Flask(__name__, static_url_path='/static')
+    flask_app.config.update(config or {})
+    configure_session('web')
+    response_cache = ResponseCache()
+    flask_app.extensions['response_cache'] = response_cache
+    flask_app.extensions['import_jobs'] = ImportJobRunner(on_job_finished=lambda job: response_cache.clear())
+    if flask_app.config.get('EXPIRY_SWEEP_INTERVAL'):
+        expiry_sweeper = ExpirySweeperThread(flask_app.config['EXPIRY_SWEEP_INTERVAL'],
+                                             on_sweep=lambda expiry_sweep: response_cache.clear())
+        expiry_sweeper.start()
+        flask_app.extensions['expiry_sweeper'] = expiry_sweeper
+
+    @flask_app.teardown_appcontext
+    def remove_sessions(exception=None):
+        Session.remove()
+        WriteSession.remove()
+
     return flask_app
 
 
@@ -1,6 +1,8 @@
 import os
-from sqlalchemy import create_engine, MetaData, Column, Integer
+from sqlalchemy import create_engine, event, inspect, MetaData, Column, Integer
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 
 
@@ -20,9 +22,80 @@ naming_convention = {
 }
 
 
-engine = create_engine(
-    'sqlite+pysqlite:///{0}/csvimporter.db'.format(os.path.dirname(os.path.abspath(__file__))), convert_unicode=True)
+DATABASE_URL = 'sqlite+pysqlite:///{0}/csvimporter.db'.format(os.path.dirname(os.path.abspath(__file__)))
+
+# Engine profiles, pragmas are executed on every new connection. WAL journal lets web readers run while import
+# writes, negative cache_size is in KiB.
+ENGINE_PROFILES = {
+    'default': {
+        'pragmas': [],
+        'poolclass': NullPool,
+    },
+    'import': {
+        'pragmas': [
+            ('journal_mode', 'WAL'),
+            ('synchronous', 'NORMAL'),
+            ('cache_size', -256 * 1024),
+            ('mmap_size', 256 * 1024 * 1024),
+            ('temp_store', 'MEMORY'),
+            ('busy_timeout', 30000),
+        ],
+        'poolclass': NullPool,
+    },
+    'web': {
+        'pragmas': [
+            ('journal_mode', 'WAL'),
+            ('query_only', 'ON'),
+            ('cache_size', -64 * 1024),
+            ('mmap_size', 256 * 1024 * 1024),
+            ('temp_store', 'MEMORY'),
+            ('busy_timeout', 5000),
+        ],
+        'poolclass': QueuePool,
+        'pool_size': 5,
+        'connect_args': {'check_same_thread': False},
+    },
+}
+
+
+def create_profile_engine(profile, database_url=DATABASE_URL):
+    """
+    Method used for creating engine with connection pragmas and pool of the profile.
+    :param profile: key of ENGINE_PROFILES
+    :param database_url: string
+    :return: Engine
+    """
+    engine_profile = dict(ENGINE_PROFILES[profile])
+    pragmas = engine_profile.pop('pragmas')
+    profile_engine = create_engine(database_url, convert_unicode=True, **engine_profile)
+
+    @event.listens_for(profile_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+        cursor.close()
+
+    return profile_engine
+
+
+def configure_session(profile, database_url=DATABASE_URL):
+    """
+    Method used for binding Session to new engine of the profile, e.g. 'import' in importer and 'web' in Flask app.
+    :param profile: key of ENGINE_PROFILES
+    :param database_url: string
+    :return: Engine
+    """
+    profile_engine = create_profile_engine(profile, database_url)
+    Session.remove()
+    Session.configure(bind=profile_engine)
+    return profile_engine
+
+
+engine = create_profile_engine('default')
 Session = scoped_session(sessionmaker(autocommit=True, autoflush=False, bind=engine))
+# used for writes from web app, where Session is read-only
+WriteSession = scoped_session(sessionmaker(autocommit=True, autoflush=False, bind=engine))
 Base = declarative_base(cls=BaseModel)
 Base.metadata = MetaData(naming_convention=naming_convention)
 Base.query = Session.query_property()
@@ -33,4 +106,27 @@ def init_db():
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
     from CsvImporter.models import models
-    Base.metadata.create_all(bind=engine, checkfirst=True)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+    create_missing_columns()
+    create_missing_indexes()
+
+
+def create_missing_columns():
+    # create_all skips tables that already exist, so nullable columns added to existing models are created here
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing_columns:
+                engine.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+                    table.name, CreateColumn(column).compile(dialect=engine.dialect)))
+
+
+def create_missing_indexes():
+    # create_all skips tables that already exist, so indexes added to existing models are created here
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=engine)
\ No newline at end of file
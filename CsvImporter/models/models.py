@@ -1,4 +1,5 @@
-from sqlalchemy import Column, DateTime, Integer, UnicodeText, Unicode, ForeignKey
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String, UnicodeText, Unicode, ForeignKey, Index, \
+    UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base, Session
 from CsvImporter.utility.helper import StatusConstants
@@ -6,13 +7,19 @@ from CsvImporter.utility.helper import now
 
 
 class Device(Base):
-    name = Column(Unicode(32), nullable=True)
+    name = Column(Unicode(32), nullable=True, index=True)
     description = Column(UnicodeText, nullable=True)
-    code = Column(Unicode(30), nullable=True)
+    code = Column(Unicode(30), nullable=True, index=True)
     date_created = Column(DateTime, nullable=True, default=now())
     date_updated = Column(DateTime, nullable=True, default=now())
     expire_date = Column(DateTime, nullable=True)
-    status = Column(Integer, nullable=True)
+    status = Column(Integer, nullable=True, index=True)
+    fingerprint = Column(String(40), nullable=True)
+
+    __table_args__ = (
+        # expired rows of status are found in order of expire date by ExpirySweeper
+        Index('ix_device_status_expire_date', 'status', 'expire_date'),
+    )
 
     def set_status_from_name(self, status_name):
         self.status = StatusConstants.get_mapped_status()[status_name]
@@ -40,16 +47,21 @@ class Device(Base):
 
 
 class DeviceContent(Base):
-    name = Column(Unicode(100), nullable=True)
+    name = Column(Unicode(100), nullable=True, index=True)
     description = Column(UnicodeText, nullable=True)
     date_created = Column(DateTime, nullable=True, default=now())
     date_updated = Column(DateTime, nullable=True, default=now())
     expire_date = Column(DateTime, nullable=True)
-    status = Column(Integer, nullable=True)
+    status = Column(Integer, nullable=True, index=True)
     device_id = Column(ForeignKey('device.id', ondelete='SET NULL'), nullable=True, index=True)
+    fingerprint = Column(String(40), nullable=True)
 
     device = relationship('Device')
 
+    __table_args__ = (
+        Index('ix_devicecontent_status_expire_date', 'status', 'expire_date'),
+    )
+
     def set_status_from_name(self, status_name):
         self.status = StatusConstants.get_mapped_status()[status_name]
 
@@ -75,8 +87,158 @@ class DeviceContent(Base):
         return self.device.name if self.device_id else u'Invalid data'
 
 
+class StagedDevice(Base):
+    """
+    Device row loaded from CSV file by staged import, row_number is number of row in file. Staged rows are merged
+    into device table and deleted in the same transaction in which they were loaded.
+    """
+    row_number = Column(Integer, primary_key=True, autoincrement=False)
+    id = Column(Integer, nullable=False, index=True)
+    name = Column(Unicode(32), nullable=True)
+    description = Column(UnicodeText, nullable=True)
+    code = Column(Unicode(30), nullable=True)
+    expire_date = Column(DateTime, nullable=True)
+    status = Column(Integer, nullable=True)
+    fingerprint = Column(String(40), nullable=True)
+
+
+class StagedDeviceContent(Base):
+    """
+    DeviceContent row loaded from CSV file by staged import, device_ref is Device ID as written in file, device_id
+    is set to None when it does not match any Device after staged devices are merged.
+    """
+    row_number = Column(Integer, primary_key=True, autoincrement=False)
+    id = Column(Integer, nullable=False, index=True)
+    name = Column(Unicode(100), nullable=True)
+    description = Column(UnicodeText, nullable=True)
+    device_ref = Column(UnicodeText, nullable=True)
+    device_id = Column(Integer, nullable=True)
+    expire_date = Column(DateTime, nullable=True)
+    status = Column(Integer, nullable=True)
+    fingerprint = Column(String(40), nullable=True)
+
+
 class ImporterSettings(Base):
     csv_store_path = Column(UnicodeText, nullable=False, default=u'csv_store')
     device_file_name = Column(Unicode(100), nullable=False, default=u'devices.csv')
     content_file_name = Column(Unicode(100), nullable=False, default=u'content.csv')
     default_csv_delimiter = Column(Unicode(1), nullable=False, default=u',')
+    # NULL in databases created before expire dates were stored in UTC, until initialize_db converts them
+    expire_dates_utc = Column(Boolean, nullable=True, default=True)
+
+
+class ImportSource(Base):
+    """
+    Drop of Device and DeviceContent files imported by ImportScheduler every schedule_interval seconds. File with
+    empty name is not imported, empty file_format means format is detected from file content.
+    """
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(100), nullable=False, unique=True)
+    csv_store_path = Column(UnicodeText, nullable=False)
+    device_file_name = Column(Unicode(100), nullable=True)
+    content_file_name = Column(Unicode(100), nullable=True)
+    csv_delimiter = Column(Unicode(1), nullable=False, default=u',')
+    file_format = Column(Unicode(20), nullable=True)
+    schedule_interval = Column(Integer, nullable=False, default=3600)
+    enabled = Column(Boolean, nullable=False, default=True)
+    date_last_checked = Column(DateTime, nullable=True)
+
+
+class ImportedFile(Base):
+    """
+    State of CSV file after last import, used for skipping unchanged files and resuming appended ones.
+    content_hash is sha1 of first committed_offset bytes, committed_row_number is number of rows before that offset.
+    """
+    id = Column(Integer, primary_key=True)
+    file_path = Column(UnicodeText, nullable=False, unique=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Float, nullable=False)
+    content_hash = Column(String(40), nullable=False)
+    committed_offset = Column(Integer, nullable=False)
+    committed_row_number = Column(Integer, nullable=False)
+    date_updated = Column(DateTime, nullable=True)
+
+
+class ImportRun(Base):
+    """
+    Counters and timings of import of one CSV file, metrics is JSON written by ImportMetrics and error_summary is
+    JSON summary of RowErrorLog. Runs of ImportScheduler have source_id of ImportSource and file_date, modification
+    time of imported file, so that lag between file drop and its import is known.
+    """
+    id = Column(Integer, primary_key=True)
+    table_name = Column(Unicode(100), nullable=False, index=True)
+    file_path = Column(UnicodeText, nullable=False)
+    source_id = Column(Integer, nullable=True, index=True)
+    file_date = Column(DateTime, nullable=True)
+    status = Column(Unicode(20), nullable=False)
+    date_started = Column(DateTime, nullable=False)
+    date_finished = Column(DateTime, nullable=True)
+    rows_read = Column(Integer, nullable=False, default=0)
+    rows_inserted = Column(Integer, nullable=False, default=0)
+    rows_updated = Column(Integer, nullable=False, default=0)
+    rows_skipped_older = Column(Integer, nullable=False, default=0)
+    rows_skipped_unchanged = Column(Integer, nullable=False, default=0)
+    rows_rejected = Column(Integer, nullable=False, default=0)
+    metrics = Column(UnicodeText, nullable=True)
+    error_summary = Column(UnicodeText, nullable=True)
+
+    def get_duration(self):
+        return (self.date_finished - self.date_started).total_seconds() if self.date_finished else None
+
+    def get_rows_per_second(self):
+        duration = self.get_duration()
+        return self.rows_read / duration if duration else 0.0
+
+    def get_lag(self):
+        """
+        :return: seconds between modification of imported file and end of its import or None
+        """
+        if not self.date_finished or not self.file_date:
+            return None
+        return (self.date_finished - self.file_date).total_seconds()
+
+
+class ImportMetricTotal(Base):
+    """
+    Sum of metrics over all import runs of a table which are kept only in ImportRun.metrics JSON, e.g. name
+    'stage_seconds' and key 'parse'. Totals are updated when import run finishes, so that they are not summed from
+    JSON of every run.
+    """
+    id = Column(Integer, primary_key=True)
+    table_name = Column(Unicode(100), nullable=False)
+    name = Column(Unicode(50), nullable=False)
+    key = Column(Unicode(100), nullable=False)
+    value = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        UniqueConstraint('table_name', 'name', 'key'),
+    )
+
+
+class DashboardAggregate(Base):
+    """
+    Precomputed count of Device or DeviceContent rows, e.g. name 'device_status' and key '1' is number of enabled
+    devices. Counts are updated by importer in the same transactions as imported rows.
+    """
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50), nullable=False)
+    key = Column(Unicode(50), nullable=False)
+    value = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('name', 'key'),
+        Index('ix_dashboardaggregate_name_value', 'name', 'value'),
+    )
+
+
+class ExpirySweep(Base):
+    """
+    Run of ExpirySweeper which disabled at least one row, content_disabled includes content of disabled devices
+    counted in content_cascaded.
+    """
+    id = Column(Integer, primary_key=True)
+    date_started = Column(DateTime, nullable=False)
+    date_finished = Column(DateTime, nullable=False)
+    devices_disabled = Column(Integer, nullable=False, default=0)
+    content_disabled = Column(Integer, nullable=False, default=0)
+    content_cascaded = Column(Integer, nullable=False, default=0)
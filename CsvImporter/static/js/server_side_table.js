@@ -0,0 +1,47 @@
+// DataTables with server-side processing. Next page is requested with cursor of the last row of the current page,
+// so server can use keyset pagination instead of OFFSET.
+function serverSideTable(selector, url, recordsTotal, orderableColumns, firstPageCursor) {
+    var cursors = {};
+    var lastRequest = null;
+
+    function getPageKey(request, start) {
+        var order = request.order.length ? request.order[0].column + request.order[0].dir : '';
+        return [start, request.length, order, request.search.value].join('|');
+    }
+
+    if (firstPageCursor) {
+        cursors[getPageKey({order: [{column: 0, dir: 'asc'}], length: 10, search: {value: ''}}, 10)] = firstPageCursor;
+    }
+
+    return $(selector).DataTable({
+        serverSide: true,
+        processing: true,
+        searchDelay: 400,
+        deferLoading: recordsTotal,
+        columnDefs: [
+            {targets: orderableColumns, orderable: true},
+            {targets: '_all', orderable: false}
+        ],
+        ajax: {
+            url: url,
+            data: function (request) {
+                lastRequest = request;
+                var cursor = cursors[getPageKey(request, request.start)];
+                if (cursor) {
+                    request.after_id = cursor.id;
+                    if (cursor.value === null) {
+                        request.after_null = 1;
+                    } else {
+                        request.after_value = cursor.value;
+                    }
+                }
+            },
+            dataSrc: function (response) {
+                if (response.cursor) {
+                    cursors[getPageKey(lastRequest, lastRequest.start + lastRequest.length)] = response.cursor;
+                }
+                return response.data;
+            }
+        }
+    });
+}
@@ -0,0 +1,186 @@
+import sys
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, Integer
+
+EPOCH = datetime(1970, 1, 1)
+# stored in integer columns instead of None, outside of range of ids, statuses and epoch microseconds of valid dates
+NULL_INT = -sys.maxint - 1
+
+
+def datetime_to_epoch(value):
+    """
+    :param value: naive datetime or None
+    :return: integer, microseconds since epoch or NULL_INT
+    """
+    if value is None:
+        return NULL_INT
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def epoch_to_datetime(value):
+    """
+    :param value: integer, microseconds since epoch or NULL_INT
+    :return: naive datetime or None
+    """
+    if value == NULL_INT:
+        return None
+    return EPOCH + timedelta(microseconds=value)
+
+
+def is_newer_epoch(current_expire_date, new_expire_date):
+    """
+    Same as is_newer_expire_date for dates returned by datetime_to_epoch.
+    :param current_expire_date: integer
+    :param new_expire_date: integer
+    :return: boolean
+    """
+    return new_expire_date != NULL_INT and current_expire_date < new_expire_date
+
+
+class ColumnBatch(object):
+    """
+    Batch of parsed rows kept as typed column arrays instead of dict per row. Integer columns are kept in array of
+    longs, dates as microseconds since epoch in array of longs and strings UTF-8 encoded in lists with equal values
+    shared.
+    Rows are converted to positional statement parameters only when batch is written.
+    """
+    def __init__(self, table, column_names):
+        """
+        :param table: sqlalchemy Table of written model
+        :param column_names: names of parsed row keys, all must be columns of table
+        """
+        self.table = table
+        self.column_names = list(column_names)
+        self.int_columns = []
+        self.datetime_columns = []
+        self.string_columns = []
+        self.columns = {}
+        for name in self.column_names:
+            column_type = table.c[name].type
+            if isinstance(column_type, DateTime):
+                self.datetime_columns.append(name)
+                self.columns[name] = array('l')
+            elif isinstance(column_type, Integer):
+                self.int_columns.append(name)
+                self.columns[name] = array('l')
+            else:
+                self.string_columns.append(name)
+                self.columns[name] = []
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def append(self, parsed_row):
+        """
+        :param parsed_row: dict returned by CsvImporter.get_parsed_*_row
+        """
+        columns = self.columns
+        for name in self.int_columns:
+            value = parsed_row[name]
+            columns[name].append(NULL_INT if value is None else int(value))
+        for name in self.datetime_columns:
+            columns[name].append(datetime_to_epoch(parsed_row[name]))
+        strings = self.strings
+        for name in self.string_columns:
+            value = parsed_row[name]
+            if value is not None:
+                value = value.encode('utf-8')
+                value = strings.setdefault(value, value)
+            columns[name].append(value)
+
+    def extend(self, parsed_rows):
+        for parsed_row in parsed_rows:
+            self.append(parsed_row)
+
+    def get_value(self, name, index):
+        value = self.columns[name][index]
+        if name in self.datetime_columns:
+            return epoch_to_datetime(value)
+        if name in self.int_columns:
+            return None if value == NULL_INT else value
+        return value if value is None else value.decode('utf-8')
+
+    def get_row(self, index):
+        return ColumnBatchRow(self, index)
+
+    def execute(self, connection, statement, indexes, **extra_values):
+        """
+        Method used for executing insert or update statement for rows of batch with one executemany call. Parameters
+        are tuples taken from column arrays, no dict per row is created. Bind parameters of statement are named as
+        columns of batch, row_id is id of row.
+        :param connection: Connection in transaction, e.g. Session.connection()
+        :param statement: Core insert or update statement
+        :param indexes: list of row indexes
+        :param extra_values: values of bind parameters which are the same in every row, e.g. date_updated, scalar
+            defaults of columns missing in batch are added as Core would add them
+        """
+        dialect = connection.dialect
+        compiled = statement.compile(dialect=dialect, column_keys=self.column_names)
+        constants = dict(extra_values)
+        for column in getattr(compiled, 'insert_prefetch', ()):
+            if column.key not in constants and column.default is not None and column.default.is_scalar:
+                constants[column.key] = column.default.arg
+        value_getters = [self.get_value_getter(name, constants,
+                                               compiled.binds[name].type._cached_bind_processor(dialect))
+                         for name in compiled.positiontup]
+        connection.execute(unicode(compiled),
+                           [tuple(get_value(index) for get_value in value_getters) for index in indexes])
+
+    def get_value_getter(self, name, constants, bind_processor):
+        """
+        :param name: name of bind parameter
+        :param constants: dict {bind parameter name: value same in every row}
+        :param bind_processor: function converting value to DBAPI value or None
+        :return: function returning DBAPI value of bind parameter for row index
+        """
+        if name in constants:
+            value = bind_processor(constants[name]) if bind_processor else constants[name]
+            return lambda index: value
+        if name == 'row_id':
+            name = 'id'
+        column = self.columns[name]
+        if name in self.datetime_columns:
+            return lambda index: bind_processor(epoch_to_datetime(column[index]))
+        if name in self.int_columns:
+            return lambda index: None if column[index] == NULL_INT else column[index]
+        # UTF-8 encoded strings are bound as they are, SQLite stores them as text
+        return column.__getitem__
+
+
+class ColumnBatchRow(object):
+    """
+    Read-only mapping of column names to values of one row of ColumnBatch, e.g. for counting written rows in
+    dashboard aggregates.
+    """
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.batch.get_value(name, self.index)
+
+
+def iter_batches(table, parsed_rows, batch_size):
+    """
+    Generator splitting parsed rows into ColumnBatch of at most batch_size rows. Rows are appended as they come, so
+    no list of parsed row dicts is kept.
+    :param table: sqlalchemy Table of written model
+    :param parsed_rows: iterable of dicts with the same keys
+    :param batch_size: integer
+    :return: generator of ColumnBatch
+    """
+    batch = None
+    for parsed_row in parsed_rows:
+        if batch is None:
+            batch = ColumnBatch(table, parsed_row.keys())
+        batch.append(parsed_row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = None
+    if batch is not None:
+        yield batch
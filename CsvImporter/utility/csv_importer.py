@@ -1,18 +1,45 @@
 # -*- coding: utf8 -*
-import csv
+import argparse
+import cProfile
+import json
 import os
 import logging
+import pstats
+import sys
+import time
 import transaction
-from dateutil import parser
+from collections import OrderedDict, deque
+from itertools import izip
+from StringIO import StringIO
+from multiprocessing import Pool, cpu_count
+from sqlalchemy import bindparam, select
 from logging.handlers import TimedRotatingFileHandler
-from CsvImporter.models.database import Session
-from CsvImporter.models.models import ImporterSettings, Device, DeviceContent
+from CsvImporter.models.database import Session, configure_session
+from CsvImporter.models.models import ImporterSettings, Device, DeviceContent, ImportedFile, \
+    ImportRun
 from CsvImporter import get_root_folder
-from CsvImporter.utility.helper import StatusConstants, now
+from CsvImporter.utility.helper import StatusConstants, now, is_newer_expire_date, iter_chunks, get_row_fingerprint, \
+    get_row_id
+from CsvImporter.utility.validation_index import ValidationIndex
+from CsvImporter.utility.date_parser import DateParser
+from CsvImporter.utility.initialize_db import has_local_expire_dates
+from CsvImporter.utility.file_state import get_file_stat, get_prefix_hash, scan_complete_rows
+from CsvImporter.utility.parallel_import import get_chunk_ranges, parse_chunk, parse_range, imap_ordered
+from CsvImporter.utility.import_metrics import ImportMetrics, get_error_reason, save_metric_totals
+from CsvImporter.utility.row_error_log import BatchTimedRotatingFileHandler, RowErrorLog, get_error_kind
+from CsvImporter.utility.column_batch import datetime_to_epoch, is_newer_epoch, iter_batches
+from CsvImporter.utility.source_readers import CsvSourceReader, open_source
+from CsvImporter.utility.mmap_reader import MmapCsvReader
+from CsvImporter.utility.dashboard import AggregateDeltas, get_aggregated_columns, get_instance_values, \
+    has_aggregates, rebuild_aggregates
+from CsvImporter.utility.staged_import import STAGE_CHUNK_SIZE, STAGED_TABLES, clear_dangling_references, \
+    clear_staged_device_codes, clear_staged_rows, delete_superseded_rows, get_dangling_references, \
+    get_staged_devices, merge_staged_rows
 
-csv_import_errors_handler = TimedRotatingFileHandler(os.path.join(get_root_folder(), 'csv_import_errors/errors.log'),
-                                                     when='midnight',
-                                                     backupCount=365)
+csv_import_errors_handler = BatchTimedRotatingFileHandler(os.path.join(get_root_folder(),
+                                                                       'csv_import_errors/errors.log'),
+                                                          when='midnight',
+                                                          backupCount=365)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(funcName)s - %(message)s')
 csv_import_errors_handler.setLevel(logging.DEBUG)
 csv_import_errors_handler.setFormatter(formatter)
@@ -25,15 +52,74 @@ log_handler = TimedRotatingFileHandler(os.path.join(get_root_folder(), 'log/app.
 log_handler.setFormatter(formatter)
 log_handler.setLevel(logging.DEBUG)
 log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
 log.addHandler(log_handler)
 
+# SQLite limits number of bound parameters per statement to 999, so keep IN (...) lookups below it
+DEFAULT_BATCH_SIZE = 500
+SELECT_IDS_CHUNK_SIZE = 500
+DEFAULT_TRANSACTION_SIZE = 50000
+# progress is reported after every written chunk and every PROGRESS_BYTES read bytes
+PROGRESS_BYTES = 1024 * 1024
+
+# order of row columns, used for mapping of JSON objects to rows
+DEVICE_FIELDS = ('id', 'name', 'description', 'code', 'expire_date', 'status')
+DEVICE_CONTENT_FIELDS = ('id', 'name', 'description', 'device_id', 'expire_date', 'status')
+
+# rejected fields of one row are logged in order of these columns, under name of the method which checked whole row
+# before its parsing and validation were split, so that error log lines stay the same
+ROW_ERROR_COLUMNS = ('number_of_columns', 'id', 'name', 'description', 'code', 'device_id', 'expire_date', 'status')
+ROW_ERROR_FUNC_NAMES = {
+    'parse_device_row': 'get_parsed_device_row',
+    'validate_device_row': 'get_parsed_device_row',
+    'parse_device_content_row': 'get_parsed_device_content_row',
+    'validate_device_content_row': 'get_parsed_device_content_row',
+}
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+def get_row_error_position(row_error):
+    """
+    :param row_error: tuple (row number, message, args, name of function which rejected the field)
+    :return: integer, position of rejected column in ROW_ERROR_COLUMNS
+    """
+    column = get_error_kind(row_error[1])[1]
+    return ROW_ERROR_COLUMNS.index(column) if column in ROW_ERROR_COLUMNS else len(ROW_ERROR_COLUMNS)
+
 
 class CsvImporter(object):
-    def __init__(self, csv_store_path=None, device_file_name=None, content_file_name=None, default_csv_delimiter=None):
+    def __init__(self, csv_store_path=None, device_file_name=None, content_file_name=None, default_csv_delimiter=None,
+                 bulk_upsert=False, batch_size=DEFAULT_BATCH_SIZE, workers=1, incremental=False,
+                 transaction_size=DEFAULT_TRANSACTION_SIZE, write_error_log=True, use_mmap=False):
         self.csv_store_path = csv_store_path
         self.device_file_name = device_file_name
         self.content_file_name = content_file_name
         self.default_csv_delimiter = default_csv_delimiter
+        self.bulk_upsert = bulk_upsert
+        self.batch_size = batch_size
+        self.workers = workers
+        self.incremental = incremental
+        self.transaction_size = transaction_size
+        self.write_error_log = write_error_log
+        self.use_mmap = use_mmap
+        self.validation_index = None
+        self.date_parser = DateParser()
+        self.metrics = ImportMetrics()
+        self.error_log = None
+        # rejected fields of row being parsed and validated, they are logged together when the row is checked
+        self.row_errors = None
+        # changes of dashboard aggregates of written table, None when aggregates are not built yet
+        self.aggregate_deltas = None
+        # object with update(bytes_read, bytes_total, rows_read) and is_cancelled() methods, e.g. ImportJobProgress
+        self.progress = None
+        self.bytes_read = 0
+        self.bytes_total = None
+        self.next_progress_bytes = 0
+        # set when reading of file stopped on error, rows after the error were not imported
+        self.read_failed = False
 
     def set_settings(self):
         settings = Session.query(ImporterSettings).first()
@@ -42,33 +128,146 @@ class CsvImporter(object):
         self.content_file_name = settings.content_file_name
         self.default_csv_delimiter = settings.default_csv_delimiter
 
-    def utf_8_encoder(self, unicode_csv_data):
-        for line in unicode_csv_data:
-            yield line.encode('utf-8')
-
     def unicode_csv_reader(self, unicode_csv_data, delimiter, **kwargs):
-        # csv.py doesn't do Unicode; encode temporarily as UTF-8:
+        return self.read_source_lines(CsvSourceReader(delimiter, **kwargs), unicode_csv_data)
+
+    def read_source_lines(self, source_reader, lines):
+        """
+        Generator of rows read from lines by source reader.
+        :param source_reader: reader from source_readers, e.g. CsvSourceReader
+        :param lines: iterable of strings
+        :return: generator of rows(lists of unicode), stops on error
+        """
+        return self.read_until_error(source_reader.read_rows(lines))
+
+    def read_until_error(self, rows):
+        """
+        Generator of rows, reading stops when reader raises an error, error is logged and read_failed is set.
+        :param rows: iterable of rows
+        :return: generator of rows
+        """
         try:
-            csv_reader = csv.reader(self.utf_8_encoder(unicode_csv_data), delimiter=str(delimiter), **kwargs)
-            for row in csv_reader:
-                # decode UTF-8 back to Unicode, cell by cell:
-                yield [unicode(cell.strip(), 'utf-8') for cell in row]
+            for row in rows:
+                yield row
+        except ImportCancelled:
+            raise
         except Exception as e:
+            self.read_failed = True
             log.exception(u'Error when reading CSV {0}'.format(e))
 
-    def read_csv_file(self, file_name):
+    def get_validation_index(self):
+        if self.validation_index is None:
+            self.validation_index = ValidationIndex().load()
+        return self.validation_index
+
+    def get_file_path(self, file_name):
+        file_path = os.path.abspath(os.path.join(get_root_folder(), self.csv_store_path, file_name))
+        return file_path if isinstance(file_path, unicode) else file_path.decode(sys.getfilesystemencoding())
+
+    def read_source_rows(self, source, start_offset=0):
         """
-        Method used for reading rows of CSV file.
-        :param file_name: string
-        :return: list of rows(lists) or None for error
+        Generator of rows of source file. File is read and decompressed line by line or mapped into memory, so memory
+        use does not depend on file size.
+        :param source: Source returned by open_source
+        :param start_offset: integer, byte offset of first row to read, only for seekable sources
+        :return: generator of rows(lists), stops on error and sets read_failed
         """
-        file_path = os.path.abspath(os.path.join(get_root_folder(), self.csv_store_path, file_name))
+        self.bytes_read = start_offset
+        mmap_reader = self.get_mmap_reader(source)
         try:
-            with open(file_path) as f:
-                return [row for row in self.unicode_csv_reader(f, self.default_csv_delimiter)]
+            if mmap_reader:
+                for next_offset, row in mmap_reader.read_file_records(source.file_path, start_offset):
+                    yield row
+                    self.bytes_read = next_offset
+                    if next_offset >= self.next_progress_bytes:
+                        self.report_progress()
+                return
+            with source.open() as f:
+                if start_offset:
+                    f.seek(start_offset)
+                for row in self.read_source_lines(source.reader, self.count_read_bytes(f)):
+                    yield row
+        except ImportCancelled:
+            raise
         except Exception as e:
-            log.exception(u'Error when reading CSV file {0}: {1}'.format(file_name, e))
+            self.read_failed = True
+            log.exception(u'Error when reading CSV file {0}: {1}'.format(source.file_path, e))
+
+    def get_mmap_reader(self, source):
+        """
+        :param source: Source returned by open_source
+        :return: MmapCsvReader if memory mapped reading is on and source is uncompressed CSV file, otherwise None
+        """
+        if not self.use_mmap or not source.is_seekable:
             return None
+        return MmapCsvReader.from_source_reader(source.reader)
+
+    def count_read_bytes(self, lines):
+        for line in lines:
+            self.bytes_read += len(line)
+            if self.bytes_read >= self.next_progress_bytes:
+                self.report_progress()
+            yield line
+
+    def report_progress(self):
+        """
+        Method used for updating progress, raises ImportCancelled if import was cancelled.
+        """
+        self.next_progress_bytes = self.bytes_read + PROGRESS_BYTES
+        if self.progress:
+            self.progress.update(self.bytes_read, self.bytes_total, self.metrics.counters['rows_read'])
+            if self.progress.is_cancelled():
+                raise ImportCancelled()
+
+    def log_row_error(self, message, row_number, *args):
+        """
+        Method used for logging rejected CSV row field. Fields rejected while a row is parsed and validated are kept
+        until the row is checked, see log_row_errors.
+        :param message: unicode format string, {0} is row number and {1}... are args
+        :param row_number: integer
+        """
+        row_error = (row_number, message, args, sys._getframe(1).f_code.co_name)
+        if self.row_errors is not None:
+            self.row_errors.append(row_error)
+        else:
+            self.write_row_error(row_error)
+
+    def log_row_errors(self):
+        """
+        Method used for logging fields rejected by parsing and validation of one row in order of its columns.
+        """
+        row_errors, self.row_errors = self.row_errors, None
+        if len(row_errors) > 1:
+            row_errors.sort(key=get_row_error_position)
+        for row_error in row_errors:
+            self.write_row_error(row_error)
+
+    def write_row_error(self, row_error):
+        """
+        Method used for writing rejected field. During import run it is added to buffered error log of the run,
+        otherwise it is logged right away.
+        :param row_error: tuple (row number, message, args, name of function which rejected the field)
+        """
+        row_number, message, args, func_name = row_error
+        func_name = ROW_ERROR_FUNC_NAMES.get(func_name, func_name)
+        self.metrics.add_rejection(get_error_reason(message))
+        if self.error_log:
+            self.error_log.add(message, row_number, args, func_name)
+        elif csv_error_logger.isEnabledFor(logging.ERROR):
+            csv_error_logger.handle(csv_error_logger.makeRecord(csv_error_logger.name, logging.ERROR, __file__, 0,
+                                                                message.format(row_number, *args), None, None,
+                                                                func=func_name))
+
+    def parse_expire_date(self, value):
+        """
+        :param value: string
+        :return: datetime, raises ValueError for invalid date
+        """
+        start_time = time.time()
+        try:
+            return self.date_parser.parse(value)
+        finally:
+            self.metrics.add_time('parse_dates', time.time() - start_time)
 
     def get_parsed_device_row(self, row, row_number):
         """
@@ -81,57 +280,62 @@ class CsvImporter(object):
             'description': string or None for invalid data,
             'code': string or None for invalid data,
             'expire_date': datetime or None for invalid data,
-            'status': integer or None for invalid data
+            'status': integer or None for invalid data,
+            'fingerprint': sha1 of CSV row data
         } or None for error
         """
+        parsed_row = self.parse_device_row(row, row_number)
+        if not parsed_row:
+            return None
+        return self.validate_device_row(parsed_row, row_number)
+
+    def parse_device_row(self, row, row_number):
+        """
+        Method used for parsing Device CSV row without checks against existing data, safe to run in worker process.
+        :param row: CSV Device data row, list
+        :param row_number: integer
+        :return: dict, same as get_parsed_device_row, or None for error
+        """
 
         if len(row) < 6:
-            csv_error_logger.error(u'Device row {0} has invalid number of columns'.format(row_number))
+            self.log_row_error(u'Device row {0} has invalid number of columns', row_number)
             return None
 
         try:
             device_id = str(row[0])
             if not device_id.isdigit():
-                csv_error_logger.error(u'Device in row {0} has invalid ID: {1}'.format(row_number, row[0]))
+                self.log_row_error(u'Device in row {0} has invalid ID: {1}', row_number, row[0])
                 return None
         except Exception as e:
-            csv_error_logger.error(u'Device in row {0} has invalid ID: {1}'.format(row_number, e))
+            self.log_row_error(u'Device in row {0} has invalid ID: {1}', row_number, e)
             return None
 
-        device_name = row[1]
+        device_name = unicode(row[1])
         name_len = len(device_name)
         if name_len > 32 or name_len < 1:
-            csv_error_logger.error(u'Device in row {0} has invalid name: {1}'.format(row_number, device_name))
+            self.log_row_error(u'Device in row {0} has invalid name: {1}', row_number, device_name)
             device_name = None
 
-        device_description = row[2]
+        device_description = unicode(row[2])
         if len(device_description) < 1:
-            csv_error_logger.error(u'Device in row {0} has invalid description: {1}'.format(row_number,
-                                                                                            device_description))
+            self.log_row_error(u'Device in row {0} has invalid description: {1}', row_number, device_description)
             device_description = None
 
-        device_code = row[3]
+        device_code = unicode(row[3])
         if len(device_code) > 30:
-            csv_error_logger.error(u'Device in row {0} has invalid code: {1}'.format(row_number, device_code))
+            self.log_row_error(u'Device in row {0} has invalid code: {1}', row_number, device_code)
             device_code = None
 
-        if device_code:
-            code_exists = Session.query(Device).filter(Device.code == device_code).first()
-            if code_exists:
-                csv_error_logger.error(
-                    u'Code for device in row {0} has duplicate code: {1}'.format(row_number, device_code))
-                device_code = None
-
         try:
-            device_expire_date = parser.parse(row[4])
+            device_expire_date = self.parse_expire_date(row[4])
         except Exception as e:
-            csv_error_logger.error(u'Device in row {0} has invalid expire date: {1}'.format(row_number, row[4]))
+            self.log_row_error(u'Device in row {0} has invalid expire date: {1}', row_number, row[4])
             device_expire_date = None
 
         status_name = row[5]
         device_status = StatusConstants.get_mapped_status().get(status_name, None)
         if not device_status:
-            csv_error_logger.error(u'Device in row {0} has invalid status: {1}'.format(row_number, status_name))
+            self.log_row_error(u'Device in row {0} has invalid status: {1}', row_number, status_name)
             device_status = None
 
         return {
@@ -140,9 +344,38 @@ class CsvImporter(object):
             'description': device_description,
             'code': device_code,
             'expire_date': device_expire_date,
-            'status': device_status
+            'status': device_status,
+            'fingerprint': get_row_fingerprint(row)
         }
 
+    def validate_device_row(self, parsed_row, row_number):
+        """
+        Method used for checking parsed Device row against validation index, duplicate code is set to None.
+        Code is reserved in the index until the row is written, see release_device_codes.
+        :param parsed_row: dict returned by parse_device_row
+        :param row_number: integer
+        :return: dict
+        """
+        validation_index = self.get_validation_index()
+        if parsed_row['code'] and validation_index.has_device_code(parsed_row['code']):
+            self.log_row_error(u'Code for device in row {0} has duplicate code: {1}', row_number, parsed_row['code'])
+            parsed_row['code'] = None
+
+        validation_index.add_device(parsed_row['id'], parsed_row['code'])
+        return parsed_row
+
+    def release_device_codes(self, codes):
+        """
+        Method used for removing codes which are not stored from validation index after Device rows were written:
+        codes of rows skipped as older or superseded in chunk and codes replaced by update, so that later rows may use
+        them.
+        :param codes: iterable of unicode or None
+        """
+        validation_index = self.get_validation_index()
+        for code in codes:
+            if code:
+                validation_index.discard_device_code(code)
+
     def get_parsed_device_content_row(self, row, row_number):
         """
         Method used for getting dict of DeviceContent data from CSV row.
@@ -154,133 +387,939 @@ class CsvImporter(object):
             'description': string or None for invalid data,
             'device_id': Device.id or None for invalid data,
             'expire_date': datetime or None for invalid data,
-            'status': integer or None for invalid data
+            'status': integer or None for invalid data,
+            'fingerprint': sha1 of CSV row data
         } or None for error
         """
+        parsed_row = self.parse_device_content_row(row, row_number)
+        if not parsed_row:
+            return None
+        return self.validate_device_content_row(parsed_row, row_number)
+
+    def parse_device_content_row(self, row, row_number):
+        """
+        Method used for parsing DeviceContent CSV row without checks against existing data, safe to run in worker
+        process.
+        :param row: CSV DeviceContent data row, list
+        :param row_number: integer
+        :return: dict, same as get_parsed_device_content_row, or None for error
+        """
 
         if len(row) < 6:
-            csv_error_logger.error(u'Device content row {0} has invalid number of columns'.format(row_number))
+            self.log_row_error(u'Device content row {0} has invalid number of columns', row_number)
             return None
 
         try:
             device_content_id = str(row[0].strip())
             if not device_content_id.isdigit():
-                csv_error_logger.error(u'Device content in row {0} has invalid ID: {1}'.format(row_number, row[0]))
+                self.log_row_error(u'Device content in row {0} has invalid ID: {1}', row_number, row[0])
                 return None
         except Exception as e:
-            csv_error_logger.error(u'Device content in row {0} has invalid ID: {1}'.format(row_number, e))
+            self.log_row_error(u'Device content in row {0} has invalid ID: {1}', row_number, e)
             return None
 
-        device_content_name = row[1]
+        device_content_name = unicode(row[1])
         name_len = len(device_content_name)
         if name_len > 100 or name_len < 1:
-            csv_error_logger.error(u'Device in row {0} has invalid name: {1}'.format(row_number, device_content_name))
+            self.log_row_error(u'Device in row {0} has invalid name: {1}', row_number, device_content_name)
             device_content_name = None
 
-        device_content_description = row[2]
+        device_content_description = unicode(row[2])
         if len(device_content_description) < 1:
-            csv_error_logger.error(u'Device in row {0} has invalid description: {1}'.format(row_number,
-                                                                                            device_content_description))
+            self.log_row_error(u'Device in row {0} has invalid description: {1}', row_number,
+                               device_content_description)
             device_content_description = None
 
-        device_id = row[3]
-        device = Session.query(Device).filter(Device.id == device_id).first()
-        if not device:
-            csv_error_logger.error(u'Device content in row {0} has invalid Device ID: {1}'.format(row_number,                                                       device_id))
-            device_id = None
-
         try:
-            device_content_expire_date = parser.parse(row[4])
+            device_content_expire_date = self.parse_expire_date(row[4])
         except Exception as e:
-            csv_error_logger.error(u'Device content in row {0} has invalid expire date: {1}'.format(row_number, row[4]))
+            self.log_row_error(u'Device content in row {0} has invalid expire date: {1}', row_number, row[4])
             device_content_expire_date = None
 
         status_name = row[5]
         device_content_status = StatusConstants.get_mapped_status().get(status_name, None)
         if not device_content_status:
-            csv_error_logger.error(u'Device content in row {0} has invalid status: {1}'.format(row_number, status_name))
+            self.log_row_error(u'Device content in row {0} has invalid status: {1}', row_number, status_name)
             device_content_status = None
 
         return {
             'id': device_content_id,
             'name': device_content_name,
             'description': device_content_description,
-            'device_id': device_id,
+            'device_id': row[3],
             'expire_date': device_content_expire_date,
-            'status': device_content_status
+            'status': device_content_status,
+            'fingerprint': get_row_fingerprint(row)
         }
 
-    def import_devices_data(self):
+    def validate_device_content_row(self, parsed_row, row_number):
         """
-        Method used for importing Device data from CSV file.
+        Method used for checking parsed DeviceContent row against validation index, unknown Device ID is set to None.
+        :param parsed_row: dict returned by parse_device_content_row
+        :param row_number: integer
+        :return: dict
+        """
+        if not self.get_validation_index().has_device_id(parsed_row['device_id']):
+            self.log_row_error(u'Device content in row {0} has invalid Device ID: {1}', row_number,
+                               parsed_row['device_id'])
+            parsed_row['device_id'] = None
+        return parsed_row
+
+    def get_parsed_rows(self, numbered_rows, parse_row, validate_row):
+        """
+        Generator of parsed and validated rows, invalid rows are skipped.
+        :param numbered_rows: iterable of tuples (row number, CSV row), row numbers count every CSV row
+        :param parse_row: method used for parsing single row
+        :param validate_row: method used for validating parsed row
+        :return: generator of dicts
+        """
+        for row_number, row in numbered_rows:
+            self.row_errors = []
+            start_time = time.time()
+            parsed_row = parse_row(row, row_number)
+            parsed_time = time.time()
+            self.metrics.add_time('parse', parsed_time - start_time)
+            if parsed_row:
+                parsed_row = validate_row(parsed_row, row_number)
+                self.metrics.add_time('validate', time.time() - parsed_time)
+            else:
+                self.metrics.increment('rows_rejected')
+            self.log_row_errors()
+            if parsed_row:
+                yield parsed_row
+
+    def get_parsed_rows_parallel(self, source, model, parse_method_name, validate_row, start_offset=0,
+                                 start_row_number=1):
+        """
+        Generator of parsed rows, same as get_parsed_rows but rows are parsed in worker processes.
+        Results are validated and yielded in file order, so rows are written in the same order and errors are logged
+        with the same row numbers as in sequential import.
+        :param source: uncompressed Source returned by open_source
+        :param model: Device or DeviceContent
+        :param parse_method_name: name of ChunkRowParser method used for parsing single row
+        :param validate_row: method used for validating parsed row
+        :param start_offset: integer, byte offset of first row to read
+        :param start_row_number: integer, number of first row
+        :return: generator of dicts
+        """
+        try:
+            chunk_ranges = get_chunk_ranges(source.file_path, start_offset)
+        except Exception as e:
+            self.read_failed = True
+            log.exception(u'Error when reading CSV file {0}: {1}'.format(source.file_path, e))
+            return
+
+        source_reader = self.get_mmap_reader(source) or source.reader
+        tasks = ((ChunkRowParser, parse_method_name, source.file_path, source_reader, start, end)
+                 for start, end in chunk_ranges)
+        pool = Pool(self.workers)
+        try:
+            chunk_results = self.get_aligned_chunk_results(
+                source.file_path, source_reader, parse_method_name, start_offset, chunk_ranges,
+                imap_ordered(pool, parse_chunk, tasks, self.workers * 2))
+            for parsed_row in self.get_validated_chunk_rows(model, chunk_results, validate_row, start_row_number):
+                yield parsed_row
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    def get_aligned_chunk_results(self, file_path, source_reader, parse_method_name, start_offset, chunk_ranges,
+                                  chunk_results):
+        """
+        Generator of chunk results of consecutive records. Chunk which did not start where records of previous chunk
+        ended, because quoted field of its last record continued on the first line of the chunk, is parsed again from
+        the end of that record in this process.
+        :param file_path: string, path of uncompressed file
+        :param source_reader: reader of Source or MmapCsvReader
+        :param parse_method_name: name of ChunkRowParser method used for parsing single row
+        :param start_offset: integer, byte offset of first row
+        :param chunk_ranges: list of tuples (start, end)
+        :param chunk_results: iterable of tuples returned by parse_chunk for chunk ranges
+        :return: generator of chunk results, see parse_range
+        """
+        next_offset = start_offset
+        for (start, end), (first_offset, chunk_next_offset, chunk_result) in izip(chunk_ranges, chunk_results):
+            if first_offset != next_offset:
+                first_offset, chunk_next_offset, chunk_result = parse_range(
+                    ChunkRowParser, parse_method_name, file_path, source_reader, next_offset, end)
+            next_offset = chunk_next_offset
+            self.bytes_read = end
+            yield chunk_result
+
+    def get_validated_chunk_rows(self, model, chunk_results, validate_row, start_row_number=1):
+        """
+        Generator of rows parsed in chunks by other processes, validated and yielded in file order. Rejected fields
+        of chunk are logged between its rows in row number order. Rows stop after chunk whose reading failed.
+        :param model: Device or DeviceContent
+        :param chunk_results: iterable of consecutive chunks of file, tuples returned by parse_rows
+        :param validate_row: method used for validating parsed row
+        :param start_row_number: integer, number of first row of the first chunk
+        :return: generator of dicts
+        """
+        row_offset = start_row_number - 1
+        for rows_count, parsed_rows, row_errors, timings, read_failed in chunk_results:
+            for stage, seconds in timings.items():
+                self.metrics.add_time(stage, seconds)
+            self.metrics.increment('rows_read', rows_count)
+            self.metrics.increment('rows_rejected', rows_count - len(parsed_rows))
+            unchanged_row_numbers = self.get_unchanged_row_numbers(model, parsed_rows) \
+                if self.incremental else set()
+            row_errors = deque(row_errors)
+            for row_number, parsed_row in parsed_rows:
+                while row_errors and row_errors[0][0] < row_number:
+                    self.log_chunk_row_error(row_errors.popleft(), row_offset, unchanged_row_numbers)
+                if row_number in unchanged_row_numbers:
+                    continue
+                # fields rejected by parsing of the row are logged together with fields rejected by its validation
+                self.row_errors = []
+                while row_errors and row_errors[0][0] == row_number:
+                    chunk_row_number, message, args, func_name = row_errors.popleft()
+                    self.row_errors.append((row_offset + chunk_row_number, message, args, func_name))
+                start_time = time.time()
+                parsed_row = validate_row(parsed_row, row_offset + row_number)
+                self.metrics.add_time('validate', time.time() - start_time)
+                self.log_row_errors()
+                yield parsed_row
+            while row_errors:
+                self.log_chunk_row_error(row_errors.popleft(), row_offset, unchanged_row_numbers)
+            if read_failed:
+                self.read_failed = True
+                return
+            row_offset += rows_count
+
+    def log_chunk_row_error(self, row_error, row_offset, unchanged_row_numbers):
+        row_number, message, args, func_name = row_error
+        if row_number not in unchanged_row_numbers:
+            self.write_row_error((row_offset + row_number, message, args, func_name))
+
+    def get_stored_fingerprints(self, model, row_ids):
+        """
+        :param model: Device or DeviceContent
+        :param row_ids: set of integers
+        :return: dict {id: fingerprint}
+        """
+        if not row_ids:
+            return {}
+        return dict(Session.query(model.id, model.fingerprint).filter(model.id.in_(row_ids)))
+
+    def skip_unchanged_rows(self, model, numbered_rows):
+        """
+        Generator of CSV rows without rows whose fingerprint matches fingerprint of stored row, so that they are not
+        parsed at all. Fingerprints are loaded with one query per batch_size rows.
+        :param model: Device or DeviceContent
+        :param numbered_rows: iterable of tuples (row number, CSV row)
+        :return: generator of tuples (row number, CSV row)
+        """
+        for chunk in iter_chunks(numbered_rows, self.batch_size):
+            start_time = time.time()
+            row_ids = [get_row_id(row) for row_number, row in chunk]
+            stored_fingerprints = self.get_stored_fingerprints(model, set(row_ids) - {None})
+            changed_rows = []
+            for row_id, (row_number, row) in zip(row_ids, chunk):
+                if row_id is not None and stored_fingerprints.get(row_id) == get_row_fingerprint(row):
+                    continue
+                changed_rows.append((row_number, row))
+            self.metrics.increment('rows_skipped_unchanged', len(chunk) - len(changed_rows))
+            self.metrics.add_time('skip_unchanged', time.time() - start_time)
+            for numbered_row in changed_rows:
+                yield numbered_row
+
+    def get_unchanged_row_numbers(self, model, numbered_parsed_rows):
+        """
+        :param model: Device or DeviceContent
+        :param numbered_parsed_rows: list of tuples (row number, parsed row)
+        :return: set of row numbers whose fingerprint matches fingerprint of stored row
+        """
+        start_time = time.time()
+        stored_fingerprints = self.get_stored_fingerprints(
+            model, set(int(parsed_row['id']) for row_number, parsed_row in numbered_parsed_rows))
+        unchanged_row_numbers = set(row_number for row_number, parsed_row in numbered_parsed_rows
+                                    if stored_fingerprints.get(int(parsed_row['id'])) == parsed_row['fingerprint'])
+        self.metrics.increment('rows_skipped_unchanged', len(unchanged_row_numbers))
+        self.metrics.add_time('skip_unchanged', time.time() - start_time)
+        return unchanged_row_numbers
+
+    def get_import_start(self, imported_file, file_path, file_size, file_mtime, resumable=True):
         """
-        csv_file_rows = self.read_csv_file(self.device_file_name)
-        if not csv_file_rows:
+        Method used for finding where import of CSV file should start, based on state saved after last import.
+        :param imported_file: ImportedFile or None
+        :param file_path: string
+        :param file_size: integer
+        :param file_mtime: float
+        :param resumable: boolean, False for compressed files, which are always imported from the start
+        :return: tuple (start offset, start row number) or None if file did not change since last import
+        """
+        if not imported_file:
+            return 0, 1
+        if imported_file.size == file_size and imported_file.mtime == file_mtime:
             return None
+        if not resumable:
+            return 0, 1
 
-        for index, row in enumerate(csv_file_rows, start=1):
-            parsed_row = self.get_parsed_device_row(row, index)
-            if not parsed_row:
+        if file_size >= imported_file.committed_offset and \
+                get_prefix_hash(file_path, imported_file.committed_offset) == imported_file.content_hash:
+            if file_size == imported_file.committed_offset:
+                # only modification time changed
+                imported_file.mtime = file_mtime
+                Session.flush()
+                return None
+            return imported_file.committed_offset, imported_file.committed_row_number + 1
+        return 0, 1
+
+    def save_file_state(self, imported_file, file_path, file_size, file_mtime):
+        """
+        Method used for saving state of imported CSV file. Only rows which were in file when import started are
+        committed.
+        :param imported_file: ImportedFile or None
+        :param file_path: string
+        :param file_size: integer, size of file when import started
+        :param file_mtime: float
+        """
+        committed_offset, content_hash, rows_count = scan_complete_rows(file_path, file_size)
+        if not imported_file:
+            imported_file = ImportedFile()
+            imported_file.file_path = file_path
+            Session.add(imported_file)
+        imported_file.size = file_size
+        imported_file.mtime = file_mtime
+        imported_file.content_hash = content_hash
+        imported_file.committed_offset = committed_offset
+        imported_file.committed_row_number = rows_count
+        imported_file.date_updated = now()
+        Session.flush()
+
+    def upsert_chunk(self, model, batch):
+        """
+        Method used for writing chunk of parsed rows with one select and executemany insert and update statements.
+        Rows are written from ColumnBatch with Core statements, no ORM instances are created.
+        Existing rows are updated only if new expire date is newer, same as in row by row import.
+        :param model: Device or DeviceContent
+        :param batch: ColumnBatch of parsed rows
+        :return: tuple (number of inserted rows, number of updated rows)
+        """
+        table = model.__table__
+        expire_dates = batch.columns['expire_date']
+        pending_indexes = OrderedDict()
+        for index, row_id in enumerate(batch.columns['id']):
+            pending_index = pending_indexes.get(row_id)
+            if pending_index is not None and not is_newer_epoch(expire_dates[pending_index], expire_dates[index]):
                 continue
-            device = Session.query(Device)\
-                .filter(Device.id == parsed_row['id'])\
-                .first()
-            if device:
-                if device.expire_date < parsed_row['expire_date']:
-                    device.code = parsed_row['code']
-                    device.name = parsed_row['name']
-                    device.description = parsed_row['description']
-                    device.expire_date = parsed_row['expire_date']
-                    device.status = parsed_row['status']
-                    device.date_updated = now()
-                    Session.flush()
-            else:
-                device = Device()
-                device.id = parsed_row['id']
+            pending_indexes[row_id] = index
+
+        column_names = ['id', 'expire_date']
+        if model is Device:
+            column_names.append('code')
+        if self.aggregate_deltas:
+            column_names += [name for name in get_aggregated_columns(table.name) if name not in column_names]
+        existing_rows = {}
+        # IDs are selected in chunks, IN list of large batch_size costs more memory than the batch itself
+        for row_ids in iter_chunks(pending_indexes.keys(), SELECT_IDS_CHUNK_SIZE):
+            existing_rows.update((row['id'], row) for row in Session.execute(
+                select([table.c[name] for name in column_names]).where(table.c.id.in_(row_ids))))
+        insert_indexes = []
+        update_indexes = []
+        for row_id, index in pending_indexes.items():
+            if row_id not in existing_rows:
+                insert_indexes.append(index)
+            elif is_newer_epoch(datetime_to_epoch(existing_rows[row_id]['expire_date']), expire_dates[index]):
+                update_indexes.append(index)
+
+        with Session.begin(subtransactions=True):
+            if insert_indexes:
+                batch.execute(Session.connection(), table.insert(), insert_indexes)
+                if self.aggregate_deltas:
+                    for index in insert_indexes:
+                        self.aggregate_deltas.add(batch.get_row(index))
+            if update_indexes:
+                update_names = [name for name in batch.column_names if name != 'id'] + ['date_updated']
+                batch.execute(Session.connection(),
+                              table.update().where(table.c.id == bindparam('row_id'))
+                              .values(dict((name, bindparam(name)) for name in update_names)),
+                              update_indexes, date_updated=now())
+                if self.aggregate_deltas:
+                    for index in update_indexes:
+                        self.aggregate_deltas.replace(existing_rows[batch.columns['id'][index]], batch.get_row(index))
+        if model is Device:
+            written_indexes = set(insert_indexes).union(update_indexes)
+            self.release_device_codes(batch.get_value('code', index) for index in xrange(len(batch))
+                                      if index not in written_indexes)
+            self.release_device_codes(existing_rows[batch.columns['id'][index]]['code'] for index in update_indexes)
+        return len(insert_indexes), len(update_indexes)
+
+    def write_rows(self, model, parsed_rows, write_row):
+        """
+        Method used for writing parsed rows in chunks of batch_size, with bulk upsert or row by row.
+        Rows are committed in transactions of transaction_size rows instead of one transaction per statement.
+        :param model: Device or DeviceContent
+        :param parsed_rows: iterable of dicts
+        :param write_row: method used for writing single parsed row when bulk upsert is off, returns one of
+            'inserted', 'updated' or 'skipped_older'
+        :return: number of written rows
+        """
+        rows_count = 0
+        uncommitted_rows_count = 0
+        if has_aggregates(Session, model.__tablename__):
+            self.aggregate_deltas = AggregateDeltas(model.__tablename__)
+        Session.begin(subtransactions=True)
+        try:
+            for chunk in self.iter_write_chunks(model, parsed_rows):
+                start_time = time.time()
+                if self.bulk_upsert:
+                    inserted_count, updated_count = self.upsert_chunk(model, chunk)
+                    self.metrics.increment('rows_inserted', inserted_count)
+                    self.metrics.increment('rows_updated', updated_count)
+                    self.metrics.increment('rows_skipped_older', len(chunk) - inserted_count - updated_count)
+                else:
+                    for parsed_row in chunk:
+                        self.metrics.increment('rows_' + write_row(parsed_row))
+                write_time = time.time() - start_time
+                self.metrics.add_time('write', write_time)
+                self.metrics.observe_batch_write(write_time)
+                rows_count += len(chunk)
+                uncommitted_rows_count += len(chunk)
+                self.report_progress()
+                if uncommitted_rows_count >= self.transaction_size:
+                    self.commit()
+                    Session.begin(subtransactions=True)
+                    uncommitted_rows_count = 0
+            self.commit()
+        except BaseException:
+            Session.rollback()
+            raise
+        finally:
+            self.aggregate_deltas = None
+        return rows_count
+
+    def iter_write_chunks(self, model, parsed_rows):
+        """
+        Method used for splitting parsed rows into chunks of batch_size. Bulk upsert chunks are ColumnBatch filled row
+        by row, so parsed row dicts are not kept until chunk is written.
+        :param model: Device or DeviceContent
+        :param parsed_rows: iterable of dicts
+        :return: generator of ColumnBatch with bulk upsert, generator of lists of dicts otherwise
+        """
+        if self.bulk_upsert:
+            return iter_batches(model.__table__, parsed_rows, self.batch_size)
+        return iter_chunks(parsed_rows, self.batch_size)
+
+    def commit(self):
+        """
+        Method used for committing written rows together with changes of dashboard aggregates they caused.
+        """
+        start_time = time.time()
+        if self.aggregate_deltas:
+            self.aggregate_deltas.apply(Session)
+        Session.commit()
+        self.metrics.add_time('commit', time.time() - start_time)
+
+    def build_aggregates(self, model):
+        """
+        Method used for building dashboard aggregates of table from all its rows, e.g. before first import which
+        counts rows incrementally.
+        :param model: Device or DeviceContent
+        """
+        if has_aggregates(Session, model.__tablename__):
+            return
+        with Session.begin(subtransactions=True):
+            rebuild_aggregates(Session, model)
+
+    def log_import_rate(self, file_name, rows_count, start_time, mode_name=None):
+        elapsed = time.time() - start_time
+        log.info(u'Imported {0} rows from {1} in {2:.2f}s ({3:.0f} rows/sec, {4})'.format(
+            rows_count, file_name, elapsed, rows_count / elapsed if elapsed else 0,
+            mode_name or (u'bulk upsert' if self.bulk_upsert else u'row by row')))
+        log.info(u'Import of {0}: {1}, stage seconds: {2}, rejected: {3}'.format(
+            file_name, u', '.join(u'{0}={1}'.format(name, value) for name, value in self.metrics.counters.items()),
+            u', '.join(u'{0}={1:.3f}'.format(name, value) for name, value in self.metrics.timings.items()),
+            u', '.join(u'{0}={1}'.format(name, value) for name, value in sorted(self.metrics.rejected.items()))))
+
+    def start_import_run(self, model, file_path):
+        """
+        Method used for starting new ImportRun and new metrics for import of CSV file.
+        :param model: Device or DeviceContent
+        :param file_path: string
+        :return: ImportRun
+        """
+        if has_local_expire_dates(Session):
+            raise ValueError(u'Expire dates are stored in local time, convert them to UTC with '
+                             u'initialize_db.py --expire-date-utc-offset before import')
+        self.metrics = ImportMetrics()
+        self.error_log = RowErrorLog(csv_error_logger, self.write_error_log)
+        self.row_errors = None
+        import_run = ImportRun()
+        import_run.table_name = unicode(model.__tablename__)
+        import_run.file_path = file_path
+        import_run.status = u'running'
+        import_run.date_started = now()
+        Session.add(import_run)
+        Session.flush()
+        return import_run
+
+    def finish_import_run(self, import_run, status):
+        """
+        Method used for saving metrics of import run and adding them to metric totals of its table.
+        :param import_run: ImportRun
+        :param status: unicode, 'finished', 'unchanged', 'cancelled' or 'failed'
+        """
+        self.error_log.close()
+        error_summary = self.error_log.get_summary()
+        self.error_log = None
+        if error_summary['errors']:
+            self.log_error_summary(import_run.file_path, error_summary)
+
+        import_run.status = status
+        import_run.date_finished = now()
+        for counter, value in self.metrics.counters.items():
+            setattr(import_run, counter, value)
+        import_run.metrics = unicode(self.metrics.to_json())
+        import_run.error_summary = unicode(json.dumps(error_summary))
+        with Session.begin(subtransactions=True):
+            Session.flush()
+            save_metric_totals(Session, import_run.table_name, self.metrics)
+
+    def log_error_summary(self, file_path, error_summary):
+        def format_counts(counts):
+            return u', '.join(u'{0}={1}'.format(name, value) for name, value in sorted(counts.items()))
+
+        csv_error_logger.warning(u'Summary of {0}: {1} rejected fields, by type: {2}, by column: {3}, first {4}:\n{5}'
+                                 .format(file_path, error_summary['errors'],
+                                         format_counts(error_summary['error_types']),
+                                         format_counts(error_summary['columns']), len(error_summary['samples']),
+                                         u'\n'.join(error_summary['samples'])))
+
+    def import_file(self, file_name, model, fields, parse_method_name, validate_row, write_row):
+        """
+        Method used for importing rows of CSV file. With incremental import unchanged files are skipped, appended
+        files are imported from the end of last import and rows equal to stored ones are not parsed.
+        :param file_name: string
+        :param model: Device or DeviceContent
+        :param fields: names of row columns in order
+        :param parse_method_name: name of method used for parsing single row
+        :param validate_row: method used for validating parsed row
+        :param write_row: method used for writing single parsed row when bulk upsert is off
+        :return: unicode, status of ImportRun
+        """
+        start_time = time.time()
+        file_path = self.get_file_path(file_name)
+        import_run = self.start_import_run(model, file_path)
+        try:
+            status, rows_count = self.import_file_rows(file_name, file_path, model, fields, parse_method_name,
+                                                       validate_row, write_row)
+        except ImportCancelled:
+            self.finish_import_run(import_run, u'cancelled')
+            log.info(u'Import of {0} was cancelled'.format(file_name))
+            raise
+        except BaseException:
+            self.finish_import_run(import_run, u'failed')
+            raise
+        if status in (u'finished', u'unchanged'):
+            self.build_aggregates(model)
+        self.finish_import_run(import_run, status)
+        if status == u'finished':
+            self.log_import_rate(file_name, rows_count, start_time)
+        return status
+
+    def import_file_rows(self, file_name, file_path, model, fields, parse_method_name, validate_row, write_row):
+        """
+        Rows read before a reading error are written, but the run fails and state of the file is not saved, so that
+        the next incremental import reads the rest of the file again.
+        :return: tuple (ImportRun status, number of written rows)
+        """
+        self.read_failed = False
+        try:
+            source = open_source(file_path, self.default_csv_delimiter, fields)
+        except Exception as e:
+            log.exception(u'Error when reading CSV file {0}: {1}'.format(file_name, e))
+            return u'failed', 0
+        log.info(u'Reading {0} as {1}, {2}'.format(file_name, source.reader.format_name,
+                                                   source.compression or u'uncompressed'))
+        self.bytes_read = 0
+        # size of compressed file is not comparable with number of read decompressed bytes
+        self.bytes_total = os.path.getsize(file_path) if source.is_seekable else None
+        self.report_progress()
+
+        start_offset, start_row_number = 0, 1
+        if self.incremental:
+            try:
+                file_size, file_mtime = get_file_stat(file_path)
+            except OSError as e:
+                log.exception(u'Error when reading CSV file {0}: {1}'.format(file_name, e))
+                return u'failed', 0
+            imported_file = Session.query(ImportedFile).filter(ImportedFile.file_path == file_path).first()
+            import_start = self.get_import_start(imported_file, file_path, file_size, file_mtime,
+                                                 source.is_seekable)
+            if import_start is None:
+                log.info(u'Skipping unchanged CSV file {0}'.format(file_name))
+                return u'unchanged', 0
+            start_offset, start_row_number = import_start
+
+        if self.workers > 1 and source.is_seekable:
+            parsed_rows = self.get_parsed_rows_parallel(source, model, parse_method_name, validate_row,
+                                                        start_offset, start_row_number)
+        else:
+            rows = self.metrics.timed_iter('read', self.read_source_rows(source, start_offset), 'rows_read')
+            numbered_rows = enumerate(rows, start=start_row_number)
+            if self.incremental:
+                numbered_rows = self.skip_unchanged_rows(model, numbered_rows)
+            parsed_rows = self.get_parsed_rows(numbered_rows, getattr(self, parse_method_name), validate_row)
+
+        rows_count = self.write_rows(model, parsed_rows, write_row)
+        if self.read_failed:
+            log.error(u'Reading of {0} failed after {1} rows, file will be imported again'.format(
+                file_name, rows_count))
+            return u'failed', rows_count
+        if self.incremental:
+            self.save_file_state(imported_file, file_path, file_size, file_mtime)
+        return u'finished', rows_count
+
+    def count_written_row(self, parsed_row, instance=None):
+        """
+        Method used for counting written row in dashboard aggregates.
+        :param parsed_row: dict
+        :param instance: Device or DeviceContent before update, None for inserted row
+        """
+        if self.aggregate_deltas is None:
+            return
+        if instance is None:
+            self.aggregate_deltas.add(parsed_row)
+        else:
+            self.aggregate_deltas.replace(get_instance_values(instance), parsed_row)
+
+    def write_device_row(self, parsed_row):
+        device = Session.query(Device)\
+            .filter(Device.id == parsed_row['id'])\
+            .first()
+        if device:
+            if is_newer_expire_date(device.expire_date, parsed_row['expire_date']):
+                self.count_written_row(parsed_row, device)
+                self.release_device_codes([device.code])
+                device.code = parsed_row['code']
                 device.name = parsed_row['name']
                 device.description = parsed_row['description']
-                device.code = parsed_row['code']
                 device.expire_date = parsed_row['expire_date']
                 device.status = parsed_row['status']
-                Session.add(device)
+                device.fingerprint = parsed_row['fingerprint']
+                device.date_updated = now()
                 Session.flush()
+                return 'updated'
+            self.release_device_codes([parsed_row['code']])
+            return 'skipped_older'
+        else:
+            device = Device()
+            device.id = parsed_row['id']
+            device.name = parsed_row['name']
+            device.description = parsed_row['description']
+            device.code = parsed_row['code']
+            device.expire_date = parsed_row['expire_date']
+            device.status = parsed_row['status']
+            device.fingerprint = parsed_row['fingerprint']
+            Session.add(device)
+            self.count_written_row(parsed_row)
+            Session.flush()
+            return 'inserted'
 
-    def import_device_content_data(self):
-        """
-        Method used for importing DeviceContent data from CSV file.
-        """
-        csv_file_rows = self.read_csv_file(self.content_file_name)
-        if not csv_file_rows:
-            return None
-        for index, row in enumerate(csv_file_rows, start=1):
-            parsed_row = self.get_parsed_device_content_row(row, index)
-            if not parsed_row:
-                continue
-            device_content = Session.query(DeviceContent).filter(DeviceContent.id == parsed_row['id']).first()
-            if device_content:
-                if device_content.expire_date < parsed_row['expire_date']:
-                    device_content.name = parsed_row['name']
-                    device_content.description = parsed_row['description']
-                    device_content.expire_date = parsed_row['expire_date']
-                    device_content.status = parsed_row['status']
-                    device_content.device_id = parsed_row['device_id']
-                    device_content.date_updated = now()
-                    Session.flush()
-            else:
-                device_content = DeviceContent()
-                device_content.id = parsed_row['id']
-                device_content.device_id = parsed_row['device_id']
+    def write_device_content_row(self, parsed_row):
+        device_content = Session.query(DeviceContent).filter(DeviceContent.id == parsed_row['id']).first()
+        if device_content:
+            if is_newer_expire_date(device_content.expire_date, parsed_row['expire_date']):
+                self.count_written_row(parsed_row, device_content)
                 device_content.name = parsed_row['name']
                 device_content.description = parsed_row['description']
                 device_content.expire_date = parsed_row['expire_date']
                 device_content.status = parsed_row['status']
-                Session.add(device_content)
+                device_content.device_id = parsed_row['device_id']
+                device_content.fingerprint = parsed_row['fingerprint']
+                device_content.date_updated = now()
                 Session.flush()
+                return 'updated'
+            return 'skipped_older'
+        else:
+            device_content = DeviceContent()
+            device_content.id = parsed_row['id']
+            device_content.device_id = parsed_row['device_id']
+            device_content.name = parsed_row['name']
+            device_content.description = parsed_row['description']
+            device_content.expire_date = parsed_row['expire_date']
+            device_content.status = parsed_row['status']
+            device_content.fingerprint = parsed_row['fingerprint']
+            Session.add(device_content)
+            self.count_written_row(parsed_row)
+            Session.flush()
+            return 'inserted'
+
+    def import_devices_data(self):
+        """
+        Method used for importing Device data from CSV file.
+        :return: unicode, status of ImportRun
+        """
+        return self.import_file(self.device_file_name, Device, DEVICE_FIELDS, 'parse_device_row',
+                                self.validate_device_row, self.write_device_row)
+
+    def import_device_content_data(self):
+        """
+        Method used for importing DeviceContent data from CSV file.
+        :return: unicode, status of ImportRun
+        """
+        return self.import_file(self.content_file_name, DeviceContent, DEVICE_CONTENT_FIELDS,
+                                'parse_device_content_row', self.validate_device_content_row,
+                                self.write_device_content_row)
+
+    def stage_device_row(self, parsed_row, row_number):
+        """
+        Method used for adding row number to parsed Device row for staging table. Code is not validated, it is checked
+        after all rows are staged, see validate_staged_device_codes.
+        :param parsed_row: dict returned by parse_device_row
+        :param row_number: integer
+        :return: dict
+        """
+        parsed_row['id'] = int(parsed_row['id'])
+        parsed_row['row_number'] = row_number
+        return parsed_row
+
+    def stage_device_content_row(self, parsed_row, row_number):
+        """
+        Method used for adding row number to parsed DeviceContent row for staging table. Device ID is not validated,
+        it is resolved after all staged devices are merged.
+        :param parsed_row: dict returned by parse_device_content_row
+        :param row_number: integer
+        :return: dict
+        """
+        device_ref = parsed_row['device_id']
+        try:
+            device_id = int(device_ref)
+        except (TypeError, ValueError):
+            device_id = None
+        parsed_row['id'] = int(parsed_row['id'])
+        parsed_row['device_ref'] = unicode(device_ref)
+        parsed_row['device_id'] = device_id
+        parsed_row['row_number'] = row_number
+        return parsed_row
+
+    def stage_rows(self, file_name, source, model, parse_method_name, stage_row):
+        """
+        Method used for loading parsed rows of source into staging table of model with executemany inserts.
+        :param file_name: string
+        :param source: Source returned by open_source
+        :param model: Device or DeviceContent
+        :param parse_method_name: name of method used for parsing single row
+        :param stage_row: method used for validating parsed row, stage_device_row or stage_device_content_row
+        :return: number of staged rows, raises IOError when reading of file failed
+        """
+        self.read_failed = False
+        log.info(u'Reading {0} as {1}, {2}'.format(file_name, source.reader.format_name,
+                                                   source.compression or u'uncompressed'))
+        self.bytes_read = 0
+        self.bytes_total = os.path.getsize(source.file_path) if source.is_seekable else None
+        self.report_progress()
+        if self.workers > 1 and source.is_seekable:
+            parsed_rows = self.get_parsed_rows_parallel(source, model, parse_method_name, stage_row)
+        else:
+            rows = self.metrics.timed_iter('read', self.read_source_rows(source), 'rows_read')
+            parsed_rows = self.get_parsed_rows(enumerate(rows, start=1), getattr(self, parse_method_name), stage_row)
+
+        staging_table = STAGED_TABLES[model][0].__table__
+        clear_staged_rows(Session, model)
+        rows_count = 0
+        for chunk in iter_chunks(parsed_rows, STAGE_CHUNK_SIZE):
+            start_time = time.time()
+            Session.execute(staging_table.insert(), chunk)
+            self.metrics.add_time('stage', time.time() - start_time)
+            rows_count += len(chunk)
+            self.report_progress()
+        if self.read_failed:
+            raise IOError(u'Reading of {0} failed after {1} rows'.format(file_name, rows_count))
+        return rows_count
+
+    def validate_staged_device_codes(self):
+        """
+        Method used for rejecting duplicate codes of staged Device rows, called after device file is staged.
+        Rows are checked in file order in chunks of batch_size, the same way as write_rows checks them, and codes of
+        rows which row by row import would skip as older, or replace by newer row, are released after each chunk, so
+        that staged import rejects the same codes as other import modes.
+        """
+        start_time = time.time()
+        self.get_validation_index()
+        # tuple (expire date, code) of Device of ID after rows checked so far
+        current_devices = {}
+        rejected_row_numbers = []
+        for chunk in iter_chunks(get_staged_devices(Session), self.batch_size):
+            codes = []
+            for row_number, row_id, code, expire_date, stored_id, stored_code, stored_expire_date in chunk:
+                parsed_row = self.validate_device_row({'id': row_id, 'code': code}, row_number)
+                if code and not parsed_row['code']:
+                    rejected_row_numbers.append(row_number)
+                codes.append(parsed_row['code'])
+
+            released_codes = []
+            for (row_number, row_id, staged_code, expire_date, stored_id, stored_code, stored_expire_date), code \
+                    in zip(chunk, codes):
+                current_device = current_devices.get(row_id)
+                if current_device is None and stored_id is not None:
+                    current_device = stored_expire_date, stored_code
+                if current_device is None or is_newer_expire_date(current_device[0], expire_date):
+                    if current_device:
+                        released_codes.append(current_device[1])
+                    current_devices[row_id] = expire_date, code
+                else:
+                    released_codes.append(code)
+            self.release_device_codes(released_codes)
+        clear_staged_device_codes(Session, rejected_row_numbers)
+        self.metrics.add_time('validate', time.time() - start_time)
+
+    def resolve_device_references(self):
+        """
+        Method used for reporting and clearing Device IDs of staged DeviceContent rows which do not match any Device,
+        called after staged devices are merged.
+        """
+        start_time = time.time()
+        dangling_count = 0
+        for row_number, device_ref in get_dangling_references(Session):
+            self.log_row_error(u'Device content in row {0} has invalid Device ID: {1}', row_number, device_ref)
+            dangling_count += 1
+        clear_dangling_references(Session)
+        self.metrics.add_time('validate', time.time() - start_time)
+        if dangling_count:
+            log.info(u'{0} device content rows refer to missing devices'.format(dangling_count))
+
+    def merge_staged(self, model, staged_count):
+        """
+        Method used for merging staged rows of model into its table.
+        :param model: Device or DeviceContent
+        :param staged_count: integer, number of staged rows
+        """
+        start_time = time.time()
+        delete_superseded_rows(Session, model)
+        inserted_count, updated_count = merge_staged_rows(Session, model, now())
+        clear_staged_rows(Session, model)
+        self.metrics.increment('rows_inserted', inserted_count)
+        self.metrics.increment('rows_updated', updated_count)
+        self.metrics.increment('rows_skipped_older', staged_count - inserted_count - updated_count)
+        self.metrics.add_time('write', time.time() - start_time)
+
+    def record_failed_import_runs(self, file_paths, status):
+        """
+        Method used for saving ImportRun of every file of staged import which was not written.
+        :param file_paths: list of tuples (model, file path)
+        :param status: unicode, 'cancelled' or 'failed'
+        """
+        for model, file_path in file_paths:
+            self.finish_import_run(self.start_import_run(model, file_path), status)
+
+    def import_staged(self):
+        """
+        Method used for importing Device and DeviceContent data in two phases in one transaction. Rows of each file are
+        parsed and loaded into staging table, then merged into target table with a few set-based statements. Device
+        IDs of content are resolved after all devices are merged, so content may refer to devices anywhere in device
+        file. Staged import always reads whole files.
+        """
+        staged_files = [
+            (self.device_file_name, self.get_file_path(self.device_file_name), Device, DEVICE_FIELDS,
+             'parse_device_row', self.stage_device_row),
+            (self.content_file_name, self.get_file_path(self.content_file_name), DeviceContent,
+             DEVICE_CONTENT_FIELDS, 'parse_device_content_row', self.stage_device_content_row),
+        ]
+        file_paths = [(model, file_path) for file_name, file_path, model, fields, parse_method_name, stage_row
+                      in staged_files]
+        sources = []
+        for file_name, file_path, model, fields, parse_method_name, stage_row in staged_files:
+            try:
+                sources.append(open_source(file_path, self.default_csv_delimiter, fields))
+            except Exception as e:
+                log.exception(u'Error when reading CSV file {0}: {1}'.format(file_name, e))
+                self.record_failed_import_runs(file_paths, u'failed')
+                return
+
+        Session.begin(subtransactions=True)
+        try:
+            for staged_file, source in zip(staged_files, sources):
+                file_name, file_path, model, fields, parse_method_name, stage_row = staged_file
+                start_time = time.time()
+                import_run = self.start_import_run(model, file_path)
+                staged_count = self.stage_rows(file_name, source, model, parse_method_name, stage_row)
+                if model is Device:
+                    self.validate_staged_device_codes()
+                if model is DeviceContent:
+                    self.resolve_device_references()
+                self.merge_staged(model, staged_count)
+                rebuild_aggregates(Session, model)
+                self.finish_import_run(import_run, u'finished')
+                self.log_import_rate(file_name, staged_count, start_time, u'staged')
+            Session.commit()
+        except BaseException as e:
+            Session.rollback()
+            if self.error_log:
+                self.error_log.close()
+                self.error_log = None
+            self.record_failed_import_runs(file_paths, u'cancelled' if isinstance(e, ImportCancelled) else u'failed')
+            raise
+
+
+class ChunkRowParser(CsvImporter):
+    """
+    CsvImporter used in worker processes for parsing rows, rejected fields are collected instead of logged so that
+    writer process can log them with row numbers relative to the whole file.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ChunkRowParser, self).__init__(*args, **kwargs)
+        self.row_errors = []
+
+    def log_row_error(self, message, row_number, *args):
+        self.row_errors.append((row_number, message, tuple(unicode(arg) for arg in args),
+                                sys._getframe(1).f_code.co_name))
 
 
 if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Import Device and DeviceContent data from CSV files.')
+    arg_parser.add_argument('--bulk', action='store_true',
+                            help='write rows in chunks with bulk insert/update statements')
+    arg_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='number of rows per bulk chunk (default: {0})'.format(DEFAULT_BATCH_SIZE))
+    arg_parser.add_argument('--parallel', action='store_true',
+                            help='parse and validate rows in worker processes')
+    arg_parser.add_argument('--workers', type=int, default=cpu_count(),
+                            help='number of worker processes for --parallel (default: {0})'.format(cpu_count()))
+    arg_parser.add_argument('--full', action='store_true',
+                            help='ignore state of previous imports and import whole files')
+    arg_parser.add_argument('--transaction-size', type=int, default=DEFAULT_TRANSACTION_SIZE,
+                            help='number of rows committed in one transaction (default: {0})'.format(
+                                DEFAULT_TRANSACTION_SIZE))
+    arg_parser.add_argument('--error-log', choices=['full', 'summary'], default='full',
+                            help='write every rejected field to the error log or only summary of each file '
+                                 '(default: full)')
+    arg_parser.add_argument('--mmap', action='store_true',
+                            help='read uncompressed CSV files mapped into memory instead of line by line')
+    arg_parser.add_argument('--staged', action='store_true',
+                            help='load both files into staging tables and merge them in one transaction, device '
+                                 'content may refer to devices anywhere in device file')
+    arg_parser.add_argument('--profile', metavar='FILE',
+                            help='run import under cProfile and dump stats to FILE, functions with the highest '
+                                 'cumulative time are logged too (worker processes are not profiled)')
+    args = arg_parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    configure_session('import')
     with transaction.manager:
-        csv_importer = CsvImporter()
+        csv_importer = CsvImporter(bulk_upsert=args.bulk, batch_size=args.batch_size,
+                                   workers=args.workers if args.parallel else 1, incremental=not args.full,
+                                   transaction_size=args.transaction_size,
+                                   write_error_log=args.error_log == 'full', use_mmap=args.mmap)
         csv_importer.set_settings()
-        csv_importer.import_devices_data()
-        csv_importer.import_device_content_data()
+        if args.staged:
+            csv_importer.import_staged()
+        else:
+            csv_importer.import_devices_data()
+            csv_importer.import_device_content_data()
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        stats_report = StringIO()
+        pstats.Stats(profiler, stream=stats_report).sort_stats('cumulative').print_stats(30)
+        log.info(u'Import profile saved to {0}\n{1}'.format(args.profile, stats_report.getvalue()))
@@ -0,0 +1,220 @@
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import bindparam, func, select
+from CsvImporter.models.models import DashboardAggregate, Device, DeviceContent
+from CsvImporter.utility.helper import StatusConstants, now
+
+EXPIRING_SOON_DAYS = 7
+TOP_DEVICES_COUNT = 10
+# key of counts of rows with NULL value
+NULL_KEY = u'none'
+
+
+def format_int_key(value):
+    return NULL_KEY if value is None else unicode(int(value))
+
+
+def format_day_key(value):
+    # same format as SQLite date() of stored datetime
+    return NULL_KEY if value is None else unicode(value.date().isoformat())
+
+
+# table name: list of (aggregate name, column name, function returning aggregate key of column value)
+AGGREGATES = {
+    'device': [
+        (u'device_status', 'status', format_int_key),
+        (u'device_expire_day', 'expire_date', format_day_key),
+    ],
+    'devicecontent': [
+        (u'devicecontent_status', 'status', format_int_key),
+        (u'devicecontent_expire_day', 'expire_date', format_day_key),
+        (u'devicecontent_per_device', 'device_id', format_int_key),
+    ],
+}
+
+
+def get_total_name(table_name):
+    return u'{0}_total'.format(table_name)
+
+
+def get_aggregated_columns(table_name):
+    """
+    :param table_name: 'device' or 'devicecontent'
+    :return: list of names of columns counted by aggregates of table
+    """
+    return [column_name for name, column_name, format_key in AGGREGATES[table_name]]
+
+
+def get_instance_values(instance):
+    """
+    :param instance: Device or DeviceContent
+    :return: dict {column name: value} of columns counted by aggregates
+    """
+    return dict((column_name, getattr(instance, column_name))
+                for column_name in get_aggregated_columns(instance.__tablename__))
+
+
+class AggregateDeltas(object):
+    """
+    Changes of DashboardAggregate counts collected while rows of one table are written, applied with apply in the
+    transaction which writes the rows.
+    """
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.aggregates = AGGREGATES[table_name]
+        self.deltas = defaultdict(int)
+
+    def add(self, values, sign=1):
+        """
+        :param values: mapping of column values of inserted row, or of removed row with sign -1
+        :param sign: 1 or -1
+        """
+        self.deltas[(get_total_name(self.table_name), u'')] += sign
+        for name, column_name, format_key in self.aggregates:
+            self.deltas[(name, format_key(values[column_name]))] += sign
+
+    def replace(self, old_values, new_values):
+        """
+        :param old_values: mapping of column values of row before update
+        :param new_values: mapping of column values of row after update
+        """
+        for name, column_name, format_key in self.aggregates:
+            old_key = format_key(old_values[column_name])
+            new_key = format_key(new_values[column_name])
+            if old_key != new_key:
+                self.deltas[(name, old_key)] -= 1
+                self.deltas[(name, new_key)] += 1
+
+    def move(self, column_name, old_value, new_value, count=1):
+        """
+        Method used for counting update which changed only one column of count rows, e.g. status set by
+        ExpirySweeper.
+        :param column_name: string
+        :param old_value: value of column before update
+        :param new_value: value of column after update
+        :param count: integer, number of updated rows
+        """
+        for name, aggregated_column_name, format_key in self.aggregates:
+            if aggregated_column_name == column_name:
+                self.deltas[(name, format_key(old_value))] -= count
+                self.deltas[(name, format_key(new_value))] += count
+
+    def clear(self):
+        self.deltas.clear()
+
+    def apply(self, session):
+        """
+        Method used for adding collected deltas to DashboardAggregate counts, missing aggregate rows are inserted.
+        :param session: Session with open transaction
+        """
+        deltas = [{'aggregate_name': name, 'aggregate_key': key, 'delta': delta}
+                  for (name, key), delta in self.deltas.items() if delta]
+        self.clear()
+        if not deltas:
+            return
+        table = DashboardAggregate.__table__
+        existing_keys = set()
+        for name in set(delta['aggregate_name'] for delta in deltas):
+            keys = [delta['aggregate_key'] for delta in deltas if delta['aggregate_name'] == name]
+            for start in range(0, len(keys), 500):
+                existing_keys.update((name, key) for key, in session.execute(
+                    select([table.c.key]).where(table.c.name == name).where(table.c.key.in_(keys[start:start + 500]))))
+        updated = [delta for delta in deltas if (delta['aggregate_name'], delta['aggregate_key']) in existing_keys]
+        if updated:
+            session.execute(table.update()
+                            .where(table.c.name == bindparam('aggregate_name'))
+                            .where(table.c.key == bindparam('aggregate_key'))
+                            .values(value=table.c.value + bindparam('delta')), updated)
+        inserted = [{'name': delta['aggregate_name'], 'key': delta['aggregate_key'], 'value': delta['delta']}
+                    for delta in deltas if (delta['aggregate_name'], delta['aggregate_key']) not in existing_keys]
+        if inserted:
+            session.execute(table.insert(), inserted)
+
+
+def has_aggregates(session, table_name):
+    """
+    :return: True if aggregates of table were built, rows are counted incrementally only after that
+    """
+    return session.query(DashboardAggregate.id)\
+        .filter(DashboardAggregate.name == get_total_name(table_name)).first() is not None
+
+
+def rebuild_aggregates(session, model):
+    """
+    Method used for computing all DashboardAggregate counts of table from its rows.
+    :param session: Session with open transaction
+    :param model: Device or DeviceContent
+    """
+    table = model.__table__
+    aggregate_table = DashboardAggregate.__table__
+    names = [get_total_name(table.name)] + [name for name, column_name, format_key in AGGREGATES[table.name]]
+    session.execute(aggregate_table.delete().where(aggregate_table.c.name.in_(names)))
+    rows = [{'name': get_total_name(table.name), 'key': u'',
+             'value': session.execute(select([func.count()]).select_from(table)).scalar()}]
+    for name, column_name, format_key in AGGREGATES[table.name]:
+        column = table.c[column_name]
+        key_column = func.date(column) if format_key is format_day_key else column
+        for key, count in session.execute(select([key_column, func.count()]).group_by(key_column)):
+            rows.append({'name': name, 'key': NULL_KEY if key is None else unicode(key), 'value': count})
+    session.execute(aggregate_table.insert(), rows)
+
+
+def get_counts(session, name):
+    return dict(session.query(DashboardAggregate.key, DashboardAggregate.value)
+                .filter(DashboardAggregate.name == name, DashboardAggregate.value != 0))
+
+
+def get_status_counts(session, table_name):
+    """
+    :return: dict {status name: count}, rows without valid status are counted as 'invalid'
+    """
+    status_names = StatusConstants.get_mapped_status_name()
+    status_counts = defaultdict(int)
+    for key, value in get_counts(session, u'{0}_status'.format(table_name)).items():
+        status_counts[status_names.get(int(key), u'invalid') if key != NULL_KEY else u'invalid'] += value
+    return dict(status_counts)
+
+
+def get_expire_day_count(session, table_name, first_day=None, last_day=None):
+    """
+    :param first_day: date or None
+    :param last_day: date or None
+    :return: number of rows which expire from first_day to last_day, both included
+    """
+    query = session.query(func.coalesce(func.sum(DashboardAggregate.value), 0))\
+        .filter(DashboardAggregate.name == u'{0}_expire_day'.format(table_name),
+                DashboardAggregate.key != NULL_KEY)
+    if first_day:
+        query = query.filter(DashboardAggregate.key >= unicode(first_day.isoformat()))
+    if last_day:
+        query = query.filter(DashboardAggregate.key <= unicode(last_day.isoformat()))
+    return query.scalar()
+
+
+def get_dashboard_summary(session, days=EXPIRING_SOON_DAYS, top_devices_count=TOP_DEVICES_COUNT):
+    """
+    Method used for getting dashboard counts from DashboardAggregate, no Device or DeviceContent rows are read.
+    :param session: Session
+    :param days: integer, rows expiring in this number of days are counted as expiring soon
+    :param top_devices_count: integer, number of devices with most content
+    :return: dict
+    """
+    today = now().date()
+    summary = {'expiring_days': days}
+    for model in (Device, DeviceContent):
+        table_name = model.__tablename__
+        summary[table_name] = {
+            'total': get_counts(session, get_total_name(table_name)).get(u'', 0),
+            'status': get_status_counts(session, table_name),
+            'expiring_soon': get_expire_day_count(session, table_name, today, today + timedelta(days=days)),
+            'expired': get_expire_day_count(session, table_name, last_day=today - timedelta(days=1)),
+        }
+    per_device = session.query(DashboardAggregate.key, DashboardAggregate.value)\
+        .filter(DashboardAggregate.name == u'devicecontent_per_device', DashboardAggregate.key != NULL_KEY,
+                DashboardAggregate.value != 0)
+    summary['devicecontent']['without_device'] = get_counts(session, u'devicecontent_per_device').get(NULL_KEY, 0)
+    summary['devicecontent']['devices_with_content'] = per_device.count()
+    summary['devicecontent']['top_devices'] = [
+        {'device_id': int(key), 'count': value}
+        for key, value in per_device.order_by(DashboardAggregate.value.desc()).limit(top_devices_count)]
+    return summary
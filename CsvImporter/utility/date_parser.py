@@ -0,0 +1,73 @@
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from dateutil import parser
+
+# ISO-8601 date and time with optional fraction and UTC offset, e.g. 2017-12-02 23:55:06.333+01:00
+ISO_DATETIME_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?'
+                             r'(Z|[+-]\d{2}(?::?\d{2})?)?$')
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class DateParser(object):
+    """
+    Parser of CSV expire dates. Values in ISO-8601 format are parsed with compiled regular expression, other values
+    with dateutil. Results for repeated values are taken from LRU cache.
+    Returned datetimes are naive UTC, so that they can be compared with now(). Dates with UTC offset are converted
+    to UTC before the offset is dropped, dates without it are taken as UTC.
+    """
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def parse(self, value):
+        """
+        Method used for parsing date string.
+        :param value: string
+        :return: datetime, raises ValueError for invalid date
+        """
+        try:
+            parsed_date = self.cache.pop(value)
+        except KeyError:
+            parsed_date = self.parse_uncached(value)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[value] = parsed_date
+        if parsed_date is None:
+            raise ValueError(u'Invalid date: {0}'.format(value))
+        return parsed_date
+
+    def parse_uncached(self, value):
+        """
+        :param value: string
+        :return: datetime or None for invalid date
+        """
+        match = ISO_DATETIME_RE.match(value)
+        # dateutil reads years below 100 as day or month, these are left to it as well
+        if match and match.group(1) >= '0100':
+            year, month, day, hour, minute, second, fraction, offset = match.groups()
+            try:
+                parsed_date = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+                                       int(fraction.ljust(6, '0')) if fraction else 0)
+                return parsed_date - get_utc_offset(offset) if offset else parsed_date
+            except (ValueError, OverflowError):
+                # out of range values are left to dateutil, so that invalid dates are handled the same way
+                pass
+        try:
+            parsed_date = parser.parse(value)
+            utc_offset = parsed_date.utcoffset()
+            return (parsed_date - utc_offset if utc_offset else parsed_date).replace(tzinfo=None)
+        except Exception:
+            return None
+
+
+def get_utc_offset(offset):
+    """
+    :param offset: UTC offset matched by ISO_DATETIME_RE, e.g. Z, +01, +01:00 or -0530
+    :return: timedelta
+    """
+    if offset == 'Z':
+        return timedelta(0)
+    minutes = int(offset[1:3]) * 60 + (int(offset[-2:]) if len(offset) > 3 else 0)
+    return timedelta(minutes=-minutes if offset[0] == '-' else minutes)
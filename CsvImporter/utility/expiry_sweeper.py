@@ -0,0 +1,197 @@
+import argparse
+import logging
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+from CsvImporter.models.database import DATABASE_URL, Session, configure_session, create_profile_engine
+from CsvImporter.models.models import Device, DeviceContent, ExpirySweep
+from CsvImporter.utility.dashboard import AggregateDeltas, has_aggregates
+from CsvImporter.utility.helper import StatusConstants, now
+from CsvImporter.utility.initialize_db import has_local_expire_dates
+
+log = logging.getLogger(__name__)
+
+# ids of batch are bound as IN (...) parameters, SQLite limits their number to 999
+DEFAULT_SWEEP_BATCH_SIZE = 500
+DEFAULT_SWEEP_INTERVAL = 60
+
+
+class ExpirySweeper(object):
+    """
+    Disables enabled Device and DeviceContent rows whose expire date has passed. Expired rows are found through
+    (status, expire_date) indexes in order of expire date, so every sweep reads only rows it disables, and they are
+    updated by set-based statements in batches of batch_size rows, each batch in its own transaction. Enabled content
+    of disabled devices is disabled in the same transaction as the devices, also in batches.
+    Expire dates are stored in UTC by DateParser, so they are compared with now(), which is UTC as well. Databases
+    with expire dates in local time are not swept until initialize_db converts them.
+    """
+    def __init__(self, session, batch_size=DEFAULT_SWEEP_BATCH_SIZE):
+        """
+        :param session: Session with autocommit=True bound to writable engine
+        :param batch_size: integer, maximum number of rows selected and updated by one statement
+        """
+        self.session = session
+        self.batch_size = batch_size
+
+    def sweep(self, expire_before=None):
+        """
+        Method used for disabling all rows expired before given date.
+        :param expire_before: datetime, now by default
+        :return: ExpirySweep or None if no row was disabled
+        """
+        if has_local_expire_dates(self.session):
+            log.warning(u'Expiry sweep skipped, expire dates are stored in local time, convert them to UTC with '
+                        u'initialize_db.py --expire-date-utc-offset')
+            return None
+        date_started = now()
+        expire_before = expire_before or date_started
+        devices_disabled, content_cascaded = self.disable_expired(Device, expire_before)
+        content_disabled = self.disable_expired(DeviceContent, expire_before)[0]
+        if not devices_disabled and not content_disabled:
+            return None
+
+        expiry_sweep = ExpirySweep()
+        expiry_sweep.date_started = date_started
+        expiry_sweep.date_finished = now()
+        expiry_sweep.devices_disabled = devices_disabled
+        expiry_sweep.content_disabled = content_disabled + content_cascaded
+        expiry_sweep.content_cascaded = content_cascaded
+        with self.session.begin():
+            self.session.add(expiry_sweep)
+        log.info(u'Expiry sweep disabled {0} devices and {1} device content rows ({2} of disabled devices)'.format(
+            devices_disabled, expiry_sweep.content_disabled, content_cascaded))
+        return expiry_sweep
+
+    def disable_expired(self, model, expire_before):
+        """
+        :param model: Device or DeviceContent
+        :param expire_before: datetime
+        :return: tuple (number of disabled rows, number of disabled content rows of disabled devices)
+        """
+        table = model.__table__
+        expired_ids = select([table.c.id])\
+            .where(table.c.status == StatusConstants.STATUS_ENABLED)\
+            .where(table.c.expire_date <= expire_before)\
+            .order_by(table.c.expire_date, table.c.id)\
+            .limit(self.batch_size)
+        disabled_count = 0
+        cascaded_count = 0
+        while True:
+            with self.session.begin():
+                row_ids = [row_id for row_id, in self.session.execute(expired_ids)]
+                if row_ids:
+                    aggregate_deltas = self.get_aggregate_deltas(model)
+                    self.disable_rows(table, table.c.id.in_(row_ids), aggregate_deltas)
+                    if model is Device:
+                        cascaded_count += self.disable_device_content(row_ids)
+                    if aggregate_deltas:
+                        aggregate_deltas.apply(self.session)
+            disabled_count += len(row_ids)
+            if len(row_ids) < self.batch_size:
+                return disabled_count, cascaded_count
+
+    def disable_device_content(self, device_ids):
+        """
+        Method used for disabling enabled content of devices, called in transaction which disables the devices.
+        :param device_ids: list of Device.id
+        :return: number of disabled DeviceContent rows
+        """
+        table = DeviceContent.__table__
+        # status + 0 can not use status indexes, so that SQLite looks content up by device_id index instead of
+        # scanning all enabled content
+        content_ids = select([table.c.id])\
+            .where(table.c.device_id.in_(device_ids))\
+            .where(table.c.status + 0 == StatusConstants.STATUS_ENABLED)\
+            .limit(self.batch_size)
+        aggregate_deltas = self.get_aggregate_deltas(DeviceContent)
+        disabled_count = 0
+        while True:
+            updated_count = self.disable_rows(table, table.c.id.in_(content_ids), aggregate_deltas)
+            disabled_count += updated_count
+            if updated_count < self.batch_size:
+                break
+        if aggregate_deltas:
+            aggregate_deltas.apply(self.session)
+        return disabled_count
+
+    def disable_rows(self, table, condition, aggregate_deltas=None):
+        """
+        :param table: Table
+        :param condition: where clause selecting enabled rows
+        :param aggregate_deltas: AggregateDeltas or None
+        :return: number of disabled rows
+        """
+        updated_count = self.session.execute(
+            table.update().where(condition).values(status=StatusConstants.STATUS_DISABLED, date_updated=now())
+        ).rowcount
+        if aggregate_deltas:
+            aggregate_deltas.move('status', StatusConstants.STATUS_ENABLED, StatusConstants.STATUS_DISABLED,
+                                  updated_count)
+        return updated_count
+
+    def get_aggregate_deltas(self, model):
+        # aggregates which are not built yet are computed from all rows by the next import
+        if has_aggregates(self.session, model.__tablename__):
+            return AggregateDeltas(model.__tablename__)
+        return None
+
+
+class ExpirySweeperThread(threading.Thread):
+    """
+    Daemon thread of web app running ExpirySweeper every interval seconds with its own writable engine.
+    """
+    def __init__(self, interval=DEFAULT_SWEEP_INTERVAL, database_url=DATABASE_URL,
+                 batch_size=DEFAULT_SWEEP_BATCH_SIZE, on_sweep=None):
+        """
+        :param on_sweep: function called with ExpirySweep after sweep which disabled rows, e.g. cache invalidation
+        """
+        super(ExpirySweeperThread, self).__init__(name='expiry-sweeper')
+        self.daemon = True
+        self.interval = interval
+        self.database_url = database_url
+        self.batch_size = batch_size
+        self.on_sweep = on_sweep
+        self.stop_event = threading.Event()
+
+    def run(self):
+        session = sessionmaker(autocommit=True, autoflush=False,
+                               bind=create_profile_engine('import', self.database_url))()
+        sweeper = ExpirySweeper(session, self.batch_size)
+        while not self.stop_event.is_set():
+            try:
+                expiry_sweep = sweeper.sweep()
+            except Exception:
+                log.exception(u'Expiry sweep failed')
+            else:
+                if expiry_sweep and self.on_sweep:
+                    self.on_sweep(expiry_sweep)
+            self.stop_event.wait(self.interval)
+        session.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Disable expired Device and DeviceContent rows.')
+    arg_parser.add_argument('--batch-size', type=int, default=DEFAULT_SWEEP_BATCH_SIZE,
+                            help='number of rows updated by one statement (default: {0})'.format(
+                                DEFAULT_SWEEP_BATCH_SIZE))
+    arg_parser.add_argument('--interval', type=float,
+                            help='keep running and sweep every INTERVAL seconds instead of sweeping once')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    configure_session('import')
+    sweeper = ExpirySweeper(Session, args.batch_size)
+    while True:
+        try:
+            sweeper.sweep()
+        except Exception:
+            if not args.interval:
+                raise
+            log.exception(u'Expiry sweep failed')
+        if not args.interval:
+            break
+        time.sleep(args.interval)
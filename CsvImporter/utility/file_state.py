@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+
+def get_prefix_hash(file_path, length):
+    """
+    Method used for hashing first length bytes of file.
+    :param file_path: string
+    :param length: integer
+    :return: sha1 hex digest or None if file is shorter than length
+    """
+    hasher = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(SCAN_BLOCK_SIZE, remaining))
+            if not block:
+                return None
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher.hexdigest()
+
+
+def scan_complete_rows(file_path, max_size):
+    """
+    Method used for finding end of last complete(newline terminated) row in first max_size bytes of file.
+    Records are expected to be one per line.
+    :param file_path: string
+    :param max_size: integer, rows appended after import started are not counted
+    :return: tuple (offset after last complete row, sha1 hex digest of bytes before that offset, number of rows)
+    """
+    hasher = hashlib.sha1()
+    complete_offset = 0
+    rows_count = 0
+    pending = b''
+    with open(file_path, 'rb') as f:
+        remaining = max_size
+        while remaining > 0:
+            block = f.read(min(SCAN_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            data = pending + block
+            end = data.rfind(b'\n') + 1
+            if end:
+                hasher.update(data[:end])
+                rows_count += data.count(b'\n', 0, end)
+                complete_offset += end
+            pending = data[end:]
+    return complete_offset, hasher.hexdigest(), rows_count
+
+
+def get_file_stat(file_path):
+    """
+    :param file_path: string
+    :return: tuple (size, mtime)
+    """
+    file_stat = os.stat(file_path)
+    return file_stat.st_size, file_stat.st_mtime
@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime
 
 
@@ -24,4 +25,56 @@ class StatusConstants(object):
             cls.STATUS_DISABLED: u'disabled',
             cls.STATUS_ENABLED: u'enabled',
             cls.STATUS_DELETED: u'deleted'
-        }
\ No newline at end of file
+        }
+
+
+def is_newer_expire_date(current_expire_date, new_expire_date):
+    """
+    Check if new expire date should replace current one. Timezone info is dropped before comparing because
+    SQLite stores datetimes without it.
+    :param current_expire_date: datetime or None
+    :param new_expire_date: datetime or None
+    :return: boolean
+    """
+    if new_expire_date is None:
+        return False
+    if current_expire_date is None:
+        return True
+    return current_expire_date.replace(tzinfo=None) < new_expire_date.replace(tzinfo=None)
+
+
+def iter_chunks(iterable, chunk_size):
+    """
+    Generator splitting iterable into lists of at most chunk_size items.
+    :param iterable: any iterable
+    :param chunk_size: integer
+    :return: generator of lists
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_row_fingerprint(row):
+    """
+    Method used for getting fingerprint of CSV row data.
+    :param row: list of unicode cells
+    :return: sha1 hex digest
+    """
+    return hashlib.sha1(u'\x1f'.join(row).encode('utf-8')).hexdigest()
+
+
+def get_row_id(row):
+    """
+    :param row: list of unicode cells
+    :return: integer ID from first cell or None
+    """
+    try:
+        return int(row[0]) if row and row[0].isdigit() else None
+    except ValueError:
+        return None
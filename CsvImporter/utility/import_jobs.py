@@ -0,0 +1,239 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import Array, Event, Process
+from CsvImporter.models.database import DATABASE_URL, Session, configure_session
+from CsvImporter.utility.csv_importer import CsvImporter, ImportCancelled
+
+log = logging.getLogger(__name__)
+
+# name of target table: CsvImporter method importing it, in import order
+IMPORT_METHODS = OrderedDict([
+    ('device', 'import_devices_data'),
+    ('devicecontent', 'import_device_content_data'),
+])
+TABLE_NAMES = list(IMPORT_METHODS.keys())
+
+# exit codes of job process when import of a table failed without exception and when import was cancelled
+EXIT_FAILED = 2
+EXIT_CANCELLED = 3
+
+# indexes of values in shared job state array
+STATE_TABLE = 0
+STATE_BYTES_READ = 1
+STATE_BYTES_TOTAL = 2
+STATE_ROWS_READ = 3
+STATE_TABLE_STARTED = 4
+STATE_UPDATED = 5
+STATE_SIZE = 6
+
+
+class ImportJobProgress(object):
+    """
+    Progress of import job shared between job process and web app, used as CsvImporter.progress.
+    """
+    def __init__(self, state, cancel_event):
+        self.state = state
+        self.cancel_event = cancel_event
+
+    def start_table(self, table_name):
+        now = time.time()
+        with self.state.get_lock():
+            self.state[STATE_TABLE] = TABLE_NAMES.index(table_name)
+            self.state[STATE_BYTES_READ] = 0
+            self.state[STATE_BYTES_TOTAL] = -1
+            self.state[STATE_ROWS_READ] = 0
+            self.state[STATE_TABLE_STARTED] = now
+            self.state[STATE_UPDATED] = now
+
+    def update(self, bytes_read, bytes_total, rows_read):
+        with self.state.get_lock():
+            self.state[STATE_BYTES_READ] = bytes_read
+            self.state[STATE_BYTES_TOTAL] = -1 if bytes_total is None else bytes_total
+            self.state[STATE_ROWS_READ] = rows_read
+            self.state[STATE_UPDATED] = time.time()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+
+def run_import_job(database_url, table_names, importer_options, state, cancel_event):
+    """
+    Job process function, imports tables with settings saved in database.
+    :param database_url: string
+    :param table_names: list of TABLE_NAMES
+    :param importer_options: dict of CsvImporter keyword arguments
+    :param state: shared Array of job state
+    :param cancel_event: Event set when job is cancelled
+    """
+    # connections of web app engine are not shared with job process
+    Session.remove()
+    configure_session('import', database_url)
+    csv_importer = CsvImporter(**importer_options)
+    csv_importer.progress = ImportJobProgress(state, cancel_event)
+    csv_importer.set_settings()
+    failed_table_names = []
+    try:
+        for table_name in table_names:
+            csv_importer.progress.start_table(table_name)
+            if getattr(csv_importer, IMPORT_METHODS[table_name])() == u'failed':
+                failed_table_names.append(table_name)
+    except ImportCancelled:
+        sys.exit(EXIT_CANCELLED)
+    finally:
+        Session.remove()
+    if failed_table_names:
+        sys.exit(EXIT_FAILED)
+
+
+class ImportJob(object):
+    """
+    Import of one or more tables started from web app, runs in separate process.
+    """
+    def __init__(self, job_id, table_names, importer_options):
+        self.id = job_id
+        self.table_names = table_names
+        self.importer_options = importer_options
+        self.status = 'queued'
+        self.date_created = time.time()
+        self.date_started = None
+        self.date_finished = None
+        self.state = Array('d', STATE_SIZE)
+        self.cancel_event = Event()
+        self.process = None
+
+    def get_progress(self):
+        """
+        :return: dict with job status, table being imported, read bytes and rows, rows/sec and ETA in seconds
+        """
+        with self.state.get_lock():
+            state = list(self.state)
+        progress = {
+            'id': self.id,
+            'tables': self.table_names,
+            'status': self.status,
+            'date_created': self.date_created,
+            'date_started': self.date_started,
+            'date_finished': self.date_finished,
+            'table': None,
+            'bytes_read': None,
+            'bytes_total': None,
+            'rows_read': None,
+            'rows_per_second': None,
+            'eta_seconds': None
+        }
+        if not state[STATE_TABLE_STARTED]:
+            return progress
+
+        elapsed = (time.time() if self.status == 'running' else state[STATE_UPDATED]) - state[STATE_TABLE_STARTED]
+        bytes_read = int(state[STATE_BYTES_READ])
+        bytes_total = int(state[STATE_BYTES_TOTAL]) if state[STATE_BYTES_TOTAL] >= 0 else None
+        progress.update({
+            'table': TABLE_NAMES[int(state[STATE_TABLE])],
+            'bytes_read': bytes_read,
+            'bytes_total': bytes_total,
+            'rows_read': int(state[STATE_ROWS_READ]),
+            'rows_per_second': state[STATE_ROWS_READ] / elapsed if elapsed > 0 else None
+        })
+        if self.status == 'running' and bytes_total is not None and bytes_read and elapsed > 0:
+            progress['eta_seconds'] = (bytes_total - bytes_read) / (bytes_read / elapsed)
+        return progress
+
+
+class ImportJobRunner(object):
+    """
+    Queue of import jobs of web app. Every job runs in its own process, jobs importing the same table run one at a
+    time in order in which they were enqueued.
+    """
+    def __init__(self, database_url=DATABASE_URL, max_finished_jobs=100, on_job_finished=None):
+        """
+        :param on_job_finished: function called with ImportJob after its process exits, e.g. for cache invalidation
+        """
+        self.database_url = database_url
+        self.max_finished_jobs = max_finished_jobs
+        self.on_job_finished = on_job_finished
+        self.jobs = OrderedDict()
+        self.last_job_id = 0
+        self.lock = threading.Lock()
+
+    def enqueue(self, table_names=None, **importer_options):
+        """
+        :param table_names: list of TABLE_NAMES, all tables by default
+        :param importer_options: CsvImporter keyword arguments, e.g. bulk_upsert=True
+        :return: ImportJob
+        """
+        table_names = [table_name for table_name in TABLE_NAMES if table_name in (table_names or TABLE_NAMES)]
+        with self.lock:
+            self.last_job_id += 1
+            job = ImportJob(self.last_job_id, table_names, importer_options)
+            self.jobs[job.id] = job
+            self.remove_finished_jobs()
+            self.start_queued_jobs()
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_jobs(self):
+        return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """
+        Method used for cancelling job. Running import is rolled back at the next chunk, queued job does not start.
+        :param job_id: integer
+        :return: ImportJob or None
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job.status == 'queued':
+                job.status = 'cancelled'
+                job.date_finished = time.time()
+            elif job and job.status == 'running':
+                job.cancel_event.set()
+        return job
+
+    def start_queued_jobs(self):
+        # called with lock held
+        busy_tables = set(table_name for job in self.jobs.values() if job.status == 'running'
+                          for table_name in job.table_names)
+        for job in self.jobs.values():
+            if job.status != 'queued':
+                continue
+            if not busy_tables.intersection(job.table_names):
+                self.start_job(job)
+            # later jobs must not overtake queued job of the same table
+            busy_tables.update(job.table_names)
+
+    def start_job(self, job):
+        job.process = Process(target=run_import_job, args=(self.database_url, job.table_names, job.importer_options,
+                                                           job.state, job.cancel_event))
+        job.process.daemon = True
+        job.process.start()
+        job.status = 'running'
+        job.date_started = time.time()
+        watcher = threading.Thread(target=self.wait_for_job, args=(job,), name='ImportJobWatcher-{0}'.format(job.id))
+        watcher.daemon = True
+        watcher.start()
+
+    def wait_for_job(self, job):
+        job.process.join()
+        with self.lock:
+            if job.process.exitcode == 0:
+                job.status = 'finished'
+            elif job.process.exitcode == EXIT_CANCELLED:
+                job.status = 'cancelled'
+            else:
+                job.status = 'failed'
+                log.error(u'Import job {0} failed with exit code {1}'.format(job.id, job.process.exitcode))
+            job.date_finished = time.time()
+            self.start_queued_jobs()
+        if self.on_job_finished:
+            self.on_job_finished(job)
+
+    def remove_finished_jobs(self):
+        # called with lock held
+        finished_jobs = [job for job in self.jobs.values() if job.status in ('finished', 'cancelled', 'failed')]
+        for job in finished_jobs[:max(0, len(finished_jobs) - self.max_finished_jobs)]:
+            del self.jobs[job.id]
@@ -0,0 +1,336 @@
+import calendar
+import json
+import time
+from collections import OrderedDict
+from sqlalchemy import bindparam, func, select
+from CsvImporter.models.models import ImportMetricTotal, ImportRun
+from CsvImporter.utility.row_error_log import get_error_kind
+
+STAGES = ('read', 'parse', 'parse_dates', 'validate', 'skip_unchanged', 'stage', 'write', 'commit')
+COUNTERS = ('rows_read', 'rows_inserted', 'rows_updated', 'rows_skipped_older', 'rows_skipped_unchanged',
+            'rows_rejected')
+# upper bounds in seconds of batch write latency histogram buckets, last bucket is +Inf
+BATCH_WRITE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# number of runs whose metrics JSON is loaded at once when totals are rebuilt
+REBUILD_RUNS_CHUNK = 1000
+
+
+def get_error_reason(message):
+    """
+    Method used for getting rejection reason label from row error message.
+    :param message: unicode format string passed to CsvImporter.log_row_error
+    :return: string, e.g. invalid_name
+    """
+    return '{0}_{1}'.format(*get_error_kind(message))
+
+
+class ImportMetrics(object):
+    """
+    Per-stage timers, row counters and batch write latency histogram of one import run.
+    Stage times of parallel import are summed over worker processes, so they can be greater than run duration.
+    """
+    def __init__(self):
+        self.timings = OrderedDict((stage, 0.0) for stage in STAGES)
+        self.counters = OrderedDict((counter, 0) for counter in COUNTERS)
+        self.rejected = {}
+        self.batch_write_buckets = [0] * (len(BATCH_WRITE_BUCKETS) + 1)
+        self.batch_write_sum = 0.0
+        self.batch_write_count = 0
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] += seconds
+
+    def increment(self, counter, value=1):
+        self.counters[counter] += value
+
+    def add_rejection(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def observe_batch_write(self, seconds):
+        bucket = 0
+        while bucket < len(BATCH_WRITE_BUCKETS) and seconds > BATCH_WRITE_BUCKETS[bucket]:
+            bucket += 1
+        self.batch_write_buckets[bucket] += 1
+        self.batch_write_sum += seconds
+        self.batch_write_count += 1
+
+    def timed_iter(self, stage, iterable, counter=None):
+        """
+        Generator of items of iterable, time spent waiting for next item is added to stage.
+        :param stage: string, one of STAGES
+        :param iterable: iterable
+        :param counter: string, one of COUNTERS incremented for every item, optional
+        :return: generator
+        """
+        iterator = iter(iterable)
+        while True:
+            start_time = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.timings[stage] += time.time() - start_time
+                return
+            self.timings[stage] += time.time() - start_time
+            if counter:
+                self.counters[counter] += 1
+            yield item
+
+    def merge(self, other):
+        """
+        Method used for adding metrics of other run, e.g. when aggregating stored runs.
+        :param other: ImportMetrics
+        """
+        for stage, seconds in other.timings.items():
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        for counter, value in other.counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+        for reason, value in other.rejected.items():
+            self.rejected[reason] = self.rejected.get(reason, 0) + value
+        for bucket, value in enumerate(other.batch_write_buckets):
+            self.batch_write_buckets[bucket] += value
+        self.batch_write_sum += other.batch_write_sum
+        self.batch_write_count += other.batch_write_count
+
+    def to_json(self):
+        return json.dumps({
+            'timings': self.timings,
+            'counters': self.counters,
+            'rejected': self.rejected,
+            'batch_write': {
+                'buckets': self.batch_write_buckets,
+                'sum': self.batch_write_sum,
+                'count': self.batch_write_count
+            }
+        })
+
+    @classmethod
+    def from_json(cls, value):
+        metrics = cls()
+        if not value:
+            return metrics
+        data = json.loads(value)
+        metrics.timings.update(data.get('timings', {}))
+        metrics.counters.update(data.get('counters', {}))
+        metrics.rejected.update(data.get('rejected', {}))
+        batch_write = data.get('batch_write', {})
+        if len(batch_write.get('buckets', [])) == len(metrics.batch_write_buckets):
+            metrics.batch_write_buckets = batch_write['buckets']
+            metrics.batch_write_sum = batch_write.get('sum', 0.0)
+            metrics.batch_write_count = batch_write.get('count', 0)
+        return metrics
+
+    def to_totals(self):
+        """
+        :return: dict {(ImportMetricTotal.name, ImportMetricTotal.key): value} of metrics which are not counters
+        """
+        totals = {}
+        for stage, seconds in self.timings.items():
+            totals[(u'stage_seconds', unicode(stage))] = seconds
+        for reason, value in self.rejected.items():
+            totals[(u'rejected', unicode(reason))] = value
+        for bucket, value in enumerate(self.batch_write_buckets):
+            totals[(u'batch_write_bucket', unicode(bucket))] = value
+        totals[(u'batch_write_sum', u'')] = self.batch_write_sum
+        totals[(u'batch_write_count', u'')] = self.batch_write_count
+        return totals
+
+    @classmethod
+    def from_totals(cls, totals):
+        """
+        :param totals: iterable of tuples (ImportMetricTotal.name, ImportMetricTotal.key, value)
+        :return: ImportMetrics, counters are not set
+        """
+        metrics = cls()
+        for name, key, value in totals:
+            if name == u'stage_seconds':
+                metrics.timings[str(key)] = value
+            elif name == u'rejected':
+                metrics.rejected[str(key)] = int(value)
+            elif name == u'batch_write_bucket' and int(key) < len(metrics.batch_write_buckets):
+                metrics.batch_write_buckets[int(key)] = int(value)
+            elif name == u'batch_write_sum':
+                metrics.batch_write_sum = value
+            elif name == u'batch_write_count':
+                metrics.batch_write_count = int(value)
+        return metrics
+
+
+def has_metric_totals(session, table_name):
+    """
+    :return: True if totals of table were built, metrics of runs are added to them only after that
+    """
+    return session.query(ImportMetricTotal.id).filter(ImportMetricTotal.table_name == table_name).first() is not None
+
+
+def add_metric_totals(session, table_name, totals):
+    """
+    Method used for adding metrics of import run to ImportMetricTotal values, missing rows are inserted.
+    :param session: Session with open transaction
+    :param table_name: unicode
+    :param totals: dict returned by ImportMetrics.to_totals
+    """
+    table = ImportMetricTotal.__table__
+    existing_keys = set((name, key) for name, key in session.execute(
+        select([table.c.name, table.c.key]).where(table.c.table_name == table_name)))
+    updated = [{'total_name': name, 'total_key': key, 'delta': value}
+               for (name, key), value in totals.items() if (name, key) in existing_keys and value]
+    if updated:
+        session.execute(table.update()
+                        .where(table.c.table_name == table_name)
+                        .where(table.c.name == bindparam('total_name'))
+                        .where(table.c.key == bindparam('total_key'))
+                        .values(value=table.c.value + bindparam('delta')), updated)
+    inserted = [{'table_name': table_name, 'name': name, 'key': key, 'value': value}
+                for (name, key), value in totals.items() if (name, key) not in existing_keys]
+    if inserted:
+        session.execute(table.insert(), inserted)
+
+
+def rebuild_metric_totals(session, table_name):
+    """
+    Method used for computing ImportMetricTotal values of table from metrics JSON of all its runs, e.g. for runs
+    stored before totals were kept.
+    :param session: Session with open transaction
+    :param table_name: unicode
+    """
+    session.execute(ImportMetricTotal.__table__.delete().where(ImportMetricTotal.table_name == table_name))
+    metrics = ImportMetrics()
+    run_metrics = session.query(ImportRun.metrics).filter(ImportRun.table_name == table_name)
+    for value, in run_metrics.yield_per(REBUILD_RUNS_CHUNK):
+        metrics.merge(ImportMetrics.from_json(value))
+    add_metric_totals(session, table_name, metrics.to_totals())
+
+
+def save_metric_totals(session, table_name, metrics):
+    """
+    Method used for adding metrics of finished import run to totals of its table, totals are built from all stored
+    runs when they do not exist yet.
+    :param session: Session with open transaction, ImportRun of metrics is flushed
+    :param table_name: unicode
+    :param metrics: ImportMetrics
+    """
+    if has_metric_totals(session, table_name):
+        add_metric_totals(session, table_name, metrics.to_totals())
+    else:
+        rebuild_metric_totals(session, table_name)
+
+
+def get_last_runs(session, key_columns, *criteria):
+    """
+    :param session: Session
+    :param key_columns: list of ImportRun columns, e.g. [ImportRun.table_name]
+    :param criteria: filter criteria of runs
+    :return: OrderedDict {tuple of key column values: last ImportRun}
+    """
+    last_run_ids = session.query(func.max(ImportRun.id)).filter(*criteria).group_by(*key_columns)
+    return OrderedDict(
+        (tuple(getattr(import_run, column.key) for column in key_columns), import_run)
+        for import_run in session.query(ImportRun).filter(ImportRun.id.in_(last_run_ids.subquery()))
+        .order_by(*key_columns))
+
+
+def format_labels(labels):
+    return u','.join(u'{0}="{1}"'.format(name, unicode(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"'))
+                     for name, value in labels)
+
+
+def get_prometheus_metrics(session, source_names=None):
+    """
+    Method used for rendering stored import runs in Prometheus text exposition format. Counters are summed over all
+    runs of a table by SQL and from ImportMetricTotal, gauges describe the last run of a table, so metrics JSON of
+    runs is not read.
+    :param session: Session
+    :param source_names: dict {ImportSource.id: name}, adds metrics of finished runs of every source and table
+    :return: unicode
+    """
+    runs_count = OrderedDict(
+        ((table, status), count) for table, status, count in
+        session.query(ImportRun.table_name, ImportRun.status, func.count(ImportRun.id))
+        .group_by(ImportRun.table_name, ImportRun.status).order_by(ImportRun.table_name, ImportRun.status))
+    totals = {}
+    for table_name, name, key, value in session.query(ImportMetricTotal.table_name, ImportMetricTotal.name,
+                                                      ImportMetricTotal.key, ImportMetricTotal.value):
+        totals.setdefault(table_name, []).append((name, key, value))
+    table_metrics = OrderedDict()
+    counter_sums = [func.coalesce(func.sum(getattr(ImportRun, counter)), 0) for counter in COUNTERS]
+    for row in session.query(ImportRun.table_name, *counter_sums).group_by(ImportRun.table_name)\
+            .order_by(ImportRun.table_name):
+        metrics = table_metrics[row[0]] = ImportMetrics.from_totals(totals.get(row[0], []))
+        metrics.counters.update(zip(COUNTERS, row[1:]))
+    last_runs = OrderedDict((table, import_run) for (table,), import_run
+                            in get_last_runs(session, [ImportRun.table_name]).items())
+
+    # (source name, table): [rows read, seconds], summed over finished runs
+    source_totals = OrderedDict()
+    last_source_runs = OrderedDict()
+    if source_names:
+        finished_source_runs = (ImportRun.source_id.in_(source_names.keys()), ImportRun.status == u'finished')
+        # run duration computed by SQLite, with millisecond precision
+        seconds = (func.julianday(ImportRun.date_finished) - func.julianday(ImportRun.date_started)) * 86400
+        for source_id, table, rows_read, run_seconds in session.query(
+                ImportRun.source_id, ImportRun.table_name, func.sum(ImportRun.rows_read), func.sum(seconds))\
+                .filter(*finished_source_runs).group_by(ImportRun.source_id, ImportRun.table_name)\
+                .order_by(ImportRun.source_id, ImportRun.table_name):
+            source_totals[(source_names[source_id], table)] = [rows_read, run_seconds or 0.0]
+        for (source_id, table), import_run in get_last_runs(session, [ImportRun.source_id, ImportRun.table_name],
+                                                            *finished_source_runs).items():
+            last_source_runs[(source_names[source_id], table)] = import_run
+
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        lines.append(u'# HELP {0} {1}'.format(name, help_text))
+        lines.append(u'# TYPE {0} {1}'.format(name, metric_type))
+        for suffix, labels, value in samples:
+            lines.append(u'{0}{1}{{{2}}} {3}'.format(name, suffix, format_labels(labels), repr(float(value))))
+
+    add_metric('csv_import_runs_total', 'counter', 'Number of import runs.',
+               [('', [('table', table), ('status', status)], value) for (table, status), value in runs_count.items()])
+    add_metric('csv_import_rows_total', 'counter', 'Number of CSV rows by import result.',
+               [('', [('table', table), ('result', counter[len('rows_'):])], value)
+                for table, metrics in table_metrics.items() for counter, value in metrics.counters.items()])
+    add_metric('csv_import_rejected_total', 'counter', 'Number of rejected CSV rows and fields by reason.',
+               [('', [('table', table), ('reason', reason)], value)
+                for table, metrics in table_metrics.items() for reason, value in sorted(metrics.rejected.items())])
+    add_metric('csv_import_stage_seconds_total', 'counter', 'Time spent in import stages.',
+               [('', [('table', table), ('stage', stage)], seconds)
+                for table, metrics in table_metrics.items() for stage, seconds in metrics.timings.items()])
+
+    histogram_samples = []
+    for table, metrics in table_metrics.items():
+        cumulative_count = 0
+        for upper_bound, value in zip(BATCH_WRITE_BUCKETS + (float('inf'),), metrics.batch_write_buckets):
+            cumulative_count += value
+            bucket_label = u'+Inf' if upper_bound == float('inf') else repr(upper_bound)
+            histogram_samples.append(('_bucket', [('table', table), ('le', bucket_label)], cumulative_count))
+        histogram_samples.append(('_sum', [('table', table)], metrics.batch_write_sum))
+        histogram_samples.append(('_count', [('table', table)], metrics.batch_write_count))
+    add_metric('csv_import_batch_write_seconds', 'histogram', 'Latency of writing one batch of rows.',
+               histogram_samples)
+
+    add_metric('csv_import_last_run_timestamp_seconds', 'gauge', 'Start time of the last import run.',
+               [('', [('table', table)], calendar.timegm(import_run.date_started.timetuple()))
+                for table, import_run in last_runs.items()])
+    add_metric('csv_import_last_run_duration_seconds', 'gauge', 'Duration of the last import run.',
+               [('', [('table', table)], import_run.get_duration())
+                for table, import_run in last_runs.items() if import_run.date_finished])
+    add_metric('csv_import_last_run_rows_per_second', 'gauge', 'Rows read per second in the last import run.',
+               [('', [('table', table)], import_run.get_rows_per_second())
+                for table, import_run in last_runs.items() if import_run.date_finished])
+
+    if source_names:
+        add_metric('csv_import_source_rows_total', 'counter', 'Number of CSV rows read by finished runs of source.',
+                   [('', [('source', source), ('table', table)], rows_read)
+                    for (source, table), (rows_read, seconds) in source_totals.items()])
+        add_metric('csv_import_source_seconds_total', 'counter', 'Duration of finished runs of source.',
+                   [('', [('source', source), ('table', table)], seconds)
+                    for (source, table), (rows_read, seconds) in source_totals.items()])
+        add_metric('csv_import_source_last_run_rows_per_second', 'gauge',
+                   'Rows read per second in the last finished run of source.',
+                   [('', [('source', source), ('table', table)], import_run.get_rows_per_second())
+                    for (source, table), import_run in last_source_runs.items()])
+        add_metric('csv_import_source_last_run_lag_seconds', 'gauge',
+                   'Seconds between modification of file and end of the last finished run of source.',
+                   [('', [('source', source), ('table', table)], import_run.get_lag())
+                    for (source, table), import_run in last_source_runs.items() if import_run.file_date])
+    return u'\n'.join(lines) + u'\n'
@@ -0,0 +1,478 @@
+import argparse
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from multiprocessing import Pipe, Process
+from Queue import Queue
+from sqlalchemy import func
+from CsvImporter.models.database import Session, configure_session
+from CsvImporter.models.models import ImportedFile, ImportRun, ImportSource
+from CsvImporter.utility.csv_importer import DEFAULT_BATCH_SIZE, DEFAULT_TRANSACTION_SIZE, DEVICE_CONTENT_FIELDS, \
+    DEVICE_FIELDS, ChunkRowParser, CsvImporter
+from CsvImporter.utility.file_state import get_file_stat
+from CsvImporter.utility.helper import iter_chunks, now
+from CsvImporter.utility.import_jobs import IMPORT_METHODS
+from CsvImporter.utility.import_metrics import ImportMetrics
+from CsvImporter.utility.parallel_import import parse_rows
+from CsvImporter.utility.source_readers import SOURCE_READERS, detect_compression, open_source
+from CsvImporter.utility.validation_index import ValidationIndex
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_POLL_INTERVAL = 10
+# parsed chunks buffered per reader process, bounds memory of sources waiting for the writer
+READ_AHEAD_CHUNKS = 20
+# assumed import speed used for weighing waiting time of files against their size
+ESTIMATED_BYTES_PER_SECOND = 1024 * 1024
+
+# name of target table: (ImportSource attribute with file name, names of row columns, method parsing single row),
+# in import order
+SOURCE_FILES = OrderedDict([
+    ('device', ('device_file_name', DEVICE_FIELDS, 'parse_device_row')),
+    ('devicecontent', ('content_file_name', DEVICE_CONTENT_FIELDS, 'parse_device_content_row')),
+])
+
+
+class FileRead(object):
+    """
+    Changed file of source, read from start_offset. file_size and file_mtime are taken before reading, so that only
+    rows which were in file then are committed in ImportedFile.
+    """
+    def __init__(self, table_name, file_path, file_size, file_mtime, start_offset, start_row_number):
+        self.table_name = table_name
+        self.file_path = file_path
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.start_offset = start_offset
+        self.start_row_number = start_row_number
+
+
+def read_source_files(file_reads, delimiter, file_format, use_mmap, chunk_rows, connection):
+    """
+    Reader process function, reads and parses changed files of source in order. For every file ('open', format name,
+    compression) or ('failed', error message) is sent to writer, then ('chunk', read bytes, chunk tuple as returned by
+    parse_rows) for every chunk_rows rows and ('end', read seconds), or ('failed', error message) after chunks of rows
+    read before a reading error.
+    :param file_reads: list of FileRead
+    :param delimiter: default CSV delimiter of source
+    :param file_format: format_name of reader from SOURCE_READERS or None
+    :param use_mmap: boolean, read uncompressed CSV files mapped into memory
+    :param chunk_rows: integer
+    :param connection: sending Connection of Pipe
+    """
+    # messages are sent by thread, so that files are parsed ahead while writer is busy with other source
+    messages = Queue(READ_AHEAD_CHUNKS)
+    sender = threading.Thread(target=send_messages, args=(messages, connection))
+    sender.start()
+    try:
+        row_parser = ChunkRowParser()
+        for file_read in file_reads:
+            file_name_attribute, fields, parse_method_name = SOURCE_FILES[file_read.table_name]
+            try:
+                source = open_source(file_read.file_path, delimiter, fields, file_format)
+            except Exception as e:
+                messages.put(('failed', unicode(e)))
+                continue
+            messages.put(('open', source.reader.format_name, source.compression))
+            file_reader = ChunkRowParser(use_mmap=use_mmap)
+            rows = file_reader.metrics.timed_iter('read', file_reader.read_source_rows(source, file_read.start_offset))
+            for chunk in iter_chunks(rows, chunk_rows):
+                row_parser.row_errors = []
+                row_parser.metrics = ImportMetrics()
+                messages.put(('chunk', file_reader.bytes_read, parse_rows(row_parser, parse_method_name, chunk)))
+            if file_reader.read_failed:
+                messages.put(('failed', u'Reading failed after {0} bytes'.format(file_reader.bytes_read)))
+            else:
+                messages.put(('end', file_reader.metrics.timings['read']))
+    finally:
+        messages.put(None)
+        sender.join()
+
+
+def send_messages(messages, connection):
+    for message in iter(messages.get, None):
+        connection.send(message)
+
+
+class SourceImporter(CsvImporter):
+    """
+    CsvImporter of one ImportSource used by ImportScheduler. Changed files of source are read and parsed by reader
+    process of the source, this importer only validates and writes their rows in the writer process.
+    """
+    def __init__(self, import_source, **importer_options):
+        """
+        :param import_source: ImportSource
+        :param importer_options: CsvImporter keyword arguments, import is always incremental
+        """
+        super(SourceImporter, self).__init__(import_source.csv_store_path, import_source.device_file_name,
+                                             import_source.content_file_name, import_source.csv_delimiter,
+                                             incremental=True, **importer_options)
+        self.source_id = import_source.id
+        self.source_name = import_source.name
+        self.file_format = import_source.file_format
+        self.file_reads = []
+        # FileRead being written
+        self.file_read = None
+        self.connection = None
+        self.reader = None
+
+    def check_files(self):
+        """
+        Method used for finding files of source which changed since their last import, missing files are skipped.
+        :return: list of FileRead
+        """
+        self.file_reads = []
+        for table_name, (file_name_attribute, fields, parse_method_name) in SOURCE_FILES.items():
+            file_name = getattr(self, file_name_attribute)
+            if not file_name:
+                continue
+            file_path = self.get_file_path(file_name)
+            try:
+                file_size, file_mtime = get_file_stat(file_path)
+                imported_file = Session.query(ImportedFile).filter(ImportedFile.file_path == file_path).first()
+                import_start = self.get_import_start(imported_file, file_path, file_size, file_mtime,
+                                                     detect_compression(file_path) is None)
+            except (IOError, OSError):
+                continue
+            if import_start is not None:
+                self.file_reads.append(FileRead(table_name, file_path, file_size, file_mtime, *import_start))
+        return self.file_reads
+
+    def get_priority(self, current_time):
+        """
+        Method used for ordering sources waiting for the writer by response ratio: waiting time of the oldest changed
+        file plus estimated import time of changed bytes, divided by the estimate. Small files go first, but priority
+        of big files grows while they wait, so they are not overtaken forever.
+        :param current_time: timestamp
+        :return: float, at least 1.0
+        """
+        pending_bytes = sum(file_read.file_size - file_read.start_offset for file_read in self.file_reads)
+        estimated_seconds = max(pending_bytes, 1) / float(ESTIMATED_BYTES_PER_SECOND)
+        waiting_seconds = max(0.0, current_time - min(file_read.file_mtime for file_read in self.file_reads))
+        return (waiting_seconds + estimated_seconds) / estimated_seconds
+
+    def start_reader(self):
+        self.connection, reader_connection = Pipe(duplex=False)
+        self.reader = Process(target=read_source_files,
+                              args=(self.file_reads, self.default_csv_delimiter, self.file_format, self.use_mmap,
+                                    self.batch_size, reader_connection),
+                              name='ImportSourceReader-{0}'.format(self.source_id))
+        self.reader.daemon = True
+        self.reader.start()
+        # reader process has the only sending end, so that receiving fails with EOFError when reader exits
+        reader_connection.close()
+
+    def stop_reader(self):
+        if self.reader.is_alive():
+            # reader can be blocked on sending after failed write
+            self.reader.terminate()
+        self.reader.join()
+        self.connection.close()
+
+    def import_files(self):
+        """
+        Method used for writing changed files of source read by reader process.
+        """
+        try:
+            for file_read in self.file_reads:
+                self.file_read = file_read
+                getattr(self, IMPORT_METHODS[file_read.table_name])()
+        finally:
+            self.stop_reader()
+
+    def get_message(self):
+        """
+        :return: next message of reader process, raises IOError if reader exited without sending it
+        """
+        try:
+            return self.connection.recv()
+        except EOFError:
+            self.reader.join()
+            raise IOError(u'Reader of source {0} exited with code {1}'.format(self.source_name, self.reader.exitcode))
+
+    def get_chunk_results(self):
+        """
+        Generator of chunk tuples of file being written, sets read_failed if reader failed to read the whole file.
+        """
+        while True:
+            message = self.get_message()
+            if message[0] == 'end':
+                self.metrics.add_time('read', message[1])
+                return
+            if message[0] == 'failed':
+                log.error(u'Error when reading CSV file {0} of source {1}: {2}'.format(
+                    self.file_read.file_path, self.source_name, message[1]))
+                self.read_failed = True
+                return
+            self.bytes_read = message[1]
+            yield message[2]
+
+    def start_import_run(self, model, file_path):
+        import_run = super(SourceImporter, self).start_import_run(model, file_path)
+        import_run.source_id = self.source_id
+        import_run.file_date = datetime.utcfromtimestamp(self.file_read.file_mtime)
+        Session.flush()
+        return import_run
+
+    def import_file_rows(self, file_name, file_path, model, fields, parse_method_name, validate_row, write_row):
+        """
+        Rows read before a reading error are written, but the run fails and state of the file is not saved, so that
+        the next check of the source imports the rest of the file again.
+        :return: tuple (ImportRun status, number of written rows)
+        """
+        self.read_failed = False
+        message = self.get_message()
+        if message[0] == 'failed':
+            log.error(u'Error when reading CSV file {0} of source {1}: {2}'.format(file_name, self.source_name,
+                                                                                   message[1]))
+            return u'failed', 0
+        format_name, compression = message[1:]
+        log.info(u'Reading {0} of source {1} as {2}, {3}'.format(file_name, self.source_name, format_name,
+                                                                 compression or u'uncompressed'))
+        self.bytes_read = self.file_read.start_offset
+        self.bytes_total = self.file_read.file_size if compression is None else None
+        parsed_rows = self.get_validated_chunk_rows(model, self.get_chunk_results(), validate_row,
+                                                    self.file_read.start_row_number)
+        rows_count = self.write_rows(model, parsed_rows, write_row)
+        if self.read_failed:
+            return u'failed', rows_count
+        imported_file = Session.query(ImportedFile).filter(ImportedFile.file_path == file_path).first()
+        self.save_file_state(imported_file, file_path, self.file_read.file_size, self.file_read.file_mtime)
+        return u'finished', rows_count
+
+
+class ImportScheduler(object):
+    """
+    Imports changed files of ImportSources whose schedule interval passed. Up to max_concurrent sources are read and
+    parsed at the same time by reader processes, their rows are validated and written by this process only, one
+    source at a time in order of priority, so that SQLite database has a single writer and rows of one source are
+    written in one order with the same validation index.
+    """
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, **importer_options):
+        """
+        :param max_concurrent: integer, maximum number of sources being read, including the one being written
+        :param importer_options: CsvImporter keyword arguments, e.g. bulk_upsert=True
+        """
+        self.max_concurrent = max_concurrent
+        self.importer_options = importer_options
+        # shared by importers of all sources, loaded again after failed import
+        self.validation_index = None
+
+    def get_due_sources(self, current_date):
+        """
+        :param current_date: datetime
+        :return: list of enabled ImportSource not checked for schedule_interval seconds
+        """
+        return [import_source for import_source in Session.query(ImportSource)
+                .filter(ImportSource.enabled.is_(True)).order_by(ImportSource.id)
+                if import_source.date_last_checked is None or
+                import_source.date_last_checked + timedelta(seconds=import_source.schedule_interval) <= current_date]
+
+    def check_due_sources(self, excluded_source_ids):
+        """
+        Method used for checking files of due sources and saving time of the check.
+        :param excluded_source_ids: set of ids of sources which are not checked, e.g. already imported
+        :return: list of SourceImporter of sources with changed files
+        """
+        current_date = now()
+        source_importers = []
+        with Session.begin():
+            for import_source in self.get_due_sources(current_date):
+                if import_source.id in excluded_source_ids:
+                    continue
+                source_importer = SourceImporter(import_source, **self.importer_options)
+                if source_importer.check_files():
+                    source_importers.append(source_importer)
+                import_source.date_last_checked = current_date
+        return source_importers
+
+    def run_once(self):
+        """
+        Method used for importing due sources until none is due. Sources which become due meanwhile are imported too,
+        but every source at most once.
+        :return: number of imported sources
+        """
+        self.validation_index = None
+        pending = []
+        active = deque()
+        seen_source_ids = set()
+        while True:
+            for source_importer in self.check_due_sources(seen_source_ids):
+                pending.append(source_importer)
+                seen_source_ids.add(source_importer.source_id)
+            current_time = time.time()
+            pending.sort(key=lambda source_importer: source_importer.get_priority(current_time), reverse=True)
+            while pending and len(active) < self.max_concurrent:
+                source_importer = pending.pop(0)
+                source_importer.start_reader()
+                active.append(source_importer)
+            if not active:
+                return len(seen_source_ids)
+            self.write_source(active.popleft())
+
+    def write_source(self, source_importer):
+        """
+        :param source_importer: SourceImporter with started reader
+        """
+        if self.validation_index is None:
+            self.validation_index = ValidationIndex().load()
+        source_importer.validation_index = self.validation_index
+        try:
+            source_importer.import_files()
+        except Exception:
+            # rows of failed file which were rolled back are in validation index too
+            self.validation_index = None
+            log.exception(u'Import of source {0} failed'.format(source_importer.source_name))
+
+    def run(self, poll_interval=DEFAULT_POLL_INTERVAL):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                log.exception(u'Scheduled import failed')
+            time.sleep(poll_interval)
+
+
+def save_import_source(name, **values):
+    """
+    Method used for adding ImportSource or changing the one with the same name.
+    :param name: unicode
+    :param values: ImportSource column values, values which are None are not changed
+    :return: ImportSource
+    """
+    with Session.begin():
+        import_source = Session.query(ImportSource).filter(ImportSource.name == name).first()
+        if not import_source:
+            import_source = ImportSource()
+            import_source.name = name
+            Session.add(import_source)
+        for column_name, value in values.items():
+            if value is not None:
+                setattr(import_source, column_name, value)
+    return import_source
+
+
+def get_source_summaries(session, current_time=None):
+    """
+    Method used for getting state of every ImportSource file: status of its last import run, throughput and lag of
+    its last finished import run, and waiting time of file change which was not imported yet.
+    :param session: Session
+    :param current_time: timestamp, now by default
+    :return: list of dicts
+    """
+    current_time = current_time or time.time()
+    last_run_ids = session.query(func.max(ImportRun.id))\
+        .filter(ImportRun.source_id.isnot(None))\
+        .group_by(ImportRun.source_id, ImportRun.table_name)
+    last_finished_run_ids = last_run_ids.filter(ImportRun.status == u'finished')
+    last_runs = dict(((import_run.source_id, import_run.table_name), import_run)
+                     for import_run in session.query(ImportRun).filter(ImportRun.id.in_(last_run_ids.subquery())))
+    last_finished_runs = dict(((import_run.source_id, import_run.table_name), import_run) for import_run
+                              in session.query(ImportRun).filter(ImportRun.id.in_(last_finished_run_ids.subquery())))
+
+    summaries = []
+    for import_source in session.query(ImportSource).order_by(ImportSource.id):
+        source_importer = SourceImporter(import_source)
+        files = []
+        for table_name, (file_name_attribute, fields, parse_method_name) in SOURCE_FILES.items():
+            file_name = getattr(import_source, file_name_attribute)
+            if not file_name:
+                continue
+            last_run = last_runs.get((import_source.id, table_name))
+            last_finished_run = last_finished_runs.get((import_source.id, table_name))
+            try:
+                file_mtime = get_file_stat(source_importer.get_file_path(file_name))[1]
+            except OSError:
+                file_mtime = None
+            waiting = file_mtime is not None and (
+                not last_finished_run or datetime.utcfromtimestamp(file_mtime) > last_finished_run.file_date)
+            files.append({
+                'table': table_name,
+                'file_name': file_name,
+                'last_status': last_run.status if last_run else None,
+                'last_started': last_run.date_started if last_run else None,
+                'last_finished': last_finished_run.date_finished if last_finished_run else None,
+                'rows_per_second': last_finished_run.get_rows_per_second() if last_finished_run else None,
+                'lag_seconds': last_finished_run.get_lag() if last_finished_run else None,
+                'waiting_seconds': max(0.0, current_time - file_mtime) if waiting else None,
+            })
+        summaries.append({
+            'id': import_source.id,
+            'name': import_source.name,
+            'enabled': import_source.enabled,
+            'schedule_interval': import_source.schedule_interval,
+            'last_checked': import_source.date_last_checked,
+            'files': files,
+        })
+    return summaries
+
+
+def format_seconds(seconds):
+    return u'-' if seconds is None else u'{0:.0f}s'.format(seconds)
+
+
+if __name__ == '__main__':
+    def text_arg(value):
+        return value.decode(sys.getfilesystemencoding())
+
+    arg_parser = argparse.ArgumentParser(description='Import files of configured sources.')
+    subparsers = arg_parser.add_subparsers(dest='command')
+    add_parser = subparsers.add_parser('add', help='add source or change source with the same name')
+    add_parser.add_argument('name', type=text_arg)
+    add_parser.add_argument('csv_store_path', nargs='?', type=text_arg,
+                            help='directory of source files, required for new source')
+    add_parser.add_argument('--device-file', type=text_arg, help='name of Device file')
+    add_parser.add_argument('--content-file', type=text_arg, help='name of DeviceContent file')
+    add_parser.add_argument('--delimiter', type=text_arg, help='default CSV delimiter (default: ,)')
+    add_parser.add_argument('--format', type=text_arg,
+                            choices=[unicode(reader_class.format_name) for reader_class in SOURCE_READERS],
+                            help='format of files, detected from file content by default')
+    add_parser.add_argument('--interval', type=int, help='seconds between checks of files (default: 3600)')
+    add_parser.add_argument('--enable', dest='enabled', action='store_true', default=None)
+    add_parser.add_argument('--disable', dest='enabled', action='store_false')
+    subparsers.add_parser('list', help='show sources with throughput and lag of their last imports')
+    run_parser = subparsers.add_parser('run', help='import changed files of due sources')
+    run_parser.add_argument('--max-concurrent', type=int, default=DEFAULT_MAX_CONCURRENT,
+                            help='maximum number of sources read at the same time (default: {0})'.format(
+                                DEFAULT_MAX_CONCURRENT))
+    run_parser.add_argument('--bulk', action='store_true', help='write rows with bulk insert/update statements')
+    run_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    run_parser.add_argument('--transaction-size', type=int, default=DEFAULT_TRANSACTION_SIZE)
+    run_parser.add_argument('--mmap', action='store_true',
+                            help='read uncompressed CSV files mapped into memory instead of line by line')
+    run_parser.add_argument('--error-log', choices=['full', 'summary'], default='full')
+    run_parser.add_argument('--once', action='store_true', help='import due sources and exit')
+    run_parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help='seconds between checks for due sources (default: {0})'.format(
+                                DEFAULT_POLL_INTERVAL))
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    configure_session('import')
+    if args.command == 'add':
+        if not args.csv_store_path and not Session.query(ImportSource).filter(ImportSource.name == args.name).count():
+            arg_parser.error('csv_store_path is required for new source')
+        save_import_source(args.name, csv_store_path=args.csv_store_path, device_file_name=args.device_file,
+                           content_file_name=args.content_file, csv_delimiter=args.delimiter,
+                           file_format=args.format, schedule_interval=args.interval, enabled=args.enabled)
+    elif args.command == 'list':
+        for summary in get_source_summaries(Session):
+            print(u'{0} (every {1}s, {2}), last checked: {3}'.format(
+                summary['name'], summary['schedule_interval'], 'enabled' if summary['enabled'] else 'disabled',
+                summary['last_checked']))
+            for file_summary in summary['files']:
+                print(u'    {0}: {1}, {2:.0f} rows/sec, lag: {3}, waiting: {4}'.format(
+                    file_summary['file_name'], file_summary['last_status'], file_summary['rows_per_second'] or 0,
+                    format_seconds(file_summary['lag_seconds']), format_seconds(file_summary['waiting_seconds'])))
+    else:
+        scheduler = ImportScheduler(args.max_concurrent, bulk_upsert=args.bulk, batch_size=args.batch_size,
+                                    transaction_size=args.transaction_size, use_mmap=args.mmap,
+                                    write_error_log=args.error_log == 'full')
+        if args.once:
+            scheduler.run_once()
+        else:
+            scheduler.run(args.poll_interval)
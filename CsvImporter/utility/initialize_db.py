@@ -1,9 +1,21 @@
+import argparse
+import re
 import transaction
 from CsvImporter.models.database import Session, init_db
-from CsvImporter.models.models import ImporterSettings
+from CsvImporter.models.models import ImporterSettings, Device, DeviceContent
+from CsvImporter.utility.dashboard import has_aggregates, rebuild_aggregates
+from CsvImporter.utility.date_parser import get_utc_offset
 
+UTC_OFFSET_RE = re.compile(r'^(Z|[+-]\d{2}(?::?\d{2})?)$')
 
-def initialize():
+
+def initialize(expire_date_utc_offset=None):
+    """
+    Method used for creating tables, missing columns and indexes and importer settings. Expire dates stored in local
+    time of their files by older versions are converted to UTC when UTC offset of the files is given.
+    :param expire_date_utc_offset: timedelta or None
+    :return: True if expire dates are stored in UTC
+    """
     init_db()
     with transaction.manager:
         settings = Session.query(ImporterSettings).first()
@@ -12,6 +24,56 @@ def initialize():
             settings.id = 1
             Session.add(settings)
             Session.flush()
+    if has_local_expire_dates(Session) and expire_date_utc_offset is not None:
+        convert_expire_dates_to_utc(Session, expire_date_utc_offset)
+    return not has_local_expire_dates(Session)
+
+
+def has_local_expire_dates(session):
+    """
+    :return: True if expire dates were stored in local time and are not converted to UTC yet
+    """
+    settings = session.query(ImporterSettings).first()
+    return settings is not None and not settings.expire_dates_utc
+
+
+def convert_expire_dates_to_utc(session, utc_offset):
+    """
+    Method used for converting stored expire dates from local time to UTC in one transaction. Dates are shifted by
+    SQLite date functions, fraction of seconds is kept as stored, and dashboard aggregates of expire days are rebuilt.
+    :param session: Session with autocommit=True
+    :param utc_offset: timedelta, UTC offset of local time of stored dates
+    """
+    modifier = u'{0:+d} seconds'.format(-int(utc_offset.total_seconds()))
+    with session.begin(subtransactions=True):
+        for model in (Device, DeviceContent):
+            table = model.__table__
+            if utc_offset:
+                session.execute(
+                    u'UPDATE {0} SET expire_date = strftime(\'%Y-%m-%d %H:%M:%S\', expire_date, :modifier) || '
+                    u'substr(expire_date, 20) WHERE expire_date IS NOT NULL'.format(table.name),
+                    {'modifier': modifier})
+                if has_aggregates(session, table.name):
+                    rebuild_aggregates(session, model)
+        session.execute(ImporterSettings.__table__.update().values(expire_dates_utc=True))
+
+
+def parse_utc_offset(value):
+    """
+    :param value: string, e.g. Z, +01, +01:00 or -0530
+    :return: timedelta
+    """
+    if not UTC_OFFSET_RE.match(value):
+        raise argparse.ArgumentTypeError(u'invalid UTC offset: {0}'.format(value))
+    return get_utc_offset(value)
+
 
 if __name__ == '__main__':
-    initialize()
+    arg_parser = argparse.ArgumentParser(description='Create database tables and importer settings.')
+    arg_parser.add_argument('--expire-date-utc-offset', type=parse_utc_offset,
+                            help='convert expire dates stored in local time by older versions to UTC, OFFSET is '
+                                 'UTC offset of the imported files, e.g. +01:00')
+    args = arg_parser.parse_args()
+    if not initialize(args.expire_date_utc_offset):
+        arg_parser.error('expire dates are stored in local time, give UTC offset of the imported files with '
+                         '--expire-date-utc-offset to convert them to UTC')
@@ -0,0 +1,110 @@
+import csv
+import mmap
+import os
+
+# size of range of records checked for non-ASCII bytes at once
+BLOCK_BYTES = 1024 * 1024
+ASCII_BYTES = ''.join(chr(code) for code in range(128))
+
+
+def is_ascii(value):
+    """
+    :param value: string
+    :return: True if string contains only ASCII bytes
+    """
+    return not value.translate(None, ASCII_BYTES)
+
+
+class MmapCsvReader(object):
+    """
+    Reader of delimited rows of uncompressed file mapped into memory, returns rows equal to rows of CsvSourceReader.
+    Records are parsed by csv module directly from mmap, without Python generator encoding every line. Cells are
+    decoded from UTF-8 only in ranges of file which contain non-ASCII bytes, elsewhere cells are kept as ASCII str,
+    which compares, hashes and formats the same as unicode in Python 2. Cells stored in unicode columns are
+    converted with unicode() by row parser.
+    Every row is returned with byte offset of the next record, so reading can stop and resume at record boundaries.
+    """
+    format_name = 'csv'
+
+    def __init__(self, delimiter, quotechar='"'):
+        self.delimiter = str(delimiter)
+        self.quotechar = quotechar
+
+    @classmethod
+    def from_source_reader(cls, source_reader):
+        """
+        :param source_reader: reader of Source
+        :return: MmapCsvReader or None if source reader is not CSV reader with default dialect
+        """
+        csv_options = getattr(source_reader, 'csv_options', None)
+        if source_reader.format_name != 'csv' or csv_options is None or csv_options:
+            return None
+        return cls(source_reader.delimiter)
+
+    def read_file_records(self, file_path, start=0, end=None):
+        """
+        Generator of rows of records which start inside byte range [start, end) of file.
+        :param file_path: string
+        :param start: integer, offset of record
+        :param end: integer or None for end of file
+        :return: generator of tuples (offset of next record, row(list of cells))
+        """
+        with open(file_path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                # empty file can not be mapped
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for record in self.read_records(buf, start, end):
+                    yield record
+            finally:
+                buf.close()
+
+    def read_chunk_rows(self, file_path, start, end):
+        """
+        Same as read_file_records, but range is read from the first line which starts in it, see
+        parallel_import.find_line_start.
+        :return: generator of rows(lists of cells)
+        """
+        with open(file_path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if start:
+                    # skip rest of the record started in previous range
+                    line_end = buf.find('\n', start - 1)
+                    start = len(buf) if line_end < 0 else line_end + 1
+                for next_offset, row in self.read_records(buf, start, end):
+                    yield row
+            finally:
+                buf.close()
+
+    def read_records(self, buf, start=0, end=None):
+        """
+        :param buf: mmap, its position is moved
+        :param start: integer, offset of first record
+        :param end: integer, records starting at or after end are not read, None for end of buffer
+        :return: generator of tuples (offset of next record, row(list of cells))
+        """
+        buf_size = len(buf)
+        end = buf_size if end is None else min(end, buf_size)
+        buf.seek(start)
+        # mmap.readline splits on '\n' only, same as iterating file, and csv.reader reads next line only when record
+        # continues, so position of buffer is offset of the next record
+        rows = csv.reader(iter(buf.readline, ''), delimiter=self.delimiter, quotechar=self.quotechar)
+        tell = buf.tell
+        offset = start
+        while offset < end:
+            line_end = buf.find('\n', min(offset + BLOCK_BYTES, end) - 1)
+            block_end = buf_size if line_end < 0 else line_end + 1
+            block_is_ascii = is_ascii(buf[offset:block_end])
+            while offset < block_end:
+                row = next(rows, None)
+                if row is None:
+                    return
+                offset = tell()
+                if block_is_ascii and offset <= block_end:
+                    yield offset, map(str.strip, row)
+                else:
+                    yield offset, [unicode(cell.strip(), 'utf-8') for cell in row]
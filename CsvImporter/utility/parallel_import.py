@@ -0,0 +1,149 @@
+import os
+import time
+from collections import deque
+from CsvImporter.utility.mmap_reader import MmapCsvReader
+
+# size of byte range parsed by one worker task
+PARALLEL_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def get_chunk_ranges(file_path, start_offset=0, chunk_bytes=PARALLEL_CHUNK_BYTES):
+    """
+    Method used for splitting file into byte ranges. Every record belongs to the range in which it starts, see
+    parse_chunk.
+    :param file_path: string
+    :param start_offset: integer, offset of the first record
+    :param chunk_bytes: integer
+    :return: list of tuples (start, end)
+    """
+    file_size = os.path.getsize(file_path)
+    return [(start, min(start + chunk_bytes, file_size)) for start in range(start_offset, file_size, chunk_bytes)]
+
+
+def find_line_start(file_path, offset):
+    """
+    :param file_path: string
+    :param offset: integer
+    :return: offset of the first line which starts at or after offset
+    """
+    if not offset:
+        return 0
+    with open(file_path, 'rb') as f:
+        f.seek(offset - 1)
+        f.readline()
+        return f.tell()
+
+
+def read_range_records(source_reader, file_path, start, end):
+    """
+    Generator of rows of records which start inside byte range [start, end) of file, same as
+    MmapCsvReader.read_file_records for other source readers. Source readers read next line only when record
+    continues, so position of file after row is offset of the next record, and record with quoted line breaks which
+    starts before end is read to its end.
+    :param source_reader: reader from source_readers, e.g. CsvSourceReader
+    :param file_path: string
+    :param start: integer, offset of record
+    :param end: integer
+    :return: generator of tuples (offset of next record, row(list of cells))
+    """
+    if start >= end:
+        return
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        for row in source_reader.read_rows(iter(f.readline, '')):
+            next_offset = f.tell()
+            yield next_offset, row
+            if next_offset >= end:
+                break
+
+
+def get_record_rows(records, next_offset):
+    """
+    Generator of rows of records, offset of the next record is kept in next_offset.
+    :param records: iterable of tuples (offset of next record, row)
+    :param next_offset: list with offset of the first record, it is replaced by offset of the next record after every
+        row
+    :return: generator of rows
+    """
+    for next_offset[0], row in records:
+        yield row
+
+
+def parse_chunk(task):
+    """
+    Worker process function, parses rows of one byte range. Range is parsed from the first line which starts in it,
+    which is not start of record when quoted field of record of previous range continues on that line, so offsets are
+    returned for checking ranges against each other, see CsvImporter.get_aligned_chunk_results.
+    :param task: tuple (row parser class, parse method name, file path, source reader or MmapCsvReader, start, end)
+    :return: tuple, same as parse_range
+    """
+    parser_class, parse_method_name, file_path, source_reader, start, end = task
+    return parse_range(parser_class, parse_method_name, file_path, source_reader, find_line_start(file_path, start),
+                       end)
+
+
+def parse_range(parser_class, parse_method_name, file_path, source_reader, start, end):
+    """
+    Method used for parsing records which start inside byte range [start, end) of file.
+    :param parser_class: ChunkRowParser
+    :param parse_method_name: name of row parser method used for parsing single row
+    :param file_path: string
+    :param source_reader: reader of Source or MmapCsvReader
+    :param start: integer, offset of record
+    :param end: integer
+    :return: tuple (offset of the first record,
+                    offset of the record after the last record read,
+                    tuple (number of CSV rows in range,
+                           list of (row number, parsed row) for valid rows,
+                           list of (row number, message, args, function name) for rejected fields,
+                           dict {stage: seconds} of ImportMetrics timings,
+                           True if reading stopped on error before the end of range))
+        row numbers are relative to the start of the range
+    """
+    row_parser = parser_class()
+    if isinstance(source_reader, MmapCsvReader):
+        records = source_reader.read_file_records(file_path, start, end)
+    else:
+        records = read_range_records(source_reader, file_path, start, end)
+    next_offset = [start]
+    rows = row_parser.read_until_error(get_record_rows(records, next_offset))
+    chunk_result = parse_rows(row_parser, parse_method_name, row_parser.metrics.timed_iter('read', rows))
+    return start, next_offset[0], chunk_result
+
+
+def parse_rows(row_parser, parse_method_name, rows):
+    """
+    Method used for parsing rows with parser which collects rejected fields instead of logging them.
+    :param row_parser: ChunkRowParser
+    :param parse_method_name: name of row parser method used for parsing single row
+    :param rows: iterable of rows(lists)
+    :return: tuple, same as chunk result of parse_range
+    """
+    parse_row = getattr(row_parser, parse_method_name)
+    rows_count = 0
+    parsed_rows = []
+    for rows_count, row in enumerate(rows, start=1):
+        start_time = time.time()
+        parsed_row = parse_row(row, rows_count)
+        row_parser.metrics.add_time('parse', time.time() - start_time)
+        if parsed_row:
+            parsed_rows.append((rows_count, parsed_row))
+    return rows_count, parsed_rows, row_parser.row_errors, dict(row_parser.metrics.timings), row_parser.read_failed
+
+
+def imap_ordered(pool, function, tasks, max_pending):
+    """
+    Same as Pool.imap, but at most max_pending results are kept in memory.
+    :param pool: multiprocessing.Pool
+    :param function: module level function
+    :param tasks: iterable of function arguments
+    :param max_pending: integer
+    :return: generator of results in tasks order
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -0,0 +1,27 @@
+from collections import Counter
+from sqlalchemy import event
+
+
+class QueryCounter(object):
+    """
+    Context manager counting SQL statements executed on engine, used in benchmarks and checks of query counts.
+    Statements are counted by their first keyword, e.g. SELECT or INSERT, text of statements is not kept, so that
+    counter can stay attached during import of millions of rows.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.counts = Counter()
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.on_before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, 'before_cursor_execute', self.on_before_cursor_execute)
+
+    def on_before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        self.counts[statement.lstrip().split(None, 1)[0].upper() if statement.strip() else u''] += 1
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
@@ -0,0 +1,192 @@
+import logging
+import re
+import threading
+import time
+from Queue import Queue
+from logging.handlers import TimedRotatingFileHandler
+
+# e.g. u'Device in row {0} has invalid expire date: {1}' -> ('invalid', 'expire_date')
+ERROR_KIND_RE = re.compile(r'has (invalid|duplicate) ([A-Za-z ]+)')
+
+DEFAULT_SAMPLE_SIZE = 20
+DEFAULT_FLUSH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 1.0
+# batches waiting for writer thread, flush blocks when writer falls behind, so memory use does not grow with the run
+DEFAULT_MAX_PENDING_BATCHES = 10
+
+log = logging.getLogger(__name__)
+
+error_kinds = {}
+
+
+def get_error_kind(message):
+    """
+    Method used for getting error type and column from row error message, results are cached per message template.
+    :param message: unicode format string passed to CsvImporter.log_row_error
+    :return: tuple (error type, column), e.g. ('invalid', 'expire_date')
+    """
+    try:
+        return error_kinds[message]
+    except KeyError:
+        match = ERROR_KIND_RE.search(message)
+        if match:
+            error_kind = match.group(1), match.group(2).strip().lower().replace(' ', '_')
+        else:
+            error_kind = 'other', 'row'
+        error_kinds[message] = error_kind
+        return error_kind
+
+
+class BatchTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    TimedRotatingFileHandler which can write batch of records with one write and one flush.
+    """
+    def emit_batch(self, records):
+        if not records:
+            return
+        self.acquire()
+        try:
+            if self.shouldRollover(records[0]):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            text = u''.join(u'{0}\n'.format(self.format(record)) for record in records)
+            self.stream.write(text if getattr(self.stream, 'encoding', None) else text.encode('utf-8'))
+            self.flush()
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            self.release()
+
+
+class RowErrorLog(object):
+    """
+    Rejected CSV fields of one import run. Counts per error type and column and first sample_size messages are kept
+    for summary. Events are handed over to background writer thread in batches of flush_size or every flush_interval
+    seconds, so formatting and writing of the error log does not block import. At most max_pending_batches batches
+    wait for the writer, then import waits for it. With write_log=False only summary is kept.
+    """
+    def __init__(self, logger, write_log=True, sample_size=DEFAULT_SAMPLE_SIZE, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, max_pending_batches=DEFAULT_MAX_PENDING_BATCHES):
+        self.logger = logger
+        self.write_log = write_log and logger.isEnabledFor(logging.ERROR)
+        self.sample_size = sample_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.errors_count = 0
+        self.error_type_counts = {}
+        self.column_counts = {}
+        self.samples = []
+        self.pending_events = []
+        self.last_flush_time = time.time()
+        self.queue = Queue(max_pending_batches)
+        self.writer_thread = None
+
+    def add(self, message, row_number, args, func_name):
+        """
+        Method used for adding rejected row field.
+        :param message: unicode format string, {0} is row number and {1}... are args
+        :param row_number: integer
+        :param args: tuple
+        :param func_name: name of function which rejected the field, funcName of its log record
+        """
+        error_type, column = get_error_kind(message)
+        self.errors_count += 1
+        self.error_type_counts[error_type] = self.error_type_counts.get(error_type, 0) + 1
+        self.column_counts[column] = self.column_counts.get(column, 0) + 1
+        if len(self.samples) < self.sample_size:
+            self.samples.append(message.format(row_number, *args))
+        if not self.write_log:
+            return
+
+        event_time = time.time()
+        self.pending_events.append((event_time, message, row_number, args, func_name))
+        if len(self.pending_events) >= self.flush_size or event_time - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_events:
+            return
+        if self.writer_thread is None:
+            self.writer_thread = threading.Thread(target=self.write_events, name='RowErrorLogWriter')
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+        self.queue.put(self.pending_events)
+        self.pending_events = []
+        self.last_flush_time = time.time()
+
+    def close(self):
+        """
+        Method used for writing pending events and stopping writer thread.
+        """
+        self.flush()
+        if self.writer_thread is not None:
+            self.queue.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+
+    def write_events(self):
+        while True:
+            events = self.queue.get()
+            if events is None:
+                return
+            try:
+                self.write_batch(events)
+            except Exception:
+                # writer has to keep taking batches from the bounded queue, otherwise import would wait forever
+                log.exception(u'Error when writing row errors')
+
+    def write_batch(self, events):
+        records = self.make_records(events)
+        for handler in self.get_handlers():
+            handler_records = [record for record in records
+                               if record.levelno >= handler.level and handler.filter(record)]
+            if hasattr(handler, 'emit_batch'):
+                handler.emit_batch(handler_records)
+            else:
+                for record in handler_records:
+                    handler.handle(record)
+
+    def get_handlers(self):
+        # same handlers as Logger.callHandlers uses
+        handlers = []
+        logger = self.logger
+        while logger:
+            handlers.extend(logger.handlers)
+            logger = logger.parent if logger.propagate else None
+        return handlers
+
+    def make_records(self, events):
+        # records differ only in message, time and function name, so they are copied from one record per function
+        # instead of creating each one
+        template_records = {}
+        records = []
+        for event_time, message, row_number, args, func_name in events:
+            template_record = template_records.get(func_name)
+            if template_record is None:
+                template_record = template_records[func_name] = self.logger.makeRecord(
+                    self.logger.name, logging.ERROR, __file__, 0, u'', None, None, func=func_name)
+            record = object.__new__(logging.LogRecord)
+            record.__dict__.update(template_record.__dict__)
+            record.msg = message.format(row_number, *args)
+            record.created = event_time
+            record.msecs = (event_time - int(event_time)) * 1000
+            record.relativeCreated = (event_time - logging._startTime) * 1000
+            records.append(record)
+        return records
+
+    def get_summary(self):
+        """
+        :return: dict {
+            'errors': number of rejected fields,
+            'error_types': dict {error type: count},
+            'columns': dict {column: count},
+            'samples': list of first sample_size messages
+        }
+        """
+        return {
+            'errors': self.errors_count,
+            'error_types': self.error_type_counts,
+            'columns': self.column_counts,
+            'samples': self.samples
+        }
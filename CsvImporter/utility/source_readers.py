@@ -0,0 +1,204 @@
+import bz2
+import csv
+import gzip
+import io
+import json
+from collections import OrderedDict
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SNIFF_SAMPLE_BYTES = 64 * 1024
+DELIMITER_CANDIDATES = (',', ';', '\t', '|')
+# share of sample lines which must have the same number of columns for delimiter to be accepted
+DELIMITER_CONSISTENCY = 0.9
+
+
+def open_zstd(file_path):
+    if zstandard is None:
+        raise IOError('zstandard package is required for reading {0}'.format(file_path))
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb')))
+
+
+def open_xz(file_path):
+    if lzma is None:
+        raise IOError('lzma or backports.lzma package is required for reading {0}'.format(file_path))
+    return lzma.LZMAFile(file_path, 'rb')
+
+
+# compression name: (magic bytes, function opening decompressed binary stream)
+COMPRESSIONS = OrderedDict([
+    # GzipFile.readline is implemented in Python, lines are read through C BufferedReader instead
+    ('gzip', ('\x1f\x8b', lambda file_path: io.BufferedReader(gzip.GzipFile(file_path, 'rb'), 1024 * 1024))),
+    ('bz2', ('BZh', lambda file_path: bz2.BZ2File(file_path, 'rb'))),
+    ('xz', ('\xfd7zXZ\x00', open_xz)),
+    ('zstd', ('\x28\xb5\x2f\xfd', open_zstd)),
+])
+
+
+def detect_compression(file_path):
+    """
+    :param file_path: string
+    :return: key of COMPRESSIONS or None for uncompressed file
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(6)
+    for compression, (magic, open_stream) in COMPRESSIONS.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def get_column_counts(lines, delimiter):
+    return [len(row) for row in csv.reader(lines, delimiter=delimiter)]
+
+
+def is_consistent_delimiter(lines, delimiter):
+    column_counts = get_column_counts(lines, delimiter)
+    if not column_counts:
+        return False
+    most_common_count = max(set(column_counts), key=column_counts.count)
+    return most_common_count > 1 and column_counts.count(most_common_count) >= DELIMITER_CONSISTENCY * len(lines)
+
+
+class CsvSourceReader(object):
+    """
+    Reader of delimited text rows, cells are decoded from UTF-8 and stripped.
+    """
+    format_name = 'csv'
+
+    def __init__(self, delimiter, **csv_options):
+        self.delimiter = str(delimiter)
+        self.csv_options = csv_options
+
+    @classmethod
+    def sniff(cls, sample_lines, default_delimiter, fields):
+        """
+        Method used for creating reader if sample looks like this format. Configured delimiter is used if it splits
+        sample lines into the same number of columns, otherwise other common delimiters are tried.
+        :param sample_lines: list of strings, first lines of decompressed file
+        :param default_delimiter: configured delimiter
+        :param fields: names of row columns in order
+        :return: CsvSourceReader
+        """
+        if sample_lines and not is_consistent_delimiter(sample_lines, str(default_delimiter)):
+            for delimiter in DELIMITER_CANDIDATES:
+                if is_consistent_delimiter(sample_lines, delimiter):
+                    return cls(delimiter)
+        return cls(default_delimiter)
+
+    def read_rows(self, lines):
+        """
+        :param lines: iterable of strings
+        :return: generator of rows(lists of unicode)
+        """
+        lines = (line.encode('utf-8') if isinstance(line, unicode) else line for line in lines)
+        for row in csv.reader(lines, delimiter=self.delimiter, **self.csv_options):
+            yield [unicode(cell.strip(), 'utf-8') for cell in row]
+
+
+class NdjsonSourceReader(object):
+    """
+    Reader of newline delimited JSON, every line is object with fields as keys or array of values in fields order.
+    Lines which are not valid JSON are returned as one cell row, so that they are rejected as rows with invalid
+    number of columns.
+    """
+    format_name = 'ndjson'
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    @classmethod
+    def sniff(cls, sample_lines, default_delimiter, fields):
+        stripped_lines = [line.strip() for line in sample_lines if line.strip()]
+        if not stripped_lines or stripped_lines[0][:1] not in ('{', '['):
+            return None
+        try:
+            json.loads(stripped_lines[0])
+        except ValueError:
+            return None
+        return cls(fields)
+
+    def read_rows(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                yield []
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError:
+                yield [line.decode('utf-8', 'replace') if isinstance(line, str) else line]
+                continue
+            if isinstance(value, dict):
+                value = [value.get(field) for field in self.fields]
+            elif not isinstance(value, list):
+                value = [value]
+            yield [u'' if cell is None else unicode(cell).strip() for cell in value]
+
+
+# readers are tried in order, last one accepts any file
+SOURCE_READERS = [NdjsonSourceReader, CsvSourceReader]
+
+
+class Source(object):
+    """
+    Input file with detected compression and reader of its format.
+    """
+    def __init__(self, file_path, compression, reader):
+        self.file_path = file_path
+        self.compression = compression
+        self.reader = reader
+
+    @property
+    def is_seekable(self):
+        # byte offsets are valid only in uncompressed files
+        return self.compression is None
+
+    def open(self):
+        """
+        :return: binary file object of decompressed content
+        """
+        if self.compression:
+            return COMPRESSIONS[self.compression][1](self.file_path)
+        return open(self.file_path, 'rb')
+
+
+def open_source(file_path, default_delimiter, fields, format_name=None):
+    """
+    Method used for detecting compression and format of file from its first bytes.
+    :param file_path: string
+    :param default_delimiter: delimiter used for CSV files when sample does not show other one
+    :param fields: names of row columns in order, used for mapping JSON objects to rows
+    :param format_name: format_name of reader from SOURCE_READERS, detected from sample if None
+    :return: Source
+    """
+    reader_classes = [reader_class for reader_class in SOURCE_READERS
+                      if format_name in (None, reader_class.format_name)]
+    if not reader_classes:
+        raise ValueError(u'Unknown format {0}'.format(format_name))
+    compression = detect_compression(file_path)
+    source = Source(file_path, compression, None)
+    with source.open() as f:
+        sample = f.read(SNIFF_SAMPLE_BYTES)
+    sample_lines = sample.splitlines(True)
+    if len(sample) == SNIFF_SAMPLE_BYTES and len(sample_lines) > 1:
+        # last line can be cut in the middle
+        sample_lines = sample_lines[:-1]
+    for reader_class in reader_classes:
+        source.reader = reader_class.sniff(sample_lines, default_delimiter, fields)
+        if source.reader:
+            return source
+    # configured NDJSON file whose first line is not valid JSON, such lines are rejected as rows
+    source.reader = NdjsonSourceReader(fields)
+    return source
@@ -0,0 +1,118 @@
+from sqlalchemy import bindparam, exists, or_, select
+from CsvImporter.models.models import Device, DeviceContent, StagedDevice, StagedDeviceContent
+
+# number of staged rows inserted by one executemany statement
+STAGE_CHUNK_SIZE = 10000
+
+# target model: (staging model, names of columns copied from staged rows)
+STAGED_TABLES = {
+    Device: (StagedDevice, ['id', 'name', 'description', 'code', 'expire_date', 'status', 'fingerprint']),
+    DeviceContent: (StagedDeviceContent, ['id', 'name', 'description', 'device_id', 'expire_date', 'status',
+                                          'fingerprint']),
+}
+
+
+def clear_staged_rows(session, model):
+    """
+    :param model: Device or DeviceContent
+    """
+    session.execute(STAGED_TABLES[model][0].__table__.delete())
+
+
+def delete_superseded_rows(session, model):
+    """
+    Method used for keeping one staged row per ID, the one which row by row import would keep: row with the newest
+    expire date, the first of them if dates are equal, or the first row if no row has expire date.
+    :param model: Device or DeviceContent
+    :return: number of deleted rows
+    """
+    staged_table = STAGED_TABLES[model][0].__table__
+    other = staged_table.alias('other')
+    kept_row_number = select([other.c.row_number])\
+        .where(other.c.id == staged_table.c.id)\
+        .order_by(other.c.expire_date.is_(None), other.c.expire_date.desc(), other.c.row_number)\
+        .limit(1).as_scalar()
+    return session.execute(staged_table.delete().where(staged_table.c.row_number != kept_row_number)).rowcount
+
+
+def merge_staged_rows(session, model, date_updated):
+    """
+    Method used for merging staged rows into target table with one UPDATE and one INSERT ... SELECT statement.
+    Existing rows are updated only if staged expire date is newer, same as in row by row import.
+    Staged rows have to be unique by ID, see delete_superseded_rows.
+    :param model: Device or DeviceContent
+    :param date_updated: datetime
+    :return: tuple (number of inserted rows, number of updated rows)
+    """
+    staging_model, column_names = STAGED_TABLES[model]
+    staged_table = staging_model.__table__
+    table = model.__table__
+    existing = table.alias('existing')
+
+    newer_ids = select([staged_table.c.id])\
+        .select_from(staged_table.join(existing, existing.c.id == staged_table.c.id))\
+        .where(staged_table.c.expire_date.isnot(None))\
+        .where(or_(existing.c.expire_date.is_(None), existing.c.expire_date < staged_table.c.expire_date))
+    values = dict((name, select([staged_table.c[name]]).where(staged_table.c.id == table.c.id).as_scalar())
+                  for name in column_names if name != 'id')
+    values['date_updated'] = date_updated
+    updated_count = session.execute(table.update().where(table.c.id.in_(newer_ids)).values(values)).rowcount
+
+    new_rows = select([staged_table.c[name] for name in column_names])\
+        .where(~exists().where(existing.c.id == staged_table.c.id))
+    inserted_count = session.execute(table.insert().from_select(column_names, new_rows)).rowcount
+    return inserted_count, updated_count
+
+
+def get_staged_devices(session):
+    """
+    :return: result of tuples (row number, ID, code, expire date, stored ID, stored code, stored expire date) of
+        staged Device rows in file order, stored values are of Device with the same ID or None if there is none
+    """
+    staged_table = StagedDevice.__table__
+    device_table = Device.__table__
+    return session.execute(
+        select([staged_table.c.row_number, staged_table.c.id, staged_table.c.code, staged_table.c.expire_date,
+                device_table.c.id, device_table.c.code, device_table.c.expire_date])
+        .select_from(staged_table.outerjoin(device_table, device_table.c.id == staged_table.c.id))
+        .order_by(staged_table.c.row_number))
+
+
+def clear_staged_device_codes(session, row_numbers):
+    """
+    Method used for setting code of staged Device rows to None.
+    :param row_numbers: list of row numbers
+    """
+    if not row_numbers:
+        return
+    staged_table = StagedDevice.__table__
+    session.execute(staged_table.update().where(staged_table.c.row_number == bindparam('staged_row_number'))
+                    .values(code=None), [{'staged_row_number': row_number} for row_number in row_numbers])
+
+
+def get_dangling_references(session):
+    """
+    :return: result of tuples (row number, Device ID as written in file) of staged DeviceContent rows whose Device
+        ID does not match any Device, in file order
+    """
+    staged_table = StagedDeviceContent.__table__
+    device_table = Device.__table__
+    return session.execute(
+        select([staged_table.c.row_number, staged_table.c.device_ref])
+        .select_from(staged_table.outerjoin(device_table, device_table.c.id == staged_table.c.device_id))
+        .where(device_table.c.id.is_(None))
+        .order_by(staged_table.c.row_number))
+
+
+def clear_dangling_references(session):
+    """
+    Method used for setting Device ID of staged DeviceContent rows to None when it does not match any Device.
+    :return: number of updated rows
+    """
+    staged_table = StagedDeviceContent.__table__
+    device_table = Device.__table__
+    return session.execute(
+        staged_table.update()
+        .where(staged_table.c.device_id.isnot(None))
+        .where(~exists().where(device_table.c.id == staged_table.c.device_id))
+        .values(device_id=None)).rowcount
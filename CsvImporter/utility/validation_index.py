@@ -0,0 +1,39 @@
+from CsvImporter.models.database import Session
+from CsvImporter.models.models import Device
+
+
+class ValidationIndex(object):
+    """
+    In-memory sets of existing Device codes and IDs used for validating CSV rows without querying database.
+    Loaded once per import run and updated as rows are accepted, so duplicates inside the same file are caught too.
+    Codes which end up not stored are discarded after their rows are written.
+    """
+    def __init__(self):
+        self.device_codes = set()
+        self.device_ids = set()
+
+    def load(self):
+        self.device_codes = set(code for code, in Session.query(Device.code).filter(Device.code.isnot(None)))
+        self.device_ids = set(device_id for device_id, in Session.query(Device.id))
+        return self
+
+    def has_device_code(self, code):
+        return code in self.device_codes
+
+    def has_device_id(self, device_id):
+        """
+        :param device_id: string or integer
+        :return: boolean
+        """
+        try:
+            return int(device_id) in self.device_ids
+        except (TypeError, ValueError):
+            return False
+
+    def add_device(self, device_id, code):
+        self.device_ids.add(int(device_id))
+        if code:
+            self.device_codes.add(code)
+
+    def discard_device_code(self, code):
+        self.device_codes.discard(code)
@@ -0,0 +1,148 @@
+from sqlalchemy import and_, or_, func
+from CsvImporter.models.database import Session
+from CsvImporter.utility.helper import StatusConstants
+
+DEFAULT_PAGE_LENGTH = 10
+MAX_PAGE_LENGTH = 1000
+
+
+class DataTablesListing(object):
+    """
+    Server-side DataTables listing of model rows. Sorting, search and pagination are done in SQL, only one page of
+    rows is loaded. Next page is loaded with keyset pagination when client sends cursor of the previous page, other
+    pages with OFFSET.
+    """
+    def __init__(self, model, sort_columns, search_columns, get_row_data, query_options=()):
+        """
+        :param model: model class
+        :param sort_columns: dict {DataTables column index: model column}
+        :param search_columns: list of text model columns searched by prefix
+        :param get_row_data: function returning list of table cells for model instance
+        :param query_options: loader options for related data used by get_row_data, so that it is loaded with the
+            page query instead of one query per row
+        """
+        self.model = model
+        self.sort_columns = sort_columns
+        self.search_columns = search_columns
+        self.get_row_data = get_row_data
+        self.query_options = query_options
+
+    def get_search_filter(self, search_value):
+        """
+        Method used for getting filter of rows whose searched columns start with search_value or whose status name
+        starts with search_value. Prefix search is done with range condition, so it can use column indexes.
+        :param search_value: unicode
+        :return: SQL expression
+        """
+        conditions = [and_(column >= search_value, column < search_value + u'\uffff')
+                      for column in self.search_columns]
+        statuses = [status for status_name, status in StatusConstants.get_mapped_status().items()
+                    if status_name.startswith(search_value.lower())]
+        if statuses:
+            conditions.append(self.model.status.in_(statuses))
+        return or_(*conditions)
+
+    def get_keyset_filters(self, sort_column, descending, after_value, after_id):
+        """
+        Method used for getting filters of rows after cursor row when ordered by (sort_column, id).
+        Rows matching the filters follow each other in that order, so a page is loaded by applying filters one by one
+        until it is full. Each filter is a range over sort_column index, SQLite sorts NULL values first in ascending
+        order and last in descending order.
+        :param sort_column: model column
+        :param descending: boolean
+        :param after_value: value of sort_column in cursor row or None
+        :param after_id: id of cursor row
+        :return: list of SQL expressions
+        """
+        id_column = self.model.id
+        if sort_column is id_column:
+            return [id_column < after_id if descending else id_column > after_id]
+        if descending:
+            if after_value is None:
+                return [and_(sort_column.is_(None), id_column < after_id)]
+            return [and_(sort_column <= after_value, or_(sort_column < after_value, id_column < after_id)),
+                    sort_column.is_(None)]
+        if after_value is None:
+            return [and_(sort_column.is_(None), id_column > after_id), sort_column.isnot(None)]
+        return [and_(sort_column >= after_value, or_(sort_column > after_value, id_column > after_id))]
+
+    def get_cursor(self, args, sort_column):
+        """
+        :param args: request arguments
+        :param sort_column: model column
+        :return: tuple (sort value, id) of last row of previous page or None
+        """
+        after_id = args.get('after_id', None, type=int)
+        if after_id is None:
+            return None
+        if sort_column is self.model.id:
+            return after_id, after_id
+        if args.get('after_null', None):
+            return None, after_id
+        if 'after_value' not in args:
+            return None
+        try:
+            return sort_column.type.python_type(args['after_value']), after_id
+        except ValueError:
+            return None
+
+    def get_page(self, args):
+        """
+        Method used for getting one page of rows.
+        :param args: request arguments with DataTables server-side parameters and optional cursor
+            (after_value or after_null, after_id) of last row of previous page
+        :return: dict {
+            'draw': integer,
+            'recordsTotal': integer,
+            'recordsFiltered': integer,
+            'rows': list of model instances,
+            'cursor': dict {'value': sort value, 'id': integer} of last row or None
+        }
+        """
+        start = max(args.get('start', 0, type=int), 0)
+        length = args.get('length', DEFAULT_PAGE_LENGTH, type=int)
+        length = DEFAULT_PAGE_LENGTH if length < 1 else min(length, MAX_PAGE_LENGTH)
+        search_value = args.get('search[value]', u'').strip()
+        sort_column = self.sort_columns.get(args.get('order[0][column]', 0, type=int), self.model.id)
+        descending = args.get('order[0][dir]', 'asc') == 'desc'
+
+        records_total = Session.query(func.count(self.model.id)).scalar()
+        query = Session.query(self.model)
+        records_filtered = records_total
+        if search_value:
+            query = query.filter(self.get_search_filter(search_value))
+            records_filtered = query.with_entities(func.count(self.model.id)).scalar()
+        query = query.options(*self.query_options)
+
+        if descending:
+            query = query.order_by(sort_column.desc(), self.model.id.desc())
+        else:
+            query = query.order_by(sort_column.asc(), self.model.id.asc())
+
+        cursor = self.get_cursor(args, sort_column)
+        if cursor:
+            rows = []
+            for keyset_filter in self.get_keyset_filters(sort_column, descending, *cursor):
+                rows.extend(query.filter(keyset_filter).limit(length - len(rows)).all())
+                if len(rows) >= length:
+                    break
+        else:
+            rows = query.offset(start).limit(length).all()
+
+        return {
+            'draw': args.get('draw', 0, type=int),
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'rows': rows,
+            'cursor': {'value': getattr(rows[-1], sort_column.key), 'id': rows[-1].id} if rows else None
+        }
+
+    def get_json_page(self, args):
+        """
+        Method used for getting DataTables server-side response.
+        :param args: request arguments
+        :return: dict
+        """
+        page = self.get_page(args)
+        page['data'] = [[unicode(cell) for cell in self.get_row_data(row)] for row in page.pop('rows')]
+        return page
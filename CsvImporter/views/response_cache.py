@@ -0,0 +1,118 @@
+import hashlib
+from collections import OrderedDict
+from functools import wraps
+from operator import itemgetter
+from threading import Lock
+from flask import current_app, json, jsonify, request
+from sqlalchemy import func
+from werkzeug.urls import url_encode
+from CsvImporter.models.database import Session
+from CsvImporter.models.models import ExpirySweep, ImportRun
+
+RESPONSE_CACHE_ENTRIES = 256
+# query arguments which DataTables changes on every request, they are not part of cache key
+UNCACHED_ARGS = ('draw', '_')
+
+
+def get_data_version():
+    """
+    :return: string identifying data written by the last import run and the last expiry sweep, None while import is
+        running or before first import, when responses are not cached
+    """
+    import_run = Session.query(ImportRun.id, ImportRun.status, ImportRun.date_finished)\
+        .order_by(ImportRun.id.desc()).first()
+    if not import_run or import_run.status == u'running':
+        return None
+    expiry_sweep_id = Session.query(func.max(ExpirySweep.id)).scalar()
+    return u'{0}-{1}-{2}-{3}'.format(import_run.id, import_run.status, import_run.date_finished, expiry_sweep_id)
+
+
+class ResponseCache(object):
+    """
+    LRU cache of rendered responses of read views, keyed by request path with query arguments. Cached responses are
+    valid only for the data version they were rendered with, so every import run invalidates them, and the cache
+    is also cleared explicitly when settings are saved or import job is finished. Clearing increments generation,
+    which is part of ETag, so that clients can not revalidate responses rendered before.
+    """
+    def __init__(self, max_entries=RESPONSE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = Lock()
+
+    def get(self, key, version):
+        """
+        :return: tuple (body, mimetype, status) or None
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries[key] = entry
+            return entry[1]
+
+    def set(self, key, version, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (version, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+
+def get_cache_key():
+    """
+    :return: unicode, request path with query arguments sorted by name, without UNCACHED_ARGS
+    """
+    args = [(name, value) for name, value in sorted(request.args.items(multi=True), key=itemgetter(0))
+            if name not in UNCACHED_ARGS]
+    return u'{0}?{1}'.format(request.path, url_encode(args, sort=False))
+
+
+def set_response_draw(body):
+    """
+    Method used for setting draw of JSON response of DataTables listing to draw of current request.
+    :param body: string, JSON object
+    :return: string, body is returned unchanged if it has no draw
+    """
+    data = json.loads(body)
+    if not isinstance(data, dict) or 'draw' not in data:
+        return body
+    data['draw'] = request.args.get('draw', 0, type=int)
+    return jsonify(data).get_data()
+
+
+def cached_response(view):
+    """
+    Decorator of read view, its responses are cached in app ResponseCache and sent with ETag of data version, so that
+    clients revalidating unchanged page get 304 Not Modified. JSON responses are shared by requests which differ only
+    in UNCACHED_ARGS, draw of request is set in cached response.
+    """
+    @wraps(view)
+    def cached_view(*args, **kwargs):
+        data_version = get_data_version()
+        if data_version is None:
+            return view(*args, **kwargs)
+        response_cache = current_app.extensions['response_cache']
+        version = u'{0}:{1}'.format(response_cache.generation, data_version)
+        key = get_cache_key()
+        cached = response_cache.get(key, version)
+        if cached is None:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            cached = (response.get_data(), response.mimetype, response.status_code)
+            response_cache.set(key, version, cached)
+        elif cached[1] == 'application/json':
+            cached = (set_response_draw(cached[0]),) + cached[1:]
+        body, mimetype, status = cached
+        response = current_app.response_class(body, status=status, mimetype=mimetype)
+        # ETag is of full path, so that client revalidating response of one draw does not get response of other draw
+        response.set_etag(hashlib.md5(u'{0}:{1}'.format(version, request.full_path).encode('utf-8')).hexdigest())
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return cached_view
@@ -1,34 +1,122 @@
-from flask import Blueprint, render_template, abort, request
+import sys
+from flask import Blueprint, render_template, abort, request, jsonify, Response, current_app
 from jinja2 import TemplateNotFound
-from CsvImporter.models.database import Session
-from CsvImporter.models.models import Device, DeviceContent, ImporterSettings
+from sqlalchemy.orm import joinedload
+from CsvImporter.models.database import Session, WriteSession
+from CsvImporter.models.models import Device, DeviceContent, ImporterSettings, ImportSource
+from CsvImporter.utility.dashboard import EXPIRING_SOON_DAYS, get_dashboard_summary
+from CsvImporter.utility.import_jobs import TABLE_NAMES
+from CsvImporter.utility.import_metrics import get_prometheus_metrics
+from CsvImporter.utility.import_scheduler import get_source_summaries
+from CsvImporter.views.listing import DataTablesListing
+from CsvImporter.views.response_cache import cached_response
 
 main_view = Blueprint('main_view', __name__)
 
+device_listing = DataTablesListing(
+    Device,
+    sort_columns={0: Device.id, 1: Device.name, 3: Device.code, 7: Device.status},
+    search_columns=[Device.name, Device.code],
+    get_row_data=lambda device: [device.id, device.get_name(), device.get_description(), device.get_code(),
+                                 device.get_date_created(), device.get_date_updated(),
+                                 device.get_date_expire_date(), device.get_status_name()])
+
+device_content_listing = DataTablesListing(
+    DeviceContent,
+    sort_columns={0: DeviceContent.id, 1: DeviceContent.name, 3: DeviceContent.device_id, 7: DeviceContent.status},
+    search_columns=[DeviceContent.name],
+    get_row_data=lambda device_content: [device_content.id, device_content.get_name(),
+                                         device_content.get_description(), device_content.get_device_name(),
+                                         device_content.get_date_created(), device_content.get_date_updated(),
+                                         device_content.get_date_expire_date(), device_content.get_status_name()],
+    query_options=[joinedload(DeviceContent.device).load_only('name')])
+
 
 @main_view.route('/')
+@cached_response
 def index():
-    devices = Session.query(Device).all()
-    context = {'devices': devices}
+    page = device_listing.get_page(request.args)
+    context = {'devices': page['rows'], 'records_total': page['recordsTotal'], 'cursor': page['cursor']}
     return render_template('index.jinja2', **context)
 
 
+@main_view.route('/devices.json')
+@cached_response
+def devices_json():
+    return jsonify(device_listing.get_json_page(request.args))
+
+
 @main_view.route('/device/content')
+@cached_response
 def device_content():
-    device_content_query = Session.query(DeviceContent).all()
-    context = {'device_content': device_content_query}
+    page = device_content_listing.get_page(request.args)
+    context = {'device_content': page['rows'], 'records_total': page['recordsTotal'], 'cursor': page['cursor']}
     return render_template('device_content.jinja2', **context)
 
 
+@main_view.route('/device/content.json')
+@cached_response
+def device_content_json():
+    return jsonify(device_content_listing.get_json_page(request.args))
+
+
+@main_view.route('/summary.json')
+def summary_json():
+    days = request.args.get('days', EXPIRING_SOON_DAYS, type=int)
+    return jsonify(get_dashboard_summary(Session, days=days))
+
+
+@main_view.route('/metrics')
+def metrics():
+    source_names = dict(Session.query(ImportSource.id, ImportSource.name))
+    return Response(get_prometheus_metrics(Session, source_names), mimetype='text/plain; version=0.0.4')
+
+
+@main_view.route('/sources.json')
+def sources_json():
+    return jsonify({'sources': get_source_summaries(Session)})
+
+
+@main_view.route('/imports', methods=['GET', 'POST'])
+def imports():
+    import_jobs = current_app.extensions['import_jobs']
+    if request.method == 'POST':
+        table_names = request.form.getlist('table') or TABLE_NAMES
+        if set(table_names).difference(TABLE_NAMES):
+            abort(400)
+        # each file is written in one transaction, so cancelled job does not leave file imported in part
+        job = import_jobs.enqueue(table_names, bulk_upsert=True, incremental=True, transaction_size=sys.maxint)
+        return jsonify(job.get_progress()), 202
+
+    return jsonify({'jobs': [job.get_progress() for job in import_jobs.get_jobs()]})
+
+
+@main_view.route('/imports/<int:job_id>')
+def import_job(job_id):
+    job = current_app.extensions['import_jobs'].get_job(job_id)
+    if not job:
+        abort(404)
+    return jsonify(job.get_progress())
+
+
+@main_view.route('/imports/<int:job_id>/cancel', methods=['POST'])
+def cancel_import_job(job_id):
+    job = current_app.extensions['import_jobs'].cancel(job_id)
+    if not job:
+        abort(404)
+    return jsonify(job.get_progress())
+
+
 @main_view.route('/settings', methods=['GET', 'POST'])
 def settings():
-    settings_query = Session.query(ImporterSettings).first()
+    settings_query = WriteSession.query(ImporterSettings).first()
     if request.method == 'POST':
         settings_query.csv_store_pat = request.form['csv_store_path']
         settings_query.device_file_name = request.form['device_file_name']
         settings_query.content_file_name = request.form['content_file_name']
         settings_query.default_csv_delimiter = request.form['default_csv_delimiter']
-        Session.flush()
+        WriteSession.flush()
+        current_app.extensions['response_cache'].clear()
 
     context = {'settings': settings_query}
 
@@ -0,0 +1,154 @@
+# -*- coding: utf8 -*
+"""
+Compare memory per staged row and import throughput of parsed rows kept as dicts, ORM instances and ColumnBatch.
+Memory of bulk import path is measured as growth of peak RSS of the whole import between small and large batch
+size, divided by the difference of batch sizes, so it includes parsed rows, chunk and statement parameters.
+
+    python benchmarks/bench_column_batch.py --rows 200000
+"""
+import argparse
+import resource
+from collections import OrderedDict
+from multiprocessing import Pool
+from common import BenchmarkDatabase, write_devices_csv, timed
+from CsvImporter.models.database import Session
+from CsvImporter.models.models import Device
+from CsvImporter.utility.column_batch import ColumnBatch
+from CsvImporter.utility.csv_importer import CsvImporter
+from CsvImporter.utility.helper import is_newer_expire_date, iter_chunks, now
+
+
+class MappingsImporter(CsvImporter):
+    """
+    CsvImporter writing chunks with bulk insert/update mappings, same as before ColumnBatch.
+    """
+    def iter_write_chunks(self, model, parsed_rows):
+        return iter_chunks(parsed_rows, self.batch_size)
+
+    def upsert_chunk(self, model, parsed_rows):
+        pending_rows = OrderedDict()
+        for parsed_row in parsed_rows:
+            row_id = int(parsed_row['id'])
+            pending_row = pending_rows.get(row_id)
+            if pending_row and not is_newer_expire_date(pending_row['expire_date'], parsed_row['expire_date']):
+                continue
+            pending_rows[row_id] = dict(parsed_row, id=row_id)
+
+        existing_expire_dates = dict(Session.query(model.id, model.expire_date)
+                                     .filter(model.id.in_(pending_rows.keys())))
+        insert_rows = []
+        update_rows = []
+        for row_id, pending_row in pending_rows.items():
+            if row_id not in existing_expire_dates:
+                insert_rows.append(pending_row)
+            elif is_newer_expire_date(existing_expire_dates[row_id], pending_row['expire_date']):
+                pending_row['date_updated'] = now()
+                update_rows.append(pending_row)
+
+        with Session.begin(subtransactions=True):
+            if insert_rows:
+                Session.bulk_insert_mappings(model, insert_rows)
+            if update_rows:
+                Session.bulk_update_mappings(model, update_rows)
+        return len(insert_rows), len(update_rows)
+
+
+def get_rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def stage_dicts(parsed_rows):
+    return list(parsed_rows)
+
+
+def stage_orm_instances(parsed_rows):
+    devices = []
+    for parsed_row in parsed_rows:
+        device = Device()
+        device.id = int(parsed_row['id'])
+        device.name = parsed_row['name']
+        device.description = parsed_row['description']
+        device.code = parsed_row['code']
+        device.expire_date = parsed_row['expire_date']
+        device.status = parsed_row['status']
+        device.fingerprint = parsed_row['fingerprint']
+        devices.append(device)
+    return devices
+
+
+def stage_column_batch(parsed_rows):
+    column_batch = None
+    for parsed_row in parsed_rows:
+        if column_batch is None:
+            column_batch = ColumnBatch(Device.__table__, parsed_row.keys())
+        column_batch.append(parsed_row)
+    return column_batch
+
+
+def measure_staging(task):
+    # runs in fresh worker process, so RSS growth belongs to staged rows only
+    file_path, stage_name = task
+    csv_importer = CsvImporter(default_csv_delimiter=u',')
+    with open(file_path) as f:
+        parsed_rows = (csv_importer.parse_device_row(row, row_number) for row_number, row in
+                       enumerate(csv_importer.unicode_csv_reader(f, u','), start=1))
+        rss_before = get_rss_bytes()
+        staged_rows = globals()[stage_name](row for row in parsed_rows if row)
+        rss_after = get_rss_bytes()
+    return rss_after - rss_before, len(staged_rows)
+
+
+def measure_import(task):
+    # runs in fresh worker process, so peak RSS belongs to this import only
+    rows_count, importer_name, batch_size = task
+    with BenchmarkDatabase() as database:
+        write_devices_csv(database.file_path('devices.csv'), rows_count)
+        csv_importer = globals()[importer_name](database.path, 'devices.csv', 'content.csv', u',', bulk_upsert=True,
+                                                batch_size=batch_size, write_error_log=False)
+        rss_before = get_rss_bytes()
+        csv_importer.import_devices_data()
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - rss_before
+
+
+def run_in_fresh_process(function, task):
+    pool = Pool(1, maxtasksperchild=1)
+    result = pool.apply(function, (task,))
+    pool.close()
+    pool.join()
+    return result
+
+
+def run_import(rows_count, importer_class, bulk_upsert):
+    with BenchmarkDatabase() as database:
+        write_devices_csv(database.file_path('devices.csv'), rows_count)
+        csv_importer = importer_class(database.path, 'devices.csv', 'content.csv', u',', bulk_upsert=bulk_upsert,
+                                      write_error_log=False)
+        return rows_count / timed(csv_importer.import_devices_data)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=200000)
+    arg_parser.add_argument('--small-batch-size', type=int, default=500)
+    arg_parser.add_argument('--large-batch-size', type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    with BenchmarkDatabase() as database:
+        file_path = database.file_path('devices.csv')
+        write_devices_csv(file_path, args.rows)
+        for stage_name in ('stage_dicts', 'stage_orm_instances', 'stage_column_batch'):
+            rss_growth, staged_count = run_in_fresh_process(measure_staging, (file_path, stage_name))
+            print('{0:<20} {1:>8.0f} bytes/row'.format(stage_name, rss_growth / float(staged_count)))
+
+    for importer_name in ('MappingsImporter', 'CsvImporter'):
+        small_rss, large_rss = [run_in_fresh_process(measure_import, (args.rows, importer_name, batch_size))
+                                for batch_size in (args.small_batch_size, args.large_batch_size)]
+        print('{0:<20} {1:>8.0f} bytes/row of import batch'.format(
+            importer_name, (large_rss - small_rss) / float(args.large_batch_size - args.small_batch_size)))
+
+    for name, importer_class, bulk_upsert in (('row by row (ORM)', CsvImporter, False),
+                                              ('bulk mappings', MappingsImporter, True),
+                                              ('bulk ColumnBatch', CsvImporter, True)):
+        print('{0:<20} {1:>8.0f} rows/sec'.format(name, run_import(args.rows, importer_class, bulk_upsert)))
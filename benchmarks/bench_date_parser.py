@@ -0,0 +1,45 @@
+# -*- coding: utf8 -*
+"""
+Compare dateutil parser with DateParser on generated expire date column.
+
+    python benchmarks/bench_date_parser.py --rows 1000000 --distinct 100000
+"""
+import argparse
+import random
+from dateutil import parser
+from common import timed
+from CsvImporter.utility.date_parser import DateParser
+
+
+def get_date_column(rows_count, distinct_count, seed=1):
+    generator = random.Random(seed)
+    values = [u'2017-{0:02d}-{1:02d} {2:02d}:{3:02d}:{4:02d}.333+01:00'.format(
+        generator.randint(1, 12), generator.randint(1, 28), generator.randint(0, 23), generator.randint(0, 59),
+        generator.randint(0, 59)) for _ in range(distinct_count)]
+    return [generator.choice(values) for _ in range(rows_count)]
+
+
+def parse_with_dateutil(date_column):
+    for value in date_column:
+        parser.parse(value).replace(tzinfo=None)
+
+
+def parse_with_date_parser(date_column):
+    date_parser = DateParser()
+    for value in date_column:
+        date_parser.parse(value)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--distinct', type=int, default=100000,
+                            help='number of distinct timestamps in the column')
+    args = arg_parser.parse_args()
+
+    date_column = get_date_column(args.rows, args.distinct)
+    dateutil_time = timed(lambda: parse_with_dateutil(date_column))
+    date_parser_time = timed(lambda: parse_with_date_parser(date_column))
+    print('dateutil:    {0:.2f}s ({1:.0f} rows/sec)'.format(dateutil_time, args.rows / dateutil_time))
+    print('DateParser:  {0:.2f}s ({1:.0f} rows/sec)'.format(date_parser_time, args.rows / date_parser_time))
+    print('speedup:     {0:.1f}x'.format(dateutil_time / date_parser_time))
@@ -0,0 +1,70 @@
+# -*- coding: utf8 -*
+"""
+Compare import of file with invalid rows when rejected fields are logged synchronously, through buffered error log
+and when only summary is kept.
+
+    python benchmarks/bench_error_log.py --rows 200000 --invalid 0.5
+"""
+import argparse
+import logging
+import random
+from logging.handlers import TimedRotatingFileHandler
+from common import BenchmarkDatabase, STATUS_NAMES, timed
+from CsvImporter.utility.csv_importer import CsvImporter, csv_error_logger, formatter
+from CsvImporter.utility.import_metrics import get_error_reason
+from CsvImporter.utility.row_error_log import BatchTimedRotatingFileHandler
+
+
+class SynchronousLogImporter(CsvImporter):
+    """
+    CsvImporter logging every rejected field right away, same as before buffered error log.
+    """
+    def log_row_error(self, message, row_number, *args):
+        self.metrics.add_rejection(get_error_reason(message))
+        csv_error_logger.error(message.format(row_number, *args))
+
+
+def write_dirty_devices_csv(file_path, rows_count, invalid_share, seed=1):
+    """
+    Write Device CSV rows, invalid_share of rows has invalid name, expire date and status.
+    """
+    generator = random.Random(seed)
+    with open(file_path, 'w') as f:
+        for index in range(rows_count):
+            if generator.random() < invalid_share:
+                f.write('{0},{1}, "Machine {0} description",CODE{0}, 2017-13-45 25:61:00, unknown\n'.format(
+                    index, 'M' * 40))
+            else:
+                f.write('{0},"Machine {0}", "Machine {0} description",CODE{0}, 2017-{1:02d}-{2:02d} 23:55:00, '
+                        '{3}\n'.format(index, generator.randint(1, 12), generator.randint(1, 28),
+                                       generator.choice(STATUS_NAMES)))
+
+
+def run(rows_count, invalid_share, importer_class, handler_class, write_error_log):
+    with BenchmarkDatabase() as database:
+        write_dirty_devices_csv(database.file_path('devices.csv'), rows_count, invalid_share)
+        error_handler = handler_class(database.file_path('errors.log'), when='midnight')
+        error_handler.setLevel(logging.DEBUG)
+        error_handler.setFormatter(formatter)
+        csv_error_logger.handlers = [error_handler]
+        csv_importer = importer_class(database.path, 'devices.csv', 'content.csv', u',', bulk_upsert=True,
+                                      write_error_log=write_error_log)
+        import_time = timed(csv_importer.import_devices_data)
+        error_handler.close()
+        with open(database.file_path('errors.log')) as f:
+            log_lines_count = sum(1 for _ in f)
+    return rows_count / import_time, log_lines_count
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=200000)
+    arg_parser.add_argument('--invalid', type=float, default=0.5, help='share of invalid rows')
+    args = arg_parser.parse_args()
+
+    for name, importer_class, handler_class, write_error_log in (
+            ('synchronous', SynchronousLogImporter, TimedRotatingFileHandler, True),
+            ('buffered', CsvImporter, BatchTimedRotatingFileHandler, True),
+            ('summary only', CsvImporter, BatchTimedRotatingFileHandler, False)):
+        rows_rate, log_lines_count = run(args.rows, args.invalid, importer_class, handler_class, write_error_log)
+        print('{0:<13} {1:>10.0f} rows/sec  {2:>9} log lines'.format(name, rows_rate, log_lines_count))
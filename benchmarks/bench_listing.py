@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*
+"""
+Measure latency of server-side device listing at different table sizes.
+
+    python benchmarks/bench_listing.py --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from common import BenchmarkDatabase, STATUS_NAMES
+from CsvImporter.app import create_app
+from CsvImporter.models.models import Device
+from CsvImporter.utility.helper import StatusConstants, iter_chunks
+from CsvImporter.views.views import main_view
+
+REQUESTS = [
+    ('first page', {'draw': 1, 'start': 0, 'length': 10}),
+    ('deep page, OFFSET', {'draw': 1, 'start': None, 'length': 10}),
+    ('deep page, keyset', {'draw': 1, 'start': None, 'length': 10, 'after_id': None}),
+    ('sort by name', {'draw': 1, 'start': 0, 'length': 10, 'order[0][column]': 1, 'order[0][dir]': 'desc'}),
+    ('search', {'draw': 1, 'start': 0, 'length': 10, 'search[value]': u'Machine 12'}),
+]
+
+
+def insert_devices(engine, rows_count, seed=1):
+    generator = random.Random(seed)
+    statuses = StatusConstants.get_mapped_status()
+    rows = ({'id': index, 'name': u'Machine {0}'.format(index), 'description': u'Machine {0} ...'.format(index),
+             'code': u'CODE{0}'.format(index), 'status': statuses[generator.choice(STATUS_NAMES)]}
+            for index in range(1, rows_count + 1))
+    for chunk in iter_chunks(rows, 10000):
+        engine.execute(Device.__table__.insert(), chunk)
+
+
+def get_latency_ms(client, url, params, repeat):
+    start_time = time.time()
+    for _ in range(repeat):
+        response = client.get(url, query_string=params)
+        assert response.status_code == 200
+    return (time.time() - start_time) * 1000 / repeat
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    arg_parser.add_argument('--repeat', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    app = create_app()
+    app.register_blueprint(main_view)
+    client = app.test_client()
+    for rows_count in args.sizes:
+        with BenchmarkDatabase() as database:
+            insert_devices(database.engine, rows_count)
+            deep_start = rows_count * 9 // 10
+            print('{0} devices'.format(rows_count))
+            for name, params in REQUESTS:
+                params = dict(params)
+                if params['start'] is None:
+                    params['start'] = deep_start
+                if 'after_id' in params:
+                    params['after_id'] = deep_start
+                latency_ms = get_latency_ms(client, '/devices.json', params, args.repeat)
+                print('  {0:<20} json: {1:>8.1f} ms'.format(name, latency_ms))
+            print('  {0:<20} html: {1:>8.1f} ms'.format('index page', get_latency_ms(client, '/', {}, args.repeat)))
@@ -0,0 +1,36 @@
+# -*- coding: utf8 -*
+"""
+Import generated Device CSV file with bulk upsert and check that peak RSS stays below a ceiling.
+
+    python benchmarks/bench_memory.py --rows 10000000 --max-rss-mb 150
+"""
+import argparse
+import resource
+import sys
+from common import BenchmarkDatabase, write_devices_csv, timed
+from CsvImporter.utility.csv_importer import CsvImporter
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=10000000)
+    arg_parser.add_argument('--max-rss-mb', type=float, default=150)
+    args = arg_parser.parse_args()
+
+    with BenchmarkDatabase() as database:
+        write_devices_csv(database.file_path('devices.csv'), args.rows)
+        csv_importer = CsvImporter(database.path, 'devices.csv', 'content.csv', u',', bulk_upsert=True)
+        rss_before = get_peak_rss_mb()
+        elapsed = timed(csv_importer.import_devices_data)
+        peak_rss = get_peak_rss_mb()
+
+    print('rows: {0}  time: {1:.1f}s  peak RSS before import: {2:.1f} MB  after import: {3:.1f} MB'.format(
+        args.rows, elapsed, rss_before, peak_rss))
+    if peak_rss > args.max_rss_mb:
+        print('FAILED: peak RSS {0:.1f} MB is above {1:.1f} MB'.format(peak_rss, args.max_rss_mb))
+        sys.exit(1)
@@ -0,0 +1,131 @@
+# -*- coding: utf8 -*
+"""
+Check that memory mapped reader returns the same rows as line reader and compare their read and import throughput.
+
+    python benchmarks/bench_mmap_reader.py --rows 200000
+"""
+import argparse
+import os
+import random
+from common import BenchmarkDatabase, write_devices_csv, write_content_csv, timed
+from CsvImporter.utility.csv_importer import CsvImporter, DEVICE_FIELDS
+from CsvImporter.utility import mmap_reader
+from CsvImporter.utility.mmap_reader import MmapCsvReader
+from CsvImporter.utility.parallel_import import get_chunk_ranges
+from CsvImporter.utility.source_readers import CsvSourceReader, open_source
+
+# rows written between generated rows, they take slow path of MmapCsvReader or quirks of csv module
+QUIRK_LINES = [
+    '1,"Machine, with comma", "desc",CODE1, 2017-01-01 23:55:00.333+01:00, enabled\n',
+    '2,"Machine ""quoted""", "desc",CODE2, 2017-01-01 23:55:00.333+01:00, enabled\n',
+    '3,"Machine" 3 , desc ,CODE3, 2017-01-01 23:55:00.333+01:00 ,\tenabled\r\n',
+    '4,Mach"ine 4,"",CODE4, 2017-01-01 23:55:00.333+01:00, enabled\n',
+    '5,"Machine 5",\t"desc\t5",CODE5, 2017-01-01 23:55:00.333+01:00, deleted\n',
+    '6,"Zařízení 6",popis,KÓD6, 2017-01-01 23:55:00.333+01:00, enabled\n',
+    '\n',
+    '7,"Machine 7", "multi\nline",CODE7, 2017-01-01 23:55:00.333+01:00, enabled\n',
+    '8,"Machine 8\n',
+    'x,"bad"\n',
+]
+MULTILINE_QUIRKS = ('7,', '8,')
+
+
+def write_quirks(file_path, count, seed=1, multiline=True):
+    generator = random.Random(seed)
+    quirk_lines = [line for line in QUIRK_LINES if multiline or not line.startswith(MULTILINE_QUIRKS)]
+    with open(file_path, 'a') as f:
+        for index in range(count):
+            f.write(generator.choice(quirk_lines))
+
+
+def read_lines(file_path, delimiter):
+    with open(file_path, 'rb') as f:
+        return list(CsvSourceReader(delimiter).read_rows(f))
+
+
+def read_mmap(file_path, delimiter):
+    return [row for next_offset, row in MmapCsvReader(delimiter).read_file_records(file_path)]
+
+
+def read_mmap_chunks(file_path, delimiter, chunk_bytes):
+    reader = MmapCsvReader(delimiter)
+    return [row for start, end in get_chunk_ranges(file_path, chunk_bytes=chunk_bytes)
+            for row in reader.read_chunk_rows(file_path, start, end)]
+
+
+def read_mmap_resumed(file_path, delimiter):
+    # reading is stopped after every record and resumed from offset returned with it
+    reader = MmapCsvReader(delimiter)
+    rows = []
+    offset = 0
+    file_size = os.path.getsize(file_path)
+    while offset < file_size:
+        offset, row = next(reader.read_file_records(file_path, offset))
+        rows.append(row)
+    return rows
+
+
+def check_parity(database, rows_count):
+    """
+    :return: list of (check name, True if rows of both readers are equal)
+    """
+    results = []
+    devices_path = database.file_path('parity_devices.csv')
+    write_devices_csv(devices_path, rows_count)
+    write_quirks(devices_path, rows_count // 10 or 1)
+    content_path = database.file_path('parity_content.csv')
+    write_content_csv(content_path, rows_count, rows_count)
+    write_quirks(content_path, rows_count // 10 or 1, multiline=False)
+    semicolon_path = database.file_path('parity_semicolon.csv')
+    with open(devices_path) as source, open(semicolon_path, 'w') as f:
+        f.write(source.read().replace(',', ';'))
+
+    for name, file_path, delimiter in (('devices', devices_path, ','), ('content', content_path, ','),
+                                       ('semicolon', semicolon_path, ';')):
+        expected_rows = read_lines(file_path, delimiter)
+        results.append(('{0} sequential'.format(name), read_mmap(file_path, delimiter) == expected_rows))
+        results.append(('{0} resumed'.format(name), read_mmap_resumed(file_path, delimiter) == expected_rows))
+    # chunk ranges are split on line breaks, same as in parallel import, so file without multi-line records is used
+    for chunk_bytes in (97, 4096):
+        results.append(('content chunks of {0} bytes'.format(chunk_bytes),
+                        read_mmap_chunks(content_path, ',', chunk_bytes) == read_lines(content_path, ',')))
+    return results
+
+
+def run_import(rows_count, use_mmap, workers=1):
+    with BenchmarkDatabase() as database:
+        write_devices_csv(database.file_path('devices.csv'), rows_count)
+        csv_importer = CsvImporter(database.path, 'devices.csv', 'content.csv', u',', bulk_upsert=True,
+                                   workers=workers, write_error_log=False, use_mmap=use_mmap)
+        return rows_count / timed(csv_importer.import_devices_data)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=200000)
+    arg_parser.add_argument('--parity-rows', type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    # small blocks, so that block boundaries are checked many times
+    block_bytes, mmap_reader.BLOCK_BYTES = mmap_reader.BLOCK_BYTES, 4096
+    with BenchmarkDatabase() as database:
+        parity_results = check_parity(database, args.parity_rows)
+    mmap_reader.BLOCK_BYTES = block_bytes
+    for name, is_equal in parity_results:
+        print('parity {0:<28} {1}'.format(name, 'ok' if is_equal else 'MISMATCH'))
+
+    with BenchmarkDatabase() as database:
+        file_path = database.file_path('devices.csv')
+        write_devices_csv(file_path, args.rows)
+        source = open_source(file_path, u',', DEVICE_FIELDS)
+        for name, csv_importer in (('line reader', CsvImporter(use_mmap=False)),
+                                   ('mmap reader', CsvImporter(use_mmap=True))):
+            read_time = timed(lambda: sum(1 for row in csv_importer.read_source_rows(source)))
+            print('read   {0:<22} {1:>8.0f} rows/sec'.format(name, args.rows / read_time))
+
+    for name, use_mmap, workers in (('line reader', False, 1), ('mmap reader', True, 1),
+                                    ('line reader, 4 workers', False, 4), ('mmap reader, 4 workers', True, 4)):
+        print('import {0:<22} {1:>8.0f} rows/sec'.format(name, run_import(args.rows, use_mmap, workers)))
+
+    if not all(is_equal for name, is_equal in parity_results):
+        raise SystemExit('readers returned different rows')
@@ -0,0 +1,50 @@
+# -*- coding: utf8 -*
+"""
+Check that rendering device content listing issues the same number of queries for any number of rows.
+
+    python benchmarks/bench_queries.py --rows 10 100 1000
+"""
+import argparse
+import sys
+from common import BenchmarkDatabase
+from CsvImporter.app import create_app
+from CsvImporter.models.models import Device, DeviceContent
+from CsvImporter.utility.query_counter import QueryCounter
+from CsvImporter.views.views import main_view
+
+
+def insert_rows(engine, rows_count):
+    engine.execute(Device.__table__.insert(), [{'id': index, 'name': u'Machine {0}'.format(index)}
+                                               for index in range(1, rows_count + 1)])
+    engine.execute(DeviceContent.__table__.insert(), [{'id': index, 'name': u'Content {0}'.format(index),
+                                                       'device_id': index} for index in range(1, rows_count + 1)])
+
+
+def get_query_counts(client, engine, rows_count):
+    query_counts = {}
+    for url in ('/device/content', '/device/content.json'):
+        with QueryCounter(engine) as query_counter:
+            response = client.get(url, query_string={'length': rows_count})
+        assert response.status_code == 200
+        query_counts[url] = query_counter.count
+    return query_counts
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000])
+    args = arg_parser.parse_args()
+
+    app = create_app()
+    app.register_blueprint(main_view)
+    client = app.test_client()
+    results = {}
+    for rows_count in args.rows:
+        with BenchmarkDatabase() as database:
+            insert_rows(database.engine, rows_count)
+            results[rows_count] = get_query_counts(client, database.engine, rows_count)
+        print('{0:>6} rows: {1}'.format(rows_count, results[rows_count]))
+
+    if len(set(tuple(sorted(query_counts.items())) for query_counts in results.values())) > 1:
+        print('FAILED: number of queries depends on number of rows')
+        sys.exit(1)
@@ -0,0 +1,78 @@
+# -*- coding: utf8 -*
+"""
+Compare end-to-end import time of the same Device rows from uncompressed, compressed and NDJSON files.
+
+    python benchmarks/bench_sources.py --rows 200000
+"""
+import argparse
+import bz2
+import csv
+import gzip
+import json
+import shutil
+from common import BenchmarkDatabase, write_devices_csv, timed
+from CsvImporter.utility.csv_importer import CsvImporter, DEVICE_FIELDS
+from CsvImporter.utility.source_readers import open_source
+
+
+def write_gzip(source_path, file_path):
+    with open(source_path, 'rb') as source, gzip.GzipFile(file_path, 'wb') as f:
+        shutil.copyfileobj(source, f)
+
+
+def write_bz2(source_path, file_path):
+    with open(source_path, 'rb') as source, bz2.BZ2File(file_path, 'wb') as f:
+        shutil.copyfileobj(source, f)
+
+
+def write_ndjson(source_path, file_path):
+    with open(source_path, 'rb') as source, open(file_path, 'wb') as f:
+        for row in csv.reader(source):
+            f.write(json.dumps(dict(zip(DEVICE_FIELDS, [cell.strip() for cell in row]))) + '\n')
+
+
+def gunzip(file_path, target_path):
+    with gzip.GzipFile(file_path, 'rb') as source, open(target_path, 'wb') as f:
+        shutil.copyfileobj(source, f)
+
+
+def run(rows_count, file_name, write_file=None, decompress_first=False):
+    with BenchmarkDatabase() as database:
+        write_devices_csv(database.file_path('plain.csv'), rows_count)
+        if write_file:
+            write_file(database.file_path('plain.csv'), database.file_path(file_name))
+        else:
+            shutil.copy(database.file_path('plain.csv'), database.file_path(file_name))
+        csv_importer = CsvImporter(database.path, 'devices.csv' if decompress_first else file_name, 'content.csv',
+                                   u',', bulk_upsert=True, write_error_log=False)
+
+        def read_devices():
+            if decompress_first:
+                # decompressing to disk before import, as it had to be done before compressed sources
+                gunzip(database.file_path(file_name), database.file_path('devices.csv'))
+            source = open_source(csv_importer.get_file_path(csv_importer.device_file_name), u',', DEVICE_FIELDS)
+            for row in csv_importer.read_source_rows(source):
+                pass
+
+        def import_devices():
+            if decompress_first:
+                gunzip(database.file_path(file_name), database.file_path('devices.csv'))
+            csv_importer.import_devices_data()
+
+        return timed(read_devices), timed(import_devices)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    for name, file_name, write_file, decompress_first in (
+            ('csv', 'devices.csv', None, False),
+            ('csv gzip', 'devices.csv.gz', write_gzip, False),
+            ('gunzip to disk + csv', 'devices.csv.gz', write_gzip, True),
+            ('csv bz2', 'devices.csv.bz2', write_bz2, False),
+            ('ndjson', 'devices.ndjson', write_ndjson, False)):
+        read_time, import_time = run(args.rows, file_name, write_file, decompress_first)
+        print('{0:<22} read: {1:>6.2f}s ({2:>7.0f} rows/sec)  import: {3:>6.2f}s ({4:>6.0f} rows/sec)'.format(
+            name, read_time, args.rows / read_time, import_time, args.rows / import_time))
@@ -0,0 +1,60 @@
+# -*- coding: utf8 -*
+"""
+Compare import throughput and latency of concurrent reads during import for default and tuned SQLite profiles.
+
+    python benchmarks/bench_sqlite_profiles.py --rows 200000
+"""
+import argparse
+import time
+from multiprocessing import Process, Queue, Event
+from sqlalchemy.exc import OperationalError
+from common import BenchmarkDatabase, write_devices_csv, timed
+from CsvImporter.models.database import create_profile_engine
+from CsvImporter.utility.csv_importer import CsvImporter
+
+# (import profile, profile of concurrent reader)
+PROFILES = [('default', 'default'), ('import', 'web')]
+
+
+def read_devices(profile, database_url, stop_event, results):
+    engine = create_profile_engine(profile, database_url)
+    latencies = []
+    errors_count = 0
+    while not stop_event.is_set():
+        start_time = time.time()
+        try:
+            engine.execute('SELECT id, name FROM device ORDER BY id DESC LIMIT 10').fetchall()
+            engine.execute('SELECT count(*) FROM device WHERE status = 1').scalar()
+        except OperationalError:
+            errors_count += 1
+        latencies.append((time.time() - start_time) * 1000)
+        time.sleep(0.01)
+    results.put((latencies, errors_count))
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(int(len(values) * percentile / 100.0), len(values) - 1)] if values else 0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    for import_profile, read_profile in PROFILES:
+        with BenchmarkDatabase(import_profile) as database:
+            write_devices_csv(database.file_path('devices.csv'), args.rows)
+            csv_importer = CsvImporter(database.path, 'devices.csv', 'content.csv', u',', bulk_upsert=True)
+            stop_event = Event()
+            results = Queue()
+            reader = Process(target=read_devices, args=(read_profile, database.url, stop_event, results))
+            reader.start()
+            elapsed = timed(csv_importer.import_devices_data)
+            stop_event.set()
+            latencies, errors_count = results.get()
+            reader.join()
+
+        print('{0:<8} import: {1:>8.0f} rows/sec  reads: {2} p50 {3:.1f} ms  p99 {4:.1f} ms  max {5:.1f} ms  '
+              'errors {6}'.format(import_profile, args.rows / elapsed, len(latencies), get_percentile(latencies, 50),
+                                  get_percentile(latencies, 99), max(latencies or [0]), errors_count))
@@ -0,0 +1,182 @@
+# -*- coding: utf8 -*
+"""
+Import generated Device and DeviceContent CSV files end to end with every import mode and store rows/sec, peak RSS
+and query counts as JSON. With --baseline results are compared to earlier run and regressions fail the benchmark.
+
+    python benchmarks/bench_suite.py --rows 10000 100000 --output results.json
+    python benchmarks/bench_suite.py --rows 10000 100000 --baseline results.json --max-regression 0.2
+"""
+import argparse
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from multiprocessing import Process, Queue
+from common import BenchmarkDatabase
+from synthetic_data import DEFAULT_INVALID_SHARE, INVALID_KINDS, SyntheticData, parse_invalid_shares
+from CsvImporter.models.database import Session
+from CsvImporter.models.models import ImportRun
+from CsvImporter.utility.csv_importer import CsvImporter
+from CsvImporter.utility.query_counter import QueryCounter
+
+# scenario name: CsvImporter keyword arguments
+SCENARIOS = OrderedDict([
+    ('row_by_row', {}),
+    ('bulk', {'bulk_upsert': True}),
+    ('bulk_mmap', {'bulk_upsert': True, 'use_mmap': True}),
+    ('parallel', {'bulk_upsert': True, 'workers': 4}),
+])
+RUN_COUNTERS = ('rows_read', 'rows_inserted', 'rows_updated', 'rows_skipped_older', 'rows_skipped_unchanged',
+                'rows_rejected')
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def import_table(database, import_method):
+    """
+    :return: dict with seconds, rows/sec, query counts and counters of import run
+    """
+    with QueryCounter(database.engine) as query_counter:
+        start_time = time.time()
+        import_method()
+        seconds = time.time() - start_time
+    import_run = Session.query(ImportRun).order_by(ImportRun.id.desc()).first()
+    result = OrderedDict([
+        ('seconds', round(seconds, 3)),
+        ('rows_per_second', round(import_run.rows_read / seconds, 1) if seconds else None),
+        ('queries', query_counter.count),
+        ('queries_by_type', dict(query_counter.counts)),
+    ])
+    result.update((name, getattr(import_run, name)) for name in RUN_COUNTERS)
+    return result
+
+
+def run_scenario(data_path, importer_options, results):
+    """
+    Process function, imports both files into new database, so that peak RSS is measured for one scenario only.
+    :param results: Queue for result dict
+    """
+    with BenchmarkDatabase() as database:
+        csv_importer = CsvImporter(data_path, 'devices.csv', 'content.csv', u',', write_error_log=False,
+                                   **importer_options)
+        result = OrderedDict()
+        result['device'] = import_table(database, csv_importer.import_devices_data)
+        result['devicecontent'] = import_table(database, csv_importer.import_device_content_data)
+    result['peak_rss_mb'] = round(get_peak_rss_mb(), 1)
+    result['workers_peak_rss_mb'] = round(get_peak_rss_mb(resource.RUSAGE_CHILDREN), 1)
+    results.put(result)
+
+
+def run_benchmarks(rows_counts, scenario_names, content_ratio, invalid_shares, seed):
+    """
+    :return: list of result dicts
+    """
+    benchmark_results = []
+    for rows_count in rows_counts:
+        data_path = tempfile.mkdtemp(prefix='csv_importer_data_')
+        try:
+            synthetic_data = SyntheticData(rows_count, int(rows_count * content_ratio),
+                                           invalid_shares=invalid_shares, seed=seed)
+            invalid_counts = {'device': synthetic_data.write_devices('{0}/devices.csv'.format(data_path)),
+                              'devicecontent': synthetic_data.write_content('{0}/content.csv'.format(data_path))}
+            for scenario_name in scenario_names:
+                results = Queue()
+                process = Process(target=run_scenario, args=(data_path, SCENARIOS[scenario_name], results))
+                process.start()
+                result = results.get()
+                process.join()
+                result.update(rows=rows_count, scenario=scenario_name, invalid_rows=invalid_counts)
+                benchmark_results.append(result)
+                print('{0:>10} rows {1:<12} devices: {2:>9.0f} rows/sec  content: {3:>9.0f} rows/sec  '
+                      'peak RSS: {4:.1f} MB  queries: {5}'.format(
+                          rows_count, scenario_name, result['device']['rows_per_second'],
+                          result['devicecontent']['rows_per_second'], result['peak_rss_mb'],
+                          result['device']['queries'] + result['devicecontent']['queries']))
+        finally:
+            shutil.rmtree(data_path, ignore_errors=True)
+    return benchmark_results
+
+
+def get_regressions(results, baseline_results, max_regression):
+    """
+    :param results: list of result dicts
+    :param baseline_results: list of result dicts of earlier run
+    :param max_regression: float, allowed relative decrease of rows/sec and increase of peak RSS
+    :return: list of messages
+    """
+    baseline = dict(((result['rows'], result['scenario']), result) for result in baseline_results)
+    regressions = []
+    for result in results:
+        old_result = baseline.get((result['rows'], result['scenario']))
+        if not old_result:
+            continue
+        name = '{0} rows {1}'.format(result['rows'], result['scenario'])
+        for table_name in ('device', 'devicecontent'):
+            new_rate = result[table_name]['rows_per_second']
+            old_rate = old_result[table_name]['rows_per_second']
+            if new_rate and old_rate and new_rate < old_rate * (1 - max_regression):
+                regressions.append('{0} {1}: {2:.0f} rows/sec, was {3:.0f}'.format(
+                    name, table_name, new_rate, old_rate))
+            if result[table_name]['queries'] > old_result[table_name]['queries']:
+                regressions.append('{0} {1}: {2} queries, was {3}'.format(
+                    name, table_name, result[table_name]['queries'], old_result[table_name]['queries']))
+        if result['peak_rss_mb'] > old_result['peak_rss_mb'] * (1 + max_regression):
+            regressions.append('{0}: peak RSS {1:.1f} MB, was {2:.1f} MB'.format(
+                name, result['peak_rss_mb'], old_result['peak_rss_mb']))
+    return regressions
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                            help='numbers of Device rows, one benchmark run for each')
+    arg_parser.add_argument('--content-ratio', type=float, default=1.0,
+                            help='number of DeviceContent rows per Device row')
+    arg_parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS.keys(), default=list(SCENARIOS.keys()))
+    arg_parser.add_argument('--invalid', metavar='KIND=SHARE', action='append', default=[],
+                            help='share of invalid rows of kind: {0}'.format(', '.join(INVALID_KINDS)))
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('--output', metavar='FILE', help='write results as JSON')
+    arg_parser.add_argument('--baseline', metavar='FILE', help='compare results with JSON of earlier run')
+    arg_parser.add_argument('--max-regression', type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    invalid_shares = dict((kind, DEFAULT_INVALID_SHARE) for kind in INVALID_KINDS)
+    invalid_shares.update(parse_invalid_shares(args.invalid))
+    report = OrderedDict([
+        ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('revision', get_revision()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('options', {'content_ratio': args.content_ratio, 'invalid_shares': invalid_shares, 'seed': args.seed}),
+        ('results', run_benchmarks(args.rows, args.scenarios, args.content_ratio, invalid_shares, args.seed)),
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_report = json.load(f)
+        if baseline_report['options'] != report['options']:
+            print('Baseline was generated with different options: {0}'.format(baseline_report['options']))
+        regressions = get_regressions(report['results'], baseline_report['results'], args.max_regression)
+        for regression in regressions:
+            print('REGRESSION: {0}'.format(regression))
+        if regressions:
+            sys.exit(1)
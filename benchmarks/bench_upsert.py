@@ -0,0 +1,32 @@
+# -*- coding: utf8 -*
+"""
+Compare rows/sec of row by row import and bulk upsert import.
+
+    python benchmarks/bench_upsert.py --rows 20000
+"""
+import argparse
+from common import BenchmarkDatabase, write_devices_csv, write_content_csv, timed
+from CsvImporter.utility.csv_importer import CsvImporter, DEFAULT_BATCH_SIZE
+
+
+def run(rows_count, bulk_upsert, batch_size):
+    with BenchmarkDatabase() as database:
+        write_devices_csv(database.file_path('devices.csv'), rows_count)
+        write_content_csv(database.file_path('content.csv'), rows_count, rows_count)
+        csv_importer = CsvImporter(database.path, 'devices.csv', 'content.csv', u',',
+                                   bulk_upsert=bulk_upsert, batch_size=batch_size)
+        devices_time = timed(csv_importer.import_devices_data)
+        content_time = timed(csv_importer.import_device_content_data)
+    return rows_count / devices_time, rows_count / content_time
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--rows', type=int, default=20000)
+    arg_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = arg_parser.parse_args()
+
+    for bulk_upsert in (False, True):
+        devices_rate, content_rate = run(args.rows, bulk_upsert, args.batch_size)
+        print('{0:<12} devices: {1:>10.0f} rows/sec  content: {2:>10.0f} rows/sec'.format(
+            'bulk upsert' if bulk_upsert else 'row by row', devices_rate, content_rate))
@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from CsvImporter.models.database import Base, Session, create_profile_engine
+from CsvImporter.models import models
+from CsvImporter.utility.csv_importer import csv_error_logger
+
+STATUS_NAMES = ['enabled', 'disabled', 'deleted']
+
+
+class BenchmarkDatabase(object):
+    """
+    Temporary SQLite database and CSV store, Session is bound to it while benchmark runs.
+    """
+    def __init__(self, profile='default'):
+        self.path = tempfile.mkdtemp(prefix='csv_importer_bench_')
+        self.url = 'sqlite+pysqlite:///{0}/bench.db'.format(self.path)
+        self.profile = profile
+        self.engine = None
+
+    def __enter__(self):
+        self.engine = create_profile_engine(self.profile, self.url)
+        Base.metadata.create_all(bind=self.engine)
+        Session.remove()
+        Session.configure(bind=self.engine)
+        error_handler = logging.FileHandler(os.path.join(self.path, 'errors.log'))
+        self.logger_handlers = csv_error_logger.handlers
+        csv_error_logger.handlers = [error_handler]
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        csv_error_logger.handlers = self.logger_handlers
+        Session.remove()
+        self.engine.dispose()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def file_path(self, file_name):
+        return os.path.join(self.path, file_name)
+
+
+def write_devices_csv(file_path, rows_count, seed=1):
+    """
+    Write Device CSV rows, about a third of IDs repeat so updates are exercised too.
+    """
+    generator = random.Random(seed)
+    with open(file_path, 'w') as f:
+        for index in range(rows_count):
+            f.write('{0},"Machine {1}", "Machine {1} description",CODE{1}, '
+                    '2017-{2:02d}-{3:02d} 23:55:{4:02d}.333+01:00, {5}\n'.format(
+                        generator.randint(1, rows_count * 2 // 3 or 1), index, generator.randint(1, 12),
+                        generator.randint(1, 28), generator.randint(0, 59), generator.choice(STATUS_NAMES)))
+
+
+def write_content_csv(file_path, rows_count, devices_count, seed=1):
+    """
+    Write DeviceContent CSV rows referencing Device IDs from 1 to devices_count.
+    """
+    generator = random.Random(seed)
+    with open(file_path, 'w') as f:
+        for index in range(rows_count):
+            f.write('{0},"Content {1}", "Content {1} is a ", \t{2}, 2017-{3:02d}-{4:02d} 23:55:{5:02d}.333+01:00, '
+                    '{6}\n'.format(generator.randint(1, rows_count * 2 // 3 or 1), index,
+                                   generator.randint(1, devices_count), generator.randint(1, 12),
+                                   generator.randint(1, 28), generator.randint(0, 59),
+                                   generator.choice(STATUS_NAMES)))
+
+
+def timed(method):
+    start_time = time.time()
+    method()
+    return time.time() - start_time
@@ -0,0 +1,145 @@
+# -*- coding: utf8 -*
+"""
+Generate Device and DeviceContent CSV files of given size with given shares of invalid rows.
+
+    python benchmarks/synthetic_data.py /tmp/data --devices 1000000 --content 2000000 --invalid bad_date=0.05
+"""
+import argparse
+import os
+import random
+from common import STATUS_NAMES
+
+# kinds of invalid data, every generated row has at most one of them
+INVALID_KINDS = ('invalid_id', 'duplicate_code', 'bad_date', 'unknown_status', 'dangling_device')
+DEFAULT_INVALID_SHARE = 0.01
+INVALID_IDS = ['', 'x{0}', '-{0}', '{0}.5']
+BAD_DATES = ['', 'not a date', '2017-13-45 23:55:00', '2017-02-30 25:61:00.333+01:00']
+UNKNOWN_STATUSES = ['', 'unknown', 'ENABLED?', 'removed']
+
+
+def parse_invalid_shares(values):
+    """
+    :param values: list of strings 'kind=share'
+    :return: dict {kind: share}
+    """
+    invalid_shares = {}
+    for value in values:
+        kind, share = value.split('=', 1)
+        if kind not in INVALID_KINDS:
+            raise ValueError(u'Unknown kind of invalid data: {0}'.format(kind))
+        invalid_shares[kind] = float(share)
+    return invalid_shares
+
+
+class SyntheticData(object):
+    """
+    Generator of CSV files with realistic mix of rows. First rows of file have unique IDs, the rest repeat earlier
+    IDs with random expire dates, so both inserts and updates are imported. Rows are written one by one, so files
+    of tens of millions rows can be generated in constant memory, and the same seed always gives the same files.
+    """
+    def __init__(self, devices_count, content_count, repeated_share=1 / 3.0, invalid_shares=None, seed=1):
+        """
+        :param devices_count: integer, number of Device rows
+        :param content_count: integer, number of DeviceContent rows
+        :param repeated_share: float, share of rows repeating ID of earlier row
+        :param invalid_shares: dict {kind from INVALID_KINDS: share of rows}, DEFAULT_INVALID_SHARE of each by default
+        :param seed: integer
+        """
+        self.devices_count = devices_count
+        self.content_count = content_count
+        self.repeated_share = repeated_share
+        self.invalid_shares = dict((kind, DEFAULT_INVALID_SHARE) for kind in INVALID_KINDS)
+        self.invalid_shares.update(invalid_shares or {})
+        self.seed = seed
+
+    def get_unique_count(self, rows_count):
+        return max(1, int(rows_count * (1 - self.repeated_share)))
+
+    def get_invalid_kind(self, generator, kinds):
+        value = generator.random()
+        for kind in kinds:
+            value -= self.invalid_shares.get(kind, 0)
+            if value < 0:
+                return kind
+        return None
+
+    def get_row_id(self, generator, index, unique_count, invalid_kind):
+        row_id = index + 1 if index < unique_count else generator.randint(1, unique_count)
+        if invalid_kind == 'invalid_id':
+            return generator.choice(INVALID_IDS).format(row_id)
+        return str(row_id)
+
+    def get_expire_date(self, generator, invalid_kind):
+        if invalid_kind == 'bad_date':
+            return generator.choice(BAD_DATES)
+        return '{0}-{1:02d}-{2:02d} {3:02d}:{4:02d}:{5:02d}.333+01:00'.format(
+            generator.randint(2017, 2019), generator.randint(1, 12), generator.randint(1, 28),
+            generator.randint(0, 23), generator.randint(0, 59), generator.randint(0, 59))
+
+    def get_status(self, generator, invalid_kind):
+        if invalid_kind == 'unknown_status':
+            return generator.choice(UNKNOWN_STATUSES)
+        return generator.choice(STATUS_NAMES)
+
+    def write_devices(self, file_path):
+        """
+        :param file_path: string
+        :return: dict {kind: number of rows} of written invalid rows
+        """
+        generator = random.Random(self.seed)
+        unique_count = self.get_unique_count(self.devices_count)
+        kinds = ('invalid_id', 'duplicate_code', 'bad_date', 'unknown_status')
+        invalid_counts = dict((kind, 0) for kind in kinds)
+        with open(file_path, 'w') as f:
+            for index in range(self.devices_count):
+                invalid_kind = self.get_invalid_kind(generator, kinds)
+                if invalid_kind:
+                    invalid_counts[invalid_kind] += 1
+                code_index = generator.randint(0, index - 1) if invalid_kind == 'duplicate_code' and index else index
+                f.write('{0},"Machine {1}","Machine {1} description",CODE{2},{3},{4}\n'.format(
+                    self.get_row_id(generator, index, unique_count, invalid_kind), index, code_index,
+                    self.get_expire_date(generator, invalid_kind), self.get_status(generator, invalid_kind)))
+        return invalid_counts
+
+    def write_content(self, file_path):
+        """
+        Valid rows reference Device IDs written by write_devices, dangling rows reference IDs above them.
+        :param file_path: string
+        :return: dict {kind: number of rows} of written invalid rows
+        """
+        generator = random.Random(self.seed + 1)
+        unique_count = self.get_unique_count(self.content_count)
+        devices_unique_count = self.get_unique_count(self.devices_count)
+        kinds = ('invalid_id', 'bad_date', 'unknown_status', 'dangling_device')
+        invalid_counts = dict((kind, 0) for kind in kinds)
+        with open(file_path, 'w') as f:
+            for index in range(self.content_count):
+                invalid_kind = self.get_invalid_kind(generator, kinds)
+                if invalid_kind:
+                    invalid_counts[invalid_kind] += 1
+                device_id = generator.randint(1, devices_unique_count)
+                if invalid_kind == 'dangling_device':
+                    device_id += devices_unique_count
+                f.write('{0},"Content {1}","Content {1} description",{2},{3},{4}\n'.format(
+                    self.get_row_id(generator, index, unique_count, invalid_kind), index, device_id,
+                    self.get_expire_date(generator, invalid_kind), self.get_status(generator, invalid_kind)))
+        return invalid_counts
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('directory')
+    arg_parser.add_argument('--devices', type=int, default=10000)
+    arg_parser.add_argument('--content', type=int, default=10000)
+    arg_parser.add_argument('--repeated-share', type=float, default=1 / 3.0)
+    arg_parser.add_argument('--invalid', metavar='KIND=SHARE', action='append', default=[],
+                            help='share of invalid rows of kind: {0}'.format(', '.join(INVALID_KINDS)))
+    arg_parser.add_argument('--seed', type=int, default=1)
+    args = arg_parser.parse_args()
+
+    synthetic_data = SyntheticData(args.devices, args.content, args.repeated_share,
+                                   parse_invalid_shares(args.invalid), args.seed)
+    print('devices.csv invalid rows: {0}'.format(
+        synthetic_data.write_devices(os.path.join(args.directory, 'devices.csv'))))
+    print('content.csv invalid rows: {0}'.format(
+        synthetic_data.write_content(os.path.join(args.directory, 'content.csv'))))
@@ -0,0 +1,70 @@
+# -*- coding: utf8 -*
+"""
+Check that rows parsed from byte ranges of file are the same as rows parsed sequentially.
+
+    python -m unittest discover tests
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from CsvImporter.utility.csv_importer import ChunkRowParser, CsvImporter
+from CsvImporter.utility.mmap_reader import MmapCsvReader
+from CsvImporter.utility.parallel_import import get_chunk_ranges, parse_chunk
+from CsvImporter.utility.source_readers import CsvSourceReader
+
+# small ranges, so that many records with quoted line breaks cross them
+CHUNK_BYTES = 97
+
+
+def write_devices_file(file_path, rows_count, seed):
+    """
+    Write devices file whose descriptions often contain quoted line breaks and quotes.
+    """
+    generator = random.Random(seed)
+    with open(file_path, 'w') as devices_file:
+        for row_number in range(rows_count):
+            line_breaks = '\nline ""{0}""\n'.format(row_number) * generator.choice([0, 0, 1, 3])
+            description = '"description {0}{1}"'.format(row_number, line_breaks)
+            devices_file.write('{0},"Device {0}",{1},CODE{0}, 2017-{2:02d}-02 23:55:00, enabled\n'.format(
+                row_number, description, generator.randint(1, 12)))
+
+
+class ParallelImportTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='csv_importer_test_')
+        self.file_path = os.path.join(self.path, 'devices.csv')
+        write_devices_file(self.file_path, 300, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def get_sequential_rows(self):
+        row_parser = ChunkRowParser()
+        with open(self.file_path, 'rb') as f:
+            rows = list(row_parser.read_source_lines(CsvSourceReader(','), f))
+        return [row_parser.parse_device_row(row, row_number) for row_number, row in enumerate(rows, start=1)]
+
+    def get_chunk_rows(self, source_reader):
+        chunk_ranges = get_chunk_ranges(self.file_path, chunk_bytes=CHUNK_BYTES)
+        tasks = [(ChunkRowParser, 'parse_device_row', self.file_path, source_reader, start, end)
+                 for start, end in chunk_ranges]
+        chunk_results = CsvImporter(write_error_log=False).get_aligned_chunk_results(
+            self.file_path, source_reader, 'parse_device_row', 0, chunk_ranges, (parse_chunk(task) for task in tasks))
+        rows = []
+        for rows_count, parsed_rows, row_errors, timings, read_failed in chunk_results:
+            self.assertFalse(read_failed)
+            self.assertEqual(rows_count, len(parsed_rows))
+            rows.extend(parsed_row for row_number, parsed_row in parsed_rows)
+        return rows
+
+    def test_quoted_line_breaks(self):
+        sequential_rows = self.get_sequential_rows()
+        self.assertEqual(len(sequential_rows), 300)
+        self.assertEqual(self.get_chunk_rows(CsvSourceReader(',')), sequential_rows)
+        self.assertEqual(self.get_chunk_rows(MmapCsvReader(',')), sequential_rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf8 -*
+"""
+Check that staged import stores the same Device and DeviceContent rows as row by row import.
+
+    python -m unittest discover tests
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from CsvImporter.models.database import Base, Session
+from CsvImporter.utility.csv_importer import CsvImporter
+
+STATUS_NAMES = ['enabled', 'disabled', 'deleted', 'unknown']
+DEVICE_COLUMNS = 'id, name, description, code, expire_date, status, fingerprint'
+DEVICE_CONTENT_COLUMNS = 'id, name, description, device_id, expire_date, status, fingerprint'
+# small batches, so that duplicate codes are checked across many chunks
+BATCH_SIZE = 50
+
+
+def write_csv_files(path, rows_count, seed):
+    """
+    Write devices.csv and content.csv with repeated IDs, older rows, duplicate codes and invalid fields.
+    :param path: string, directory of files
+    :param rows_count: integer, number of rows of each file
+    :param seed: integer
+    """
+    generator = random.Random(seed)
+    with open(os.path.join(path, 'devices.csv'), 'w') as devices_file:
+        for row_number in range(rows_count):
+            expire_date = '2017-{0:02d}-02 23:55:{1:02d}.333+01:00'.format(
+                generator.randint(1, 12), generator.randint(0, 65))
+            devices_file.write('{0},"Device {1}", "description {1}",CODE{2}, {3}, {4}\n'.format(
+                generator.randint(1, rows_count // 2), row_number, generator.randint(1, rows_count // 2),
+                expire_date, generator.choice(STATUS_NAMES)))
+    with open(os.path.join(path, 'content.csv'), 'w') as content_file:
+        for row_number in range(rows_count):
+            expire_date = '2017-{0:02d}-02 23:55:{1:02d}.333'.format(generator.randint(1, 12), generator.randint(0, 59))
+            content_file.write('{0},"Content {1}", "description, {1}", {2}, {3}, {4}\n'.format(
+                generator.randint(1, rows_count), row_number, generator.randint(1, rows_count), expire_date,
+                generator.choice(STATUS_NAMES)))
+
+
+class StagedImportTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='csv_importer_test_')
+        self.engines = {}
+        for name in ('rows', 'staged'):
+            self.engines[name] = create_engine('sqlite:///{0}'.format(os.path.join(self.path, name + '.db')))
+            Base.metadata.create_all(bind=self.engines[name])
+
+    def tearDown(self):
+        Session.remove()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def import_files(self, name, **kwargs):
+        Session.remove()
+        Session.configure(bind=self.engines[name])
+        csv_importer = CsvImporter(self.path, 'devices.csv', 'content.csv', u',', batch_size=BATCH_SIZE,
+                                   write_error_log=False, **kwargs)
+        if name == 'staged':
+            csv_importer.import_staged()
+        else:
+            csv_importer.import_devices_data()
+            csv_importer.import_device_content_data()
+
+    def get_rows(self, name, table_name, columns):
+        return self.engines[name].execute('SELECT {0} FROM {1} ORDER BY id'.format(columns, table_name)).fetchall()
+
+    def assert_same_tables(self):
+        for table_name, columns in (('device', DEVICE_COLUMNS), ('devicecontent', DEVICE_CONTENT_COLUMNS)):
+            self.assertEqual(self.get_rows('rows', table_name, columns), self.get_rows('staged', table_name, columns))
+
+    def test_same_tables(self):
+        # second file is imported on top of stored rows of the first one
+        for seed in (1, 2):
+            write_csv_files(self.path, 1000, seed)
+            self.import_files('rows')
+            self.import_files('staged')
+            self.assert_same_tables()
+
+    def test_same_tables_parallel(self):
+        write_csv_files(self.path, 1000, 3)
+        self.import_files('rows')
+        self.import_files('staged', workers=3)
+        self.assert_same_tables()
+
+
+if __name__ == '__main__':
+    unittest.main()